@@ -6,24 +6,76 @@ HOW: Import this module and run with uvicorn or `python main.py <command>`.
 Closes: #2 and #32.
 """
 
-from fastapi import FastAPI, Depends, HTTPException, Header, status
-from fastapi.responses import FileResponse, HTMLResponse
+from fastapi import (
+    BackgroundTasks,
+    FastAPI,
+    Depends,
+    HTTPException,
+    Header,
+    Query,
+    Request,
+    Response,
+    status,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import (
+    FileResponse,
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
+from fastapi.routing import APIRoute
 from fastapi.staticfiles import StaticFiles
-from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from fastapi.security import (
+    HTTPBasic,
+    HTTPBasicCredentials,
+    HTTPBearer,
+    HTTPAuthorizationCredentials,
+)
 import uvicorn
 
 import os
+import asyncio
 import sqlite3
 import hashlib
+import hmac
+import base64
+import json
+import time
+import threading
 import secrets
 import re
+import csv
+import io
+import tempfile
+import random
+import queue
+import sys
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Generic, TypeVar
 from pathlib import Path
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from operator import attrgetter
 
 from sqlalchemy import (
     create_engine,
     func,
     and_,
+    or_,
+    select,
+    tuple_,
+    bindparam,
+    event,
+    literal,
     Column,
     String,
     DECIMAL,
@@ -32,16 +84,132 @@ from sqlalchemy import (
     ForeignKey,
     TIMESTAMP,
 )
-from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.dialects import postgresql, sqlite as sqlite_dialect
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base, aliased
 
 from pydantic import BaseModel
+import numpy as np
 
 # --- Database setup ---
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./arivu_foods_inventory.db")
-engine = create_engine(DATABASE_URL, echo=True)
+# WHY: echo=True and default SQLite settings (rollback journal, FULL sync,
+#      small cache) log every statement and make dashboard reads and sale
+#      writes block each other
+# WHAT: named engine profiles setting journal mode, sync level, cache, mmap,
+#       busy timeout, pool size and echo
+# HOW: choose with DB_PROFILE (dev, prod, bulk-load); DB_ECHO=1 forces SQL
+#      logging on. Pragmas only apply to SQLite URLs
+ENGINE_PROFILES = {
+    "dev": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,  # negative values are KiB
+        "mmap_size": 0,
+        "busy_timeout": 5000,
+        "pool_size": 5,
+        "max_overflow": 10,
+        "echo": False,
+    },
+    "prod": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,
+        "mmap_size": 256 * 1024 * 1024,
+        "busy_timeout": 5000,
+        "pool_size": 20,
+        "max_overflow": 20,
+        "echo": False,
+    },
+    # one-off imports: no fsync per commit, large cache; do not serve traffic
+    "bulk-load": {
+        "journal_mode": "WAL",
+        "synchronous": "OFF",
+        "cache_size": -256000,
+        "mmap_size": 1024 * 1024 * 1024,
+        "busy_timeout": 30000,
+        "pool_size": 2,
+        "max_overflow": 0,
+        "echo": False,
+    },
+}
+DB_PROFILE = os.getenv("DB_PROFILE", "dev")
+if DB_PROFILE not in ENGINE_PROFILES:
+    raise RuntimeError(
+        f"Unknown DB_PROFILE {DB_PROFILE!r}; choose one of {', '.join(ENGINE_PROFILES)}"
+    )
+engine_profile = ENGINE_PROFILES[DB_PROFILE]
+
+
+def _pool_kwargs(url: str, profile: dict) -> dict:
+    db_url = make_url(url)
+    if db_url.get_backend_name() == "sqlite" and db_url.database in (
+        None,
+        "",
+        ":memory:",
+    ):
+        return {}
+    return {"pool_size": profile["pool_size"], "max_overflow": profile["max_overflow"]}
+
+
+def _install_sqlite_pragmas(sync_engine, profile: dict) -> None:
+    @event.listens_for(sync_engine, "connect")
+    def _apply_sqlite_pragmas(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        for pragma in ("journal_mode", "synchronous", "cache_size", "mmap_size"):
+            cursor.execute(f"PRAGMA {pragma}={profile[pragma]}")
+        cursor.execute(f"PRAGMA busy_timeout={int(profile['busy_timeout'])}")
+        cursor.close()
+
+
+def _echo(profile: dict) -> bool:
+    return os.getenv("DB_ECHO", "1" if profile["echo"] else "0") == "1"
+
+
+def build_engine(url: str = DATABASE_URL, profile: dict = engine_profile):
+    """Create an engine configured by ``profile``."""
+    new_engine = create_engine(url, echo=_echo(profile), **_pool_kwargs(url, profile))
+    if new_engine.dialect.name == "sqlite":
+        _install_sqlite_pragmas(new_engine, profile)
+    return new_engine
+
+
+engine = build_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+# WHY: sync endpoints hold a threadpool slot for the whole query, so polling
+#      dashboards starve write requests
+# WHAT: async engine/session for read-heavy routes; they reuse the sync service
+#       functions through AsyncSession.run_sync so the CLI keeps working
+# HOW: ASYNC_DATABASE_URL overrides the driver derived from DATABASE_URL
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def _async_url(url: str) -> str:
+    db_url = make_url(url)
+    driver = ASYNC_DRIVERS.get(db_url.get_backend_name())
+    return (
+        db_url.set(drivername=driver).render_as_string(hide_password=False)
+        if driver
+        else url
+    )
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=_echo(engine_profile),
+    **_pool_kwargs(ASYNC_DATABASE_URL, engine_profile),
+)
+if async_engine.dialect.name == "sqlite":
+    _install_sqlite_pragmas(async_engine.sync_engine, engine_profile)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
+
 
 def get_db():
     db = SessionLocal()
@@ -51,6 +219,11 @@ def get_db():
         db.close()
 
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 # --- ORM models ---
 class Product(Base):
     __tablename__ = "products"
@@ -175,13 +348,261 @@ class User(Base):
     store_id = Column(String(50), ForeignKey("locations.location_id"))
 
 
-# Create tables if not already present (initial migration)
+class StockSnapshotPeriod(Base):
+    """Dates for which a stock snapshot has been taken."""
+
+    __tablename__ = "stock_snapshot_periods"
+    snapshot_date = Column(Date, primary_key=True)
+    created_at = Column(TIMESTAMP)
+
+
+class StockSnapshot(Base):
+    """Units per product, batch and location at the end of a snapshot date."""
+
+    __tablename__ = "stock_snapshots"
+    snapshot_date = Column(
+        Date, ForeignKey("stock_snapshot_periods.snapshot_date"), primary_key=True
+    )
+    product_id = Column(String(50), ForeignKey("products.product_id"), primary_key=True)
+    batch_id = Column(String(50), ForeignKey("batches.batch_id"), primary_key=True)
+    location_id = Column(
+        String(50), ForeignKey("locations.location_id"), primary_key=True
+    )
+    quantity = Column(Integer, nullable=False)
+
+
+class ExpiryCalendar(Base):
+    """Units on hand per batch, product and location keyed by batch expiry.
+
+    Derived from ``current_stock`` and kept in step by the stock write paths;
+    only rows with stock and a known expiry date are present.
+    """
+
+    __tablename__ = "expiry_calendar"
+    batch_id = Column(String(50), ForeignKey("batches.batch_id"), primary_key=True)
+    product_id = Column(String(50), ForeignKey("products.product_id"), primary_key=True)
+    location_id = Column(
+        String(50), ForeignKey("locations.location_id"), primary_key=True
+    )
+    expiry_date = Column(Date, nullable=False)
+    quantity = Column(Integer, nullable=False)
+
+
+class ReorderThreshold(Base):
+    """Units of a product a store should hold before a low-stock alert."""
+
+    __tablename__ = "reorder_thresholds"
+    store_id = Column(
+        String(50), ForeignKey("retail_partners.store_id"), primary_key=True
+    )
+    product_id = Column(String(50), ForeignKey("products.product_id"), primary_key=True)
+    min_quantity = Column(Integer, nullable=False)
+
+
+class StockAlert(Base):
+    """Low-stock and expiry alerts raised by the stock write paths."""
+
+    __tablename__ = "stock_alerts"
+    alert_id = Column(Integer, primary_key=True, autoincrement=True)
+    alert_type = Column(String(20), nullable=False)
+    store_id = Column(String(50), ForeignKey("retail_partners.store_id"))
+    location_id = Column(
+        String(50), ForeignKey("locations.location_id"), nullable=False
+    )
+    product_id = Column(String(50), ForeignKey("products.product_id"), nullable=False)
+    batch_id = Column(String(50), ForeignKey("batches.batch_id"))
+    quantity = Column(Integer, nullable=False)
+    threshold = Column(Integer)
+    expiry_date = Column(Date)
+    created_at = Column(TIMESTAMP, nullable=False)
+    acknowledged_at = Column(TIMESTAMP)
+    acknowledged_by = Column(String(255))
+    resolved_at = Column(TIMESTAMP)
+
+
+class TableVersion(Base):
+    """Change counter per table, bumped by every commit that writes to it."""
+
+    __tablename__ = "table_versions"
+    table_name = Column(String(100), primary_key=True)
+    version = Column(Integer, nullable=False)
+
+
+class SchemaMigration(Base):
+    """Versions applied by the migration runner."""
+
+    __tablename__ = "schema_migrations"
+    version = Column(Integer, primary_key=True)
+    name = Column(String(255), nullable=False)
+    applied_at = Column(TIMESTAMP)
+
+
+# --- Schema migrations ---
+# WHY: create_all only creates missing tables; it cannot add indexes or evolve
+#      an existing database
+# WHAT: ordered, versioned DDL steps recorded in schema_migrations; secondary
+#       indexes are defined here rather than on the ORM models
+# HOW: append a new (version, name, statements) entry; never edit an applied
+#      one. Pending steps run at startup and via `python main.py migrate`
+TABLE_VERSION_EPOCH = "_epoch"
+
+# Re-derive expiry_calendar from current_stock (migration 2, data generator)
+EXPIRY_CALENDAR_REBUILD = [
+    "DELETE FROM expiry_calendar",
+    "INSERT INTO expiry_calendar "
+    "(batch_id, product_id, location_id, expiry_date, quantity) "
+    "SELECT cs.batch_id, cs.product_id, cs.location_id, b.expiry_date, "
+    "cs.quantity FROM current_stock cs "
+    "JOIN batches b ON b.batch_id = cs.batch_id "
+    "WHERE cs.quantity > 0 AND b.expiry_date IS NOT NULL",
+]
+
+MIGRATIONS: list[tuple[int, str, list[str]]] = [
+    (
+        1,
+        "hot-path secondary indexes",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_current_stock_location "
+            "ON current_stock (location_id)",
+            "CREATE INDEX IF NOT EXISTS ix_current_stock_batch "
+            "ON current_stock (batch_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS ux_current_stock_product_batch_location "
+            "ON current_stock (product_id, batch_id, location_id)",
+            "CREATE INDEX IF NOT EXISTS ix_stock_movements_date "
+            "ON stock_movements (movement_date, movement_id)",
+            "CREATE INDEX IF NOT EXISTS ix_stock_movements_destination "
+            "ON stock_movements (destination_location_id, movement_date)",
+            "CREATE INDEX IF NOT EXISTS ix_stock_movements_source "
+            "ON stock_movements (source_location_id, movement_date)",
+            "CREATE INDEX IF NOT EXISTS ix_stock_movements_product "
+            "ON stock_movements (product_id, movement_date)",
+            "CREATE INDEX IF NOT EXISTS ix_stock_movements_batch "
+            "ON stock_movements (batch_id, movement_date)",
+            "CREATE INDEX IF NOT EXISTS ix_retail_sales_store_date "
+            "ON retail_sales (store_id, sale_date)",
+            "CREATE INDEX IF NOT EXISTS ix_retail_sales_date "
+            "ON retail_sales (sale_date, sale_id)",
+            "CREATE INDEX IF NOT EXISTS ix_retail_sales_product "
+            "ON retail_sales (product_id, sale_date)",
+            "CREATE INDEX IF NOT EXISTS ix_retail_sales_batch "
+            "ON retail_sales (batch_id, sale_date)",
+            "CREATE INDEX IF NOT EXISTS ix_batches_expiry ON batches (expiry_date)",
+            "CREATE INDEX IF NOT EXISTS ix_batches_manufactured "
+            "ON batches (date_manufactured, batch_id)",
+            "CREATE INDEX IF NOT EXISTS ix_batch_products_batch "
+            "ON batch_products (batch_id)",
+            "CREATE INDEX IF NOT EXISTS ix_retail_partners_location "
+            "ON retail_partners (location_id)",
+            "CREATE INDEX IF NOT EXISTS ix_locations_type "
+            "ON locations (location_type)",
+        ],
+    ),
+    (
+        2,
+        "expiry calendar",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_expiry_calendar_date "
+            "ON expiry_calendar (expiry_date, batch_id, product_id, quantity)",
+            *EXPIRY_CALENDAR_REBUILD,
+        ],
+    ),
+    (
+        3,
+        "stock alerts",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_stock_alerts_location_product "
+            "ON stock_alerts (location_id, product_id)",
+            "CREATE INDEX IF NOT EXISTS ix_stock_alerts_store "
+            "ON stock_alerts (store_id, alert_id)",
+            "CREATE INDEX IF NOT EXISTS ix_stock_alerts_active "
+            "ON stock_alerts (resolved_at, alert_id)",
+        ],
+    ),
+    (
+        4,
+        "fefo allocation index",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_expiry_calendar_fefo "
+            "ON expiry_calendar (location_id, product_id, expiry_date, batch_id, "
+            "quantity)",
+        ],
+    ),
+    (
+        6,
+        "on-hand stock per location index",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_current_stock_location_on_hand "
+            "ON current_stock (location_id, quantity, batch_id)",
+        ],
+    ),
+    (
+        5,
+        "table version epoch",
+        [
+            # random per database, so ETags from a recreated database never match
+            "INSERT INTO table_versions (table_name, version) "
+            f"VALUES ('{TABLE_VERSION_EPOCH}', {secrets.randbelow(2**31)})",
+        ],
+    ),
+]
+
+
+def get_applied_migrations(bind=None) -> set[int]:
+    with Session(bind=bind or engine) as db:
+        return {v for (v,) in db.query(SchemaMigration.version)}
+
+
+def run_migrations(bind=None, target: int | None = None) -> list[int]:
+    """Apply pending migrations up to ``target``; return versions applied.
+
+    Each version runs in its own transaction together with its
+    schema_migrations row, so a failing step leaves earlier ones in place.
+    """
+    bind = bind or engine
+    applied = get_applied_migrations(bind)
+    done = []
+    for version, name, statements in MIGRATIONS:
+        if version in applied or (target is not None and version > target):
+            continue
+        with bind.begin() as conn:
+            for stmt in statements:
+                conn.exec_driver_sql(stmt)
+            conn.execute(
+                SchemaMigration.__table__.insert().values(
+                    version=version, name=name, applied_at=datetime.now()
+                )
+            )
+        done.append(version)
+    return done
+
+
+# Create tables if not already present (initial migration), then apply any
+# pending versioned migrations
 Base.metadata.create_all(bind=engine)
+run_migrations()
 
 
 # --- Authentication helpers ---
 API_KEY = os.getenv("API_KEY", "changeme")
-security = HTTPBasic()
+# WHY: dashboards make 8+ API calls per page; re-checking the users table and
+#      re-hashing the password on each one is wasted work
+# WHAT: /login issues HMAC-signed, expiring session tokens carrying role and
+#       store_id; HTTP Basic remains as a fallback for scripts
+# HOW: set SESSION_SECRET so tokens survive restarts and are shared between
+#      workers; SESSION_TTL_SECONDS controls lifetime
+SESSION_SECRET = os.getenv("SESSION_SECRET") or secrets.token_hex(32)
+SESSION_TTL_SECONDS = int(os.getenv("SESSION_TTL_SECONDS", "43200"))
+REVOKED_TOKENS_MAX = 10000
+security = HTTPBasic(auto_error=False)
+bearer_security = HTTPBearer(auto_error=False)
+
+
+class AuthUser(BaseModel):
+    """Authenticated principal resolved from a session token or Basic auth."""
+
+    username: str
+    role: str
+    store_id: str | None = None
 
 
 def verify_api_key(x_api_key: str = Header(...)):
@@ -192,20 +613,688 @@ def verify_api_key(x_api_key: str = Header(...)):
         )
 
 
-def verify_basic_auth(
-    credentials: HTTPBasicCredentials = Depends(security),
-    db: Session = Depends(get_db),
-):
-    """Validate username/password against users table."""
-    user = db.query(User).filter(User.username == credentials.username).first()
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload: str) -> str:
+    digest = hmac.new(SESSION_SECRET.encode(), payload.encode(), hashlib.sha256)
+    return _b64encode(digest.digest())
+
+
+# Revoked token ids mapped to their expiry so entries can be pruned once the
+# token would have expired anyway; bounded by REVOKED_TOKENS_MAX. A live entry
+# is never dropped early, since that would silently un-revoke its token
+_revoked_tokens: dict[str, float] = {}
+_revoked_lock = threading.Lock()
+
+
+class RevocationListFullError(Exception):
+    """The denylist holds REVOKED_TOKENS_MAX unexpired tokens."""
+
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        super().__init__(
+            f"Revocation list full; retry in {retry_after}s when an entry expires"
+        )
+
+
+def issue_session_token(user, ttl: int | None = None) -> tuple[str, int]:
+    """Return a signed token for ``user`` and its lifetime in seconds."""
+    ttl = ttl or SESSION_TTL_SECONDS
+    claims = {
+        "sub": user.username,
+        "role": user.role,
+        "store_id": user.store_id,
+        "exp": int(time.time()) + ttl,
+        "jti": secrets.token_urlsafe(12),
+    }
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{payload}.{_sign(payload)}", ttl
+
+
+def decode_session_token(token: str) -> dict | None:
+    """Return token claims if signature, expiry and denylist checks pass."""
+    payload, _, signature = token.partition(".")
+    if not signature or not hmac.compare_digest(signature, _sign(payload)):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+    except ValueError:
+        return None
+    if claims.get("exp", 0) < time.time() or claims.get("jti") in _revoked_tokens:
+        return None
+    return claims
+
+
+def revoke_session_token(token: str) -> bool:
+    """Add a valid token to the in-memory denylist.
+
+    Only expired entries are pruned to make room; raises
+    RevocationListFullError if the list is still full.
+    """
+    claims = decode_session_token(token)
+    if not claims:
+        return False
+    now = time.time()
+    with _revoked_lock:
+        if len(_revoked_tokens) >= REVOKED_TOKENS_MAX:
+            for jti in [j for j, exp in _revoked_tokens.items() if exp < now]:
+                del _revoked_tokens[jti]
+        if len(_revoked_tokens) >= REVOKED_TOKENS_MAX:
+            soonest = min(_revoked_tokens.values())
+            raise RevocationListFullError(int(soonest - now) + 1)
+        _revoked_tokens[claims["jti"]] = claims["exp"]
+    return True
+
+
+def verify_basic_auth(credentials: HTTPBasicCredentials, db: Session) -> "UserRef":
+    """Validate username/password against the (cached) users table."""
+    user = get_user_ref(db, credentials.username)
     hashed = hashlib.sha256(credentials.password.encode()).hexdigest()
     if not user or not secrets.compare_digest(user.password, hashed):
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials"
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid credentials",
+            headers={"WWW-Authenticate": "Basic"},
         )
     return user
 
 
+async def verify_auth(
+    bearer: HTTPAuthorizationCredentials | None = Depends(bearer_security),
+    basic: HTTPBasicCredentials | None = Depends(security),
+) -> AuthUser:
+    """Accept a Bearer session token without DB work, else fall back to Basic."""
+    if bearer:
+        claims = decode_session_token(bearer.credentials)
+        if not claims:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid or expired token",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return AuthUser(
+            username=claims["sub"], role=claims["role"], store_id=claims["store_id"]
+        )
+    if basic:
+        async with AsyncSessionLocal() as db:
+            user = await db.run_sync(lambda session: verify_basic_auth(basic, session))
+            return AuthUser(
+                username=user.username, role=user.role, store_id=user.store_id
+            )
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Not authenticated",
+        headers={"WWW-Authenticate": "Basic"},
+    )
+
+
+# --- Pagination helpers ---
+# WHY: list endpoints over growing tables must not load everything at once
+# WHAT: opaque keyset cursors encoding the sort key of the last row returned
+# HOW: paginated endpoints return the next cursor in the X-Next-Cursor header;
+#      clients pass it back as ?cursor=
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(*values) -> str:
+    return _b64encode(json.dumps(values, default=str, separators=(",", ":")).encode())
+
+
+def decode_cursor(cursor: str) -> list:
+    try:
+        values = json.loads(_b64decode(cursor))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+# --- Response serialization ---
+# WHY: large list payloads spend most of their time encoding JSON
+# WHAT: orjson-backed default response class (stdlib json when orjson is not
+#       installed) and an opt-in columnar layout with one array per field
+# HOW: list endpoints build rows as tuples and return rows_response();
+#      clients pass ?format=columnar to receive {field: [values, ...]}
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps_json(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(
+            content, default=_json_default, option=orjson.OPT_NON_STR_KEYS
+        )
+    return json.dumps(
+        content,
+        default=_json_default,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson when available."""
+
+    def render(self, content) -> bytes:
+        return dumps_json(content)
+
+
+# Bodies smaller than this are sent uncompressed
+GZIP_MIN_BYTES = int(os.getenv("GZIP_MIN_BYTES", "1024"))
+
+
+def response_format(format: str = Query("rows", pattern="^(rows|columnar)$")) -> str:
+    return format
+
+
+def rows_response(
+    response: Response, fields: tuple[str, ...], rows, fmt: str = "rows"
+) -> FastJSONResponse:
+    """Serialize ``rows`` (tuples ordered like ``fields``) in layout ``fmt``.
+
+    Headers already set on the injected ``response`` (ETag, cursor) are kept.
+    """
+    rows = list(rows)
+    if fmt == "columnar":
+        columns = zip(*rows) if rows else [()] * len(fields)
+        content = {field: list(column) for field, column in zip(fields, columns)}
+    else:
+        content = [dict(zip(fields, row)) for row in rows]
+    out = FastJSONResponse(content)
+    out.raw_headers.extend(
+        (key, value) for key, value in response.raw_headers if key != b"content-length"
+    )
+    return out
+
+
+# --- Change tracking ---
+# WHY: derived results (heatmap, reference lists) can be reused until the
+#      tables they read change
+# WHAT: two kinds of version counters. Per-process counters bumped by service
+#       functions after commit give this worker instant invalidation (the
+#       reference caches use them, with a TTL for other processes). Stored
+#       counters in table_versions are bumped inside every session commit
+#       for the tables its INSERT/UPDATE/DELETE statements touched, so they
+#       also see other workers and CLI commands; ETags and shared caches key
+#       on those
+# HOW: table_versions() for the in-process counters,
+#      stored_table_versions(db, ...) for the database ones
+_table_versions: dict[str, int] = {}
+_table_versions_lock = threading.Lock()
+# Written by schema tooling only, or by the version bump itself
+UNVERSIONED_TABLES = {"table_versions", "schema_migrations"}
+
+
+def bump_table_versions(*tables: str) -> None:
+    with _table_versions_lock:
+        for table in tables:
+            _table_versions[table] = _table_versions.get(table, 0) + 1
+    invalidate_reference_caches(*tables)
+
+
+def table_versions(*tables: str) -> tuple[int, ...]:
+    return tuple(_table_versions.get(table, 0) for table in tables)
+
+
+def stored_table_versions(db: Session, *tables: str) -> tuple[int, ...]:
+    """Database epoch followed by the stored version of each table."""
+    names = (TABLE_VERSION_EPOCH, *tables)
+    versions = dict(
+        db.execute(
+            select(TableVersion.table_name, TableVersion.version).where(
+                TableVersion.table_name.in_(names)
+            )
+        ).all()
+    )
+    return tuple(versions.get(name, 0) for name in names)
+
+
+def _record_written_table(conn, cursor, statement, parameters, context, executemany):
+    if not (context.isinsert or context.isupdate or context.isdelete):
+        return
+    table = getattr(getattr(context.compiled, "statement", None), "table", None)
+    if table is not None and table.name not in UNVERSIONED_TABLES:
+        conn.info.setdefault("written_tables", set()).add(table.name)
+
+
+def _forget_written_tables(conn) -> None:
+    conn.info.pop("written_tables", None)
+
+
+def _bump_stored_versions(session: Session) -> None:
+    # before_commit runs ahead of the final flush; flush now so its tables
+    # are recorded and bumped in this same transaction
+    session.flush()
+    conn = session.connection()
+    tables = conn.info.pop("written_tables", None)
+    if not tables:
+        return
+    table = TableVersion.__table__
+    rows = [{"table_name": name, "version": 1} for name in sorted(tables)]
+    upsert = _UPSERT_INSERTS.get(conn.dialect.name)
+    if upsert:
+        stmt = upsert(table)
+        conn.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["table_name"],
+                set_={"version": table.c.version + 1},
+            ),
+            rows,
+        )
+        return
+    for row in rows:
+        bumped = conn.execute(
+            table.update()
+            .where(table.c.table_name == row["table_name"])
+            .values(version=table.c.version + 1)
+        )
+        if bumped.rowcount == 0:
+            conn.execute(table.insert().values(**row))
+
+
+for _engine in (engine, async_engine.sync_engine):
+    event.listen(_engine, "after_cursor_execute", _record_written_table)
+    # commits outside a Session (migrations, gen-data) and rollbacks must not
+    # leak their tables into the next transaction on this connection
+    event.listen(_engine, "commit", _forget_written_tables)
+    event.listen(_engine, "rollback", _forget_written_tables)
+event.listen(Session, "before_commit", _bump_stored_versions)
+
+
+# WHY: reference lists rarely change but every dashboard load re-queries and
+#      re-serializes them
+# WHAT: strong ETags built from the stored versions of the tables a GET
+#       reads (one primary-key lookup); If-None-Match matches are answered
+#       with 304 before any other DB work. ``daily=True`` adds today's date
+#       for responses that also depend on it
+# HOW: add conditional_get(<tables>) to a route's dependencies after auth_dep;
+#      async routes use async_conditional_get so the check shares their
+#      AsyncSession instead of taking a threadpool slot and a sync connection
+def table_etag(db: Session, *tables: str, daily: bool = False) -> str:
+    versions = ".".join(str(v) for v in stored_table_versions(db, *tables))
+    if daily:
+        versions += f"-{date.today().isoformat()}"
+    return f'"{versions}"'
+
+
+def _answer_etag(response: Response, if_none_match: str | None, etag: str) -> None:
+    """Raise 304 if ``if_none_match`` matches ``etag``, else set the headers."""
+    if if_none_match:
+        candidates = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        if etag in candidates or "*" in candidates:
+            raise HTTPException(
+                status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag}
+            )
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+
+
+def conditional_get(*tables: str, daily: bool = False):
+    def check_etag(
+        response: Response,
+        if_none_match: str | None = Header(None),
+        db: Session = Depends(get_db),
+    ) -> None:
+        _answer_etag(response, if_none_match, table_etag(db, *tables, daily=daily))
+
+    return Depends(check_etag)
+
+
+def async_conditional_get(*tables: str, daily: bool = False):
+    async def check_etag(
+        response: Response,
+        if_none_match: str | None = Header(None),
+        db: AsyncSession = Depends(get_async_db),
+    ) -> None:
+        etag = await db.run_sync(table_etag, *tables, daily=daily)
+        _answer_etag(response, if_none_match, etag)
+
+    return Depends(check_etag)
+
+
+# --- Reference cache ---
+# WHY: auth, store routes and reference lists re-read users, partners,
+#      products and locations on nearly every request although they rarely
+#      change
+# WHAT: size-bounded LRU caches of immutable row copies, keyed per entity.
+#       Entries are dropped when bump_table_versions() touches their table
+#       and are also checked against the table versions on every read, so a
+#       write racing a load cannot leave a stale entry. REFERENCE_CACHE_TTL
+#       bounds staleness from writes made by other processes
+# HOW: get_product_refs / get_location_refs / get_partner_refs /
+#      get_partner_ref / get_user_ref; hit and miss counts are served at
+#      GET /reference-cache/stats
+REFERENCE_CACHE_TTL = float(os.getenv("REFERENCE_CACHE_TTL", "300"))
+REFERENCE_CACHE_MAX_ENTRIES = int(os.getenv("REFERENCE_CACHE_MAX_ENTRIES", "4096"))
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+@dataclass(frozen=True, slots=True)
+class ProductRef:
+    product_id: str
+    product_name: str
+    unit_of_measure: str
+    standard_pack_size: float
+    mrp: float | None
+
+
+@dataclass(frozen=True, slots=True)
+class LocationRef:
+    location_id: str
+    location_name: str
+    location_type: str
+
+
+@dataclass(frozen=True, slots=True)
+class PartnerRef:
+    store_id: str
+    location_id: str
+    store_name: str
+
+
+@dataclass(frozen=True, slots=True)
+class UserRef:
+    username: str
+    password: str
+    role: str
+    store_id: str | None
+
+
+_reference_caches: list["ReferenceCache"] = []
+
+
+class ReferenceCache(Generic[K, V]):
+    """LRU cache of reference data loaded through ``loader(db, key)``."""
+
+    def __init__(
+        self,
+        name: str,
+        tables: tuple[str, ...],
+        loader: Callable[[Session, K], V],
+        max_entries: int = REFERENCE_CACHE_MAX_ENTRIES,
+        ttl: float = REFERENCE_CACHE_TTL,
+    ):
+        self.name = name
+        self.tables = tables
+        self.loader = loader
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[K, tuple[tuple[int, ...], float, V]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        _reference_caches.append(self)
+
+    def get(self, db: Session, key: K = None) -> V:
+        versions = table_versions(*self.tables)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] == versions and entry[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+        value = self.loader(db, key)
+        with self._lock:
+            self._entries[key] = (versions, now + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            if self._entries:
+                self._entries.clear()
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "tables": list(self.tables),
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+def invalidate_reference_caches(*tables: str) -> None:
+    touched = set(tables)
+    for cache in _reference_caches:
+        if touched.intersection(cache.tables):
+            cache.clear()
+
+
+def reference_cache_stats() -> dict:
+    return {cache.name: cache.stats() for cache in _reference_caches}
+
+
+def _product_ref(p: Product) -> ProductRef:
+    return ProductRef(
+        p.product_id,
+        p.product_name,
+        p.unit_of_measure,
+        float(p.standard_pack_size),
+        float(p.mrp) if p.mrp is not None else None,
+    )
+
+
+def _partner_ref(p: RetailPartner) -> PartnerRef:
+    return PartnerRef(p.store_id, p.location_id, p.store_name)
+
+
+def _load_user(db: Session, username: str) -> UserRef | None:
+    user = get_user_by_username(db, username)
+    if not user:
+        return None
+    return UserRef(user.username, user.password, user.role, user.store_id)
+
+
+def _load_partner(db: Session, store_id: str) -> PartnerRef | None:
+    partner = db.get(RetailPartner, store_id)
+    return _partner_ref(partner) if partner else None
+
+
+_product_list_cache: ReferenceCache[None, tuple[ProductRef, ...]] = ReferenceCache(
+    "product_list",
+    ("products",),
+    lambda db, _: tuple(_product_ref(p) for p in get_all_products(db)),
+    max_entries=1,
+)
+_location_list_cache: ReferenceCache[None, tuple[LocationRef, ...]] = ReferenceCache(
+    "location_list",
+    ("locations",),
+    lambda db, _: tuple(
+        LocationRef(l.location_id, l.location_name, l.location_type)
+        for l in get_all_locations(db)
+    ),
+    max_entries=1,
+)
+_partner_list_cache: ReferenceCache[None, tuple[PartnerRef, ...]] = ReferenceCache(
+    "partner_list",
+    ("retail_partners",),
+    lambda db, _: tuple(_partner_ref(p) for p in get_all_retail_partners(db)),
+    max_entries=1,
+)
+_partner_cache: ReferenceCache[str, PartnerRef | None] = ReferenceCache(
+    "partners", ("retail_partners",), _load_partner
+)
+_user_cache: ReferenceCache[str, UserRef | None] = ReferenceCache(
+    "users", ("users",), _load_user
+)
+
+
+def get_product_refs(db: Session) -> tuple[ProductRef, ...]:
+    return _product_list_cache.get(db)
+
+
+def get_location_refs(db: Session) -> tuple[LocationRef, ...]:
+    return _location_list_cache.get(db)
+
+
+def get_partner_refs(db: Session) -> tuple[PartnerRef, ...]:
+    return _partner_list_cache.get(db)
+
+
+def get_partner_ref(db: Session, store_id: str) -> PartnerRef | None:
+    return _partner_cache.get(db, store_id)
+
+
+def get_user_ref(db: Session, username: str) -> UserRef | None:
+    return _user_cache.get(db, username)
+
+
+# --- Change events ---
+# WHY: dashboards re-fetched whole tables after every write
+# WHAT: typed change events (movement, sale, batch, stock, alert) queued on
+#       the session by service functions and published to SSE subscribers
+#       once the transaction commits; rolled back work publishes nothing
+# HOW: queue_event(db, type, rows, scopes) with one set of location ids per
+#      row; subscribers limited to a location only receive rows scoped to it
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+SSE_KEEPALIVE_SECONDS = 15
+
+
+class EventSubscriber:
+    """One SSE connection; ``location_id`` None receives every row."""
+
+    def __init__(self, location_id: str | None):
+        self.location_id = location_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+
+    def offer(self, message: str) -> None:
+        # runs on the subscriber's event loop
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # the client stopped reading: drop its backlog and end the stream
+            # so it reconnects and reloads instead of receiving a gap
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+_subscribers: set[EventSubscriber] = set()
+_subscribers_lock = threading.Lock()
+_event_ids = iter(range(1, 1 << 62))
+
+
+def has_event_subscribers() -> bool:
+    return bool(_subscribers)
+
+
+def subscribe_events(location_id: str | None) -> EventSubscriber:
+    subscriber = EventSubscriber(location_id)
+    with _subscribers_lock:
+        _subscribers.add(subscriber)
+    return subscriber
+
+
+def unsubscribe_events(subscriber: EventSubscriber) -> None:
+    with _subscribers_lock:
+        _subscribers.discard(subscriber)
+
+
+def queue_event(db: Session, event_type: str, rows: list[dict], scopes) -> None:
+    """Publish ``rows`` as one ``event_type`` event after ``db`` commits."""
+    if rows and _subscribers:
+        db.info.setdefault("change_events", []).append(
+            (event_type, rows, [set(filter(None, scope)) for scope in scopes])
+        )
+
+
+def _row_dict(obj) -> dict:
+    return {c.key: getattr(obj, c.key) for c in obj.__table__.columns}
+
+
+def _sse_message(event_type: str, rows: list[dict]) -> str:
+    data = dumps_json({"rows": rows}).decode()
+    return f"id: {next(_event_ids)}\nevent: {event_type}\ndata: {data}\n\n"
+
+
+def publish_events(events) -> None:
+    with _subscribers_lock:
+        subscribers = list(_subscribers)
+    for event_type, rows, scopes in events:
+        # render once per distinct location view, not once per connection
+        views: dict[str | None, str | None] = {}
+        for subscriber in subscribers:
+            loc = subscriber.location_id
+            if loc not in views:
+                visible = (
+                    rows
+                    if loc is None
+                    else [row for row, scope in zip(rows, scopes) if loc in scope]
+                )
+                views[loc] = _sse_message(event_type, visible) if visible else None
+            if views[loc]:
+                subscriber.loop.call_soon_threadsafe(subscriber.offer, views[loc])
+
+
+# Savepoints nest strictly, so a stack of queue lengths taken as each one
+# begins tells a savepoint rollback which events are its own
+def _mark_savepoint_events(session: Session, transaction) -> None:
+    if transaction.nested:
+        marks = session.info.setdefault("change_event_marks", [])
+        marks.append(len(session.info.get("change_events", ())))
+
+
+def _forget_savepoint_mark(session: Session, transaction) -> None:
+    if transaction.nested:
+        session.info["change_event_marks"].pop()
+
+
+def _publish_committed_events(session: Session) -> None:
+    if session.in_nested_transaction():
+        # a RELEASE SAVEPOINT; the outer transaction can still fail
+        return
+    events = session.info.pop("change_events", None)
+    if events:
+        publish_events(events)
+
+
+def _drop_rolled_back_events(session: Session) -> None:
+    if session.in_nested_transaction():
+        events = session.info.get("change_events")
+        if events:
+            del events[session.info["change_event_marks"][-1] :]
+        return
+    session.info.pop("change_events", None)
+
+
+event.listen(Session, "after_transaction_create", _mark_savepoint_events)
+event.listen(Session, "after_transaction_end", _forget_savepoint_mark)
+event.listen(Session, "after_commit", _publish_committed_events)
+event.listen(Session, "after_rollback", _drop_rolled_back_events)
+
+
 # --- Service layer functions ---
 def get_all_products(db: Session):
     return db.query(Product).all()
@@ -215,22 +1304,86 @@ def create_product(db: Session, data: dict) -> Product:
     product = Product(**data)
     db.add(product)
     db.commit()
+    bump_table_versions("products")
     db.refresh(product)
     return product
 
 
-def get_all_batches(db: Session):
-    """Return batches with their associated product items."""
-    batches = db.query(Batch).all()
+# default page for GET /batches
+BATCH_PAGE_SIZE = 100
+
+
+def get_all_batches(
+    db: Session,
+    limit: int | None = None,
+    after: tuple[date, str] | None = None,
+    manufactured_from: date | None = None,
+    manufactured_to: date | None = None,
+    expiry_from: date | None = None,
+    expiry_to: date | None = None,
+    in_stock_at: str | None = None,
+):
+    """Return batches with their associated product items.
+
+    Batches are ordered newest first by ``(date_manufactured, batch_id)`` and
+    fetched together with their items in one joined query. ``after`` is the
+    key of the last batch on the previous page; ``in_stock_at`` keeps only
+    batches with stock left at that location.
+    """
+    page = db.query(Batch)
+    if in_stock_at:
+        # drive from the location's on-hand rows instead of walking batches
+        page = page.filter(
+            Batch.batch_id.in_(
+                select(CurrentStock.batch_id).where(
+                    CurrentStock.location_id == in_stock_at,
+                    CurrentStock.quantity > 0,
+                )
+            )
+        )
+    if manufactured_from:
+        page = page.filter(Batch.date_manufactured >= manufactured_from)
+    if manufactured_to:
+        page = page.filter(Batch.date_manufactured <= manufactured_to)
+    if expiry_from:
+        page = page.filter(Batch.expiry_date >= expiry_from)
+    if expiry_to:
+        page = page.filter(Batch.expiry_date <= expiry_to)
+    if after:
+        page = page.filter(
+            tuple_(Batch.date_manufactured, Batch.batch_id) < tuple_(*after)
+        )
+    page = page.order_by(Batch.date_manufactured.desc(), Batch.batch_id.desc())
+    if limit:
+        page = page.limit(limit)
+    batch = aliased(Batch, page.subquery())
+    rows = (
+        db.query(batch, BatchProduct)
+        .outerjoin(BatchProduct, BatchProduct.batch_id == batch.batch_id)
+        .order_by(
+            batch.date_manufactured.desc(), batch.batch_id.desc(), BatchProduct.id
+        )
+        .all()
+    )
     result = []
-    for b in batches:
-        items = db.query(BatchProduct).filter(BatchProduct.batch_id == b.batch_id).all()
-        result.append((b, items))
+    for b, item in rows:
+        if not result or result[-1][0] is not b:
+            result.append((b, []))
+        if item is not None:
+            result[-1][1].append(item)
     return result
 
 
-def create_batch(db: Session, data: dict, items: list[dict]) -> Batch:
-    """Insert a batch and its product items."""
+def get_dispatchable_batches(db: Session):
+    """Every batch the warehouse can still dispatch from.
+
+    Not paged: batches with warehouse stock stay few, and the oldest of them
+    are the ones FEFO wants dispatched first.
+    """
+    return get_all_batches(db, in_stock_at=CENTRAL_WAREHOUSE_ID)
+
+
+def _batch_changes(db: Session, data: dict, items: list[dict]) -> Batch:
     batch = Batch(**data)
     db.add(batch)
     for itm in items:
@@ -240,19 +1393,103 @@ def create_batch(db: Session, data: dict, items: list[dict]) -> Batch:
             quantity_produced=itm["quantity_produced"],
         )
         db.add(bp)
-    db.commit()
+    queue_event(
+        db,
+        "batch",
+        [{**_row_dict(batch), "items": items}],
+        [(CENTRAL_WAREHOUSE_ID,)],
+    )
+    db.flush()
+    _stock_batch_items(
+        db,
+        batch,
+        [(i["product_id"], i["quantity_produced"]) for i in items],
+        CENTRAL_WAREHOUSE_ID,
+    )
+    return batch
+
+
+def create_batch(db: Session, data: dict, items: list[dict]) -> Batch:
+    """Insert a batch with its product items and stock them at the warehouse."""
+
+    def work():
+        batch = _batch_changes(db, data, items)
+        db.commit()
+        return batch
+
+    batch = run_stock_write(db, work)
+    bump_table_versions("batches", "batch_products", "current_stock", "stock_alerts")
     db.refresh(batch)
     return batch
 
 
-def get_all_movements(db: Session):
-    return db.query(StockMovement).all()
+def _store_location_ids(db: Session, store_id: str):
+    return (
+        db.query(RetailPartner.location_id)
+        .filter(RetailPartner.store_id == store_id)
+        .scalar_subquery()
+    )
+
+
+def get_movement_history(
+    db: Session,
+    limit: int = 100,
+    after: tuple[datetime, str] | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    product_id: str | None = None,
+    batch_id: str | None = None,
+    location_id: str | None = None,
+    store_id: str | None = None,
+):
+    """Return one page of movements, newest first, keyed by (date, id).
+
+    ``location_id`` and ``store_id`` match either end of a movement.
+    """
+    query = db.query(StockMovement).filter(StockMovement.movement_date != None)
+    if date_from:
+        query = query.filter(StockMovement.movement_date >= date_from)
+    if date_to:
+        query = query.filter(StockMovement.movement_date < date_to + timedelta(days=1))
+    if product_id:
+        query = query.filter(StockMovement.product_id == product_id)
+    if batch_id:
+        query = query.filter(StockMovement.batch_id == batch_id)
+    locations = []
+    if location_id:
+        locations.append(location_id)
+    if store_id:
+        locations.append(_store_location_ids(db, store_id))
+    for loc in locations:
+        query = query.filter(
+            (StockMovement.source_location_id == loc)
+            | (StockMovement.destination_location_id == loc)
+        )
+    if after:
+        query = query.filter(
+            tuple_(StockMovement.movement_date, StockMovement.movement_id)
+            < tuple_(*after)
+        )
+    return (
+        query.order_by(
+            StockMovement.movement_date.desc(), StockMovement.movement_id.desc()
+        )
+        .limit(limit)
+        .all()
+    )
 
 
 def create_movement(db: Session, data: dict) -> StockMovement:
     move = StockMovement(**data)
     db.add(move)
+    queue_event(
+        db,
+        "movement",
+        [_row_dict(move)],
+        [(move.source_location_id, move.destination_location_id)],
+    )
     db.commit()
+    bump_table_versions("stock_movements")
     db.refresh(move)
     return move
 
@@ -280,11 +1517,11 @@ def get_total_retail_stock(db: Session) -> int:
 
 
 def get_expiring_units_count(db: Session, days: int = 60) -> int:
+    """Units on hand whose batch expires within ``days`` (expired included)."""
     cutoff = date.today() + timedelta(days=days)
     return (
-        db.query(func.coalesce(func.sum(CurrentStock.quantity), 0))
-        .join(Batch, CurrentStock.batch_id == Batch.batch_id)
-        .filter(and_(Batch.expiry_date != None, Batch.expiry_date <= cutoff))
+        db.query(func.coalesce(func.sum(ExpiryCalendar.quantity), 0))
+        .filter(ExpiryCalendar.expiry_date <= cutoff)
         .scalar()
     )
 
@@ -314,13 +1551,20 @@ def get_warehouse_product_totals(db: Session, warehouse_id: str = "MAIN_WH"):
     )
 
 
-def get_store_current_stock(db: Session, store_id: str) -> int:
-    partner = db.query(RetailPartner).filter(RetailPartner.store_id == store_id).first()
-    if not partner:
+def _partner_location_id(db: Session, store_id: str) -> str | None:
+    partner = get_partner_ref(db, store_id)
+    return partner.location_id if partner else None
+
+
+def get_store_current_stock(
+    db: Session, store_id: str, location_id: str | None = None
+) -> int:
+    location_id = location_id or _partner_location_id(db, store_id)
+    if not location_id:
         return 0
     return (
         db.query(func.coalesce(func.sum(CurrentStock.quantity), 0))
-        .filter(CurrentStock.location_id == partner.location_id)
+        .filter(CurrentStock.location_id == location_id)
         .scalar()
     )
 
@@ -338,6 +1582,48 @@ def get_recent_sales(db: Session, limit: int = 5):
     return db.query(RetailSale).order_by(RetailSale.sale_date.desc()).limit(limit).all()
 
 
+def get_sales_history(
+    db: Session,
+    limit: int = 100,
+    after: tuple[date, str] | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    product_id: str | None = None,
+    batch_id: str | None = None,
+    location_id: str | None = None,
+    store_id: str | None = None,
+):
+    """Return one page of retail sales, newest first, keyed by (date, id)."""
+    query = db.query(RetailSale)
+    if date_from:
+        query = query.filter(RetailSale.sale_date >= date_from)
+    if date_to:
+        query = query.filter(RetailSale.sale_date <= date_to)
+    if product_id:
+        query = query.filter(RetailSale.product_id == product_id)
+    if batch_id:
+        query = query.filter(RetailSale.batch_id == batch_id)
+    if store_id:
+        query = query.filter(RetailSale.store_id == store_id)
+    if location_id:
+        query = query.filter(
+            RetailSale.store_id.in_(
+                db.query(RetailPartner.store_id).filter(
+                    RetailPartner.location_id == location_id
+                )
+            )
+        )
+    if after:
+        query = query.filter(
+            tuple_(RetailSale.sale_date, RetailSale.sale_id) < tuple_(*after)
+        )
+    return (
+        query.order_by(RetailSale.sale_date.desc(), RetailSale.sale_id.desc())
+        .limit(limit)
+        .all()
+    )
+
+
 def get_user_by_username(db: Session, username: str):
     return db.query(User).filter(User.username == username).first()
 
@@ -346,118 +1632,1877 @@ def create_user(db: Session, data: dict) -> User:
     user = User(**data)
     db.add(user)
     db.commit()
+    bump_table_versions("users")
     db.refresh(user)
     return user
 
 
+def _stock_id(product_id: str, batch_id: str, location_id: str) -> str:
+    return f"{batch_id}-{location_id}-{product_id}"
+
+
+def _stock_batch_items(
+    db: Session, batch: Batch, items: list[tuple[str, int]], warehouse_id: str
+) -> None:
+    invalidate_stock_snapshots(db, batch.date_manufactured)
+    for product_id, quantity in items:
+        increment_stock(db, product_id, batch.batch_id, warehouse_id, quantity)
+    stock_rows_changed(
+        db, [(product_id, batch.batch_id, warehouse_id) for product_id, _ in items]
+    )
+
+
 def add_new_batch_to_inventory(
     db: Session, batch: Batch, warehouse_id: str = "MAIN_WH"
 ) -> None:
-    items = db.query(BatchProduct).filter(BatchProduct.batch_id == batch.batch_id).all()
-    for item in items:
-        stock = (
-            db.query(CurrentStock)
-            .filter(
-                CurrentStock.product_id == item.product_id,
-                CurrentStock.batch_id == batch.batch_id,
-                CurrentStock.location_id == warehouse_id,
+    items = (
+        db.query(BatchProduct.product_id, BatchProduct.quantity_produced)
+        .filter(BatchProduct.batch_id == batch.batch_id)
+        .all()
+    )
+
+    def work():
+        _stock_batch_items(db, batch, items, warehouse_id)
+        db.commit()
+
+    run_stock_write(db, work)
+    bump_table_versions("current_stock", "stock_alerts")
+
+
+# WHY: dispatches and sales read a stock row, changed it in Python and wrote
+#      it back, so concurrent writers lost updates and max(0, ...) hid oversells
+# WHAT: decrements are one conditional UPDATE (quantity >= n), increments one
+#       upsert; a decrement that matches no row raises InsufficientStockError.
+#       Writes that hit lock contention are rolled back and retried with
+#       jittered backoff up to STOCK_WRITE_RETRIES times
+# HOW: wrap a whole unit of work (rows added + stock changes + commit) in
+#      run_stock_write so a retry replays all of it;
+#      `python main.py bench-stock-contention` checks throughput and totals
+STOCK_WRITE_RETRIES = int(os.getenv("STOCK_WRITE_RETRIES", "5"))
+STOCK_RETRY_BASE_DELAY = float(os.getenv("STOCK_RETRY_BASE_DELAY", "0.01"))
+_LOCK_ERROR_MARKERS = (
+    "database is locked",
+    "database table is locked",
+    "deadlock detected",
+    "could not serialize access",
+    "lock timeout",
+)
+
+
+# Dialects whose INSERT supports ON CONFLICT DO UPDATE
+_UPSERT_INSERTS = {"sqlite": sqlite_dialect.insert, "postgresql": postgresql.insert}
+
+
+class InsufficientStockError(Exception):
+    """A decrement would take a stock row below zero."""
+
+    def __init__(self, product_id, batch_id, location_id, requested, available):
+        self.product_id = product_id
+        self.batch_id = batch_id
+        self.location_id = location_id
+        self.requested = requested
+        self.available = available
+        batch = f" batch {batch_id}" if batch_id else ""
+        super().__init__(
+            f"Insufficient stock for {product_id}{batch} at "
+            f"{location_id}: requested {requested}, available {available}"
+        )
+
+
+def _is_lock_contention(exc: OperationalError) -> bool:
+    message = str(exc.orig).lower()
+    return any(marker in message for marker in _LOCK_ERROR_MARKERS)
+
+
+def begin_write(db: Session) -> None:
+    """Open the transaction before any SAVEPOINT on SQLite.
+
+    pysqlite only issues BEGIN ahead of DML, so a SAVEPOINT opened first would
+    itself become the outer transaction and its RELEASE would commit. Taking
+    the write lock up front also avoids upgrading it mid-transaction.
+    """
+    if db.get_bind().dialect.name != "sqlite":
+        return
+    conn = db.connection()
+    if not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def run_stock_write(db: Session, work):
+    """Run ``work()`` (which commits), retrying it on lock contention."""
+    for attempt in range(STOCK_WRITE_RETRIES + 1):
+        try:
+            return work()
+        except OperationalError as exc:
+            db.rollback()
+            if attempt == STOCK_WRITE_RETRIES or not _is_lock_contention(exc):
+                raise
+            time.sleep(STOCK_RETRY_BASE_DELAY * (2**attempt) * random.uniform(0.5, 1.5))
+        except Exception:
+            db.rollback()
+            raise
+
+
+def decrement_stock(
+    db: Session, product_id: str, batch_id: str, location_id: str, quantity: int
+) -> None:
+    """Take ``quantity`` units from a stock row or raise InsufficientStockError."""
+    table = CurrentStock.__table__
+    result = db.execute(
+        table.update()
+        .where(
+            table.c.product_id == product_id,
+            table.c.batch_id == batch_id,
+            table.c.location_id == location_id,
+            table.c.quantity >= quantity,
+        )
+        .values(quantity=table.c.quantity - quantity, last_updated=func.now())
+    )
+    if result.rowcount == 0:
+        available = db.execute(
+            select(table.c.quantity).where(
+                table.c.product_id == product_id,
+                table.c.batch_id == batch_id,
+                table.c.location_id == location_id,
             )
-            .first()
+        ).scalar()
+        raise InsufficientStockError(
+            product_id, batch_id, location_id, quantity, available or 0
         )
-        if stock:
-            stock.quantity += item.quantity_produced
-        else:
-            stock = CurrentStock(
-                stock_id=f"{batch.batch_id}-{warehouse_id}-{item.product_id}",
-                product_id=item.product_id,
-                batch_id=batch.batch_id,
-                location_id=warehouse_id,
-                quantity=item.quantity_produced,
+
+
+def increment_stock(
+    db: Session, product_id: str, batch_id: str, location_id: str, quantity: int
+) -> None:
+    """Add ``quantity`` units to a stock row, creating it if needed."""
+    table = CurrentStock.__table__
+    values = {
+        "stock_id": _stock_id(product_id, batch_id, location_id),
+        "product_id": product_id,
+        "batch_id": batch_id,
+        "location_id": location_id,
+        "quantity": quantity,
+        "last_updated": func.now(),
+    }
+    upsert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if upsert:
+        stmt = upsert(table).values(**values)
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["product_id", "batch_id", "location_id"],
+                set_={
+                    "quantity": table.c.quantity + stmt.excluded.quantity,
+                    "last_updated": stmt.excluded.last_updated,
+                },
             )
-            db.add(stock)
-    db.commit()
+        )
+        return
+    result = db.execute(
+        table.update()
+        .where(
+            table.c.product_id == product_id,
+            table.c.batch_id == batch_id,
+            table.c.location_id == location_id,
+        )
+        .values(quantity=table.c.quantity + quantity, last_updated=func.now())
+    )
+    if result.rowcount == 0:
+        db.execute(table.insert().values(**values))
 
 
-def dispatch_stock(db: Session, movement: StockMovement) -> None:
+def _apply_movement_stock(db: Session, movement: StockMovement) -> None:
+    keys = []
     if movement.source_location_id:
-        src = (
-            db.query(CurrentStock)
-            .filter(
-                CurrentStock.product_id == movement.product_id,
-                CurrentStock.batch_id == movement.batch_id,
-                CurrentStock.location_id == movement.source_location_id,
-            )
-            .first()
+        decrement_stock(
+            db,
+            movement.product_id,
+            movement.batch_id,
+            movement.source_location_id,
+            movement.quantity,
+        )
+        keys.append(
+            (movement.product_id, movement.batch_id, movement.source_location_id)
         )
-        if src:
-            src.quantity = max(0, src.quantity - movement.quantity)
     if movement.destination_location_id:
-        dest = (
-            db.query(CurrentStock)
+        increment_stock(
+            db,
+            movement.product_id,
+            movement.batch_id,
+            movement.destination_location_id,
+            movement.quantity,
+        )
+        keys.append(
+            (movement.product_id, movement.batch_id, movement.destination_location_id)
+        )
+    stock_rows_changed(db, keys)
+
+
+def dispatch_stock(db: Session, movement: StockMovement) -> None:
+    """Apply an already recorded movement to current stock."""
+
+    def work():
+        _apply_movement_stock(db, movement)
+        db.commit()
+
+    run_stock_write(db, work)
+    bump_table_versions("current_stock", "stock_alerts")
+
+
+def _movement_changes(db: Session, data: dict) -> StockMovement:
+    move = StockMovement(**data)
+    db.add(move)
+    queue_event(
+        db,
+        "movement",
+        [_row_dict(move)],
+        [(move.source_location_id, move.destination_location_id)],
+    )
+    db.flush()
+    _apply_movement_stock(db, move)
+    return move
+
+
+def record_movement(db: Session, data: dict) -> list[StockMovement]:
+    """Insert a movement and apply it to stock in one transaction.
+
+    Without a ``batch_id`` the quantity is allocated FEFO at the source and
+    one movement is written per batch used.
+    """
+
+    def work():
+        moves = _allocated_movement_changes(db, data)
+        db.commit()
+        return moves
+
+    moves = run_stock_write(db, work)
+    bump_table_versions("stock_movements", "current_stock", "stock_alerts")
+    return moves
+
+
+# --- Write pipeline ---
+# WHY: every write request paid for its own commit, and with SQLite the
+#      per-commit fsync capped write throughput under load
+# WHAT: a writer thread drains queued write units into one transaction per
+#       window (up to WRITE_BATCH_SIZE units or WRITE_BATCH_LATENCY_MS after
+#       the first arrives). Each unit runs in a SAVEPOINT so a failing unit
+#       (e.g. insufficient stock) only rolls back itself; callers are answered
+#       after the window commits. WRITE_PIPELINE=0 commits per request instead
+# HOW: submit_write(db, lambda db: ..., tables) from a write route; throughput
+#      is reported by GET /write-pipeline/stats
+WRITE_PIPELINE_ENABLED = os.getenv("WRITE_PIPELINE", "1") != "0"
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "64"))
+WRITE_BATCH_LATENCY_MS = float(os.getenv("WRITE_BATCH_LATENCY_MS", "2"))
+WRITE_THROUGHPUT_WINDOW = 60.0
+
+
+class WritePipeline:
+    """Group-commit queued write units from concurrent callers."""
+
+    def __init__(self, session_factory, batch_size: int, latency_ms: float):
+        self.session_factory = session_factory
+        self.batch_size = max(1, batch_size)
+        self.latency = max(0.0, latency_ms) / 1000
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._commits: deque[tuple[float, int]] = deque()
+        self.counters = {"writes": 0, "failed": 0, "windows": 0, "retries": 0}
+
+    def submit(self, work, tables=()):
+        """Queue ``work(db)`` and block until its window commits."""
+        future: Future = Future()
+        self._ensure_started()
+        self._queue.put((work, tables, future))
+        return future.result()
+
+    def close(self) -> None:
+        if self._thread and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _ensure_started(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(
+                    target=self._run, name="write-pipeline", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            window = [item]
+            deadline = time.monotonic() + self.latency
+            while len(window) < self.batch_size:
+                try:
+                    item = self._queue.get(
+                        timeout=max(0.0, deadline - time.monotonic())
+                    )
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)
+                    break
+                window.append(item)
+            self._apply(window)
+
+    def _apply(self, window: list) -> None:
+        for attempt in range(STOCK_WRITE_RETRIES + 1):
+            try:
+                with self.session_factory() as db:
+                    outcomes = self._apply_once(db, window)
+                break
+            except OperationalError as exc:
+                if attempt == STOCK_WRITE_RETRIES or not _is_lock_contention(exc):
+                    outcomes = [(None, exc)] * len(window)
+                    break
+                self.counters["retries"] += 1
+                time.sleep(
+                    STOCK_RETRY_BASE_DELAY * (2**attempt) * random.uniform(0.5, 1.5)
+                )
+            except Exception as exc:
+                outcomes = [(None, exc)] * len(window)
+                break
+        tables = set()
+        written = 0
+        for (_, unit_tables, _), (_, exc) in zip(window, outcomes):
+            if exc is None:
+                tables.update(unit_tables)
+                written += 1
+        if tables:
+            bump_table_versions(*tables)
+        now = time.monotonic()
+        with self._lock:
+            self.counters["writes"] += written
+            self.counters["failed"] += len(window) - written
+            self.counters["windows"] += 1
+            self._commits.append((now, written))
+            while self._commits and self._commits[0][0] < now - WRITE_THROUGHPUT_WINDOW:
+                self._commits.popleft()
+        for (_, _, future), (result, exc) in zip(window, outcomes):
+            if exc is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exc)
+
+    def _apply_once(self, db: Session, window: list) -> list:
+        begin_write(db)
+        # calendar, alert and stock-event upkeep runs once for the window
+        db.info["deferred_stock_keys"] = set()
+        outcomes = []
+        for work, _, _ in window:
+            savepoint = db.begin_nested()
+            try:
+                result = work(db)
+                savepoint.commit()
+            except OperationalError:
+                raise
+            except Exception as exc:
+                # also drops the events this unit queued
+                savepoint.rollback()
+                outcomes.append((None, exc))
+            else:
+                outcomes.append((result, None))
+        keys = db.info.pop("deferred_stock_keys")
+        if keys:
+            stock_rows_changed(db, keys)
+        db.commit()
+        return outcomes
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            recent = [n for t, n in self._commits if t >= now - WRITE_THROUGHPUT_WINDOW]
+            counters = dict(self.counters)
+        windows = counters["windows"]
+        return {
+            "enabled": WRITE_PIPELINE_ENABLED,
+            "batch_size": self.batch_size,
+            "latency_ms": self.latency * 1000,
+            "queued": self._queue.qsize(),
+            **counters,
+            "avg_window": round(counters["writes"] / windows, 2) if windows else 0,
+            "writes_per_second": round(sum(recent) / WRITE_THROUGHPUT_WINDOW, 2),
+            "commits_per_second": round(len(recent) / WRITE_THROUGHPUT_WINDOW, 2),
+        }
+
+
+write_pipeline = WritePipeline(SessionLocal, WRITE_BATCH_SIZE, WRITE_BATCH_LATENCY_MS)
+
+
+def submit_write(db: Session, work, tables=()):
+    """Apply ``work(db)`` through the write pipeline, or directly if disabled.
+
+    ``work`` must not commit and should return plain values (ids), not ORM
+    objects bound to the pipeline's session.
+    """
+    if WRITE_PIPELINE_ENABLED:
+        # end the request's read transaction so its pooled connection is free
+        # for the writer thread while this caller waits
+        db.rollback()
+        return write_pipeline.submit(work, tables)
+
+    def direct():
+        result = work(db)
+        db.commit()
+        return result
+
+    result = run_stock_write(db, direct)
+    bump_table_versions(*tables)
+    return result
+
+
+# Keep IN (...) lists well below SQLite's bound-parameter limit
+IN_CLAUSE_CHUNK = 500
+
+
+def _chunks(items: list, size: int = IN_CLAUSE_CHUNK):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def _existing_ids(db: Session, column, ids) -> set:
+    found = set()
+    for chunk in _chunks(list(set(ids))):
+        found.update(v for (v,) in db.query(column).filter(column.in_(chunk)))
+    return found
+
+
+def _load_stock_rows(db: Session, keys) -> dict[tuple[str, str, str], tuple]:
+    """Map (product, batch, location) keys to existing (stock_id, quantity)."""
+    stock = {}
+    for chunk in _chunks(list(keys)):
+        # OR of equality terms lets SQLite probe the unique key index once per
+        # key; a row-value IN (VALUES ...) list falls back to a table scan
+        matches = or_(
+            *[
+                and_(
+                    CurrentStock.product_id == p,
+                    CurrentStock.batch_id == b,
+                    CurrentStock.location_id == loc,
+                )
+                for p, b, loc in chunk
+            ]
+        )
+        for sid, prod, bat, loc, qty in db.query(
+            CurrentStock.stock_id,
+            CurrentStock.product_id,
+            CurrentStock.batch_id,
+            CurrentStock.location_id,
+            CurrentStock.quantity,
+        ).filter(matches):
+            stock[(prod, bat, loc)] = (sid, qty)
+    return stock
+
+
+# --- Expiry calendar ---
+# WHY: expiry questions (units expiring soon, soonest-first list, batch status)
+#      should not join and re-sum all of current_stock on every request
+# WHAT: expiry_calendar mirrors on-hand current_stock rows with the batch
+#       expiry date, indexed by (expiry_date, batch_id, product_id, quantity)
+# HOW: every service that writes current_stock calls stock_rows_changed()
+#      with the keys it touched before committing
+EXPIRY_WARNING_DAYS = int(os.getenv("EXPIRY_WARNING_DAYS", "30"))
+
+
+def expiry_status(expiry_date: date, today: date | None = None) -> str:
+    """``red`` once expired, ``yellow`` within EXPIRY_WARNING_DAYS, else ``green``."""
+    today = today or date.today()
+    if expiry_date < today:
+        return "red"
+    if expiry_date <= today + timedelta(days=EXPIRY_WARNING_DAYS):
+        return "yellow"
+    return "green"
+
+
+def refresh_expiry_calendar(db: Session, keys) -> None:
+    """Re-derive calendar rows for the given (product, batch, location) keys.
+
+    Runs inside the caller's transaction; pending ORM changes are flushed
+    first so the copy reflects them.
+    """
+    keys = list(set(keys))
+    if not keys:
+        return
+    db.flush()
+    calendar = ExpiryCalendar.__table__
+    for chunk in _chunks(keys):
+        db.execute(
+            calendar.delete().where(
+                or_(
+                    *[
+                        and_(
+                            calendar.c.product_id == p,
+                            calendar.c.batch_id == b,
+                            calendar.c.location_id == loc,
+                        )
+                        for p, b, loc in chunk
+                    ]
+                )
+            )
+        )
+        on_hand = (
+            select(
+                CurrentStock.batch_id,
+                CurrentStock.product_id,
+                CurrentStock.location_id,
+                Batch.expiry_date,
+                CurrentStock.quantity,
+            )
+            .join(Batch, Batch.batch_id == CurrentStock.batch_id)
+            .where(
+                or_(
+                    *[
+                        and_(
+                            CurrentStock.product_id == p,
+                            CurrentStock.batch_id == b,
+                            CurrentStock.location_id == loc,
+                        )
+                        for p, b, loc in chunk
+                    ]
+                ),
+                CurrentStock.quantity > 0,
+                Batch.expiry_date.is_not(None),
+            )
+        )
+        db.execute(
+            calendar.insert().from_select(
+                ["batch_id", "product_id", "location_id", "expiry_date", "quantity"],
+                on_hand,
+            )
+        )
+
+
+def get_expiring_stock(
+    db: Session,
+    days: int = 30,
+    location_id: str | None = None,
+    limit: int | None = None,
+):
+    """Calendar rows expiring within ``days``, soonest first, with product names."""
+    cutoff = date.today() + timedelta(days=days)
+    query = (
+        db.query(ExpiryCalendar, Product.product_name)
+        .join(Product, Product.product_id == ExpiryCalendar.product_id)
+        .filter(ExpiryCalendar.expiry_date <= cutoff)
+    )
+    if location_id:
+        query = query.filter(ExpiryCalendar.location_id == location_id)
+    query = query.order_by(
+        ExpiryCalendar.expiry_date,
+        ExpiryCalendar.batch_id,
+        ExpiryCalendar.product_id,
+        ExpiryCalendar.location_id,
+    )
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+
+def get_batch_expiry_status(db: Session) -> list[dict]:
+    """Units on hand per batch and product with their expiry status."""
+    today = date.today()
+    rows = (
+        db.query(
+            ExpiryCalendar.batch_id,
+            ExpiryCalendar.product_id,
+            ExpiryCalendar.expiry_date,
+            func.sum(ExpiryCalendar.quantity),
+        )
+        .group_by(
+            ExpiryCalendar.expiry_date,
+            ExpiryCalendar.batch_id,
+            ExpiryCalendar.product_id,
+        )
+        .order_by(ExpiryCalendar.expiry_date, ExpiryCalendar.batch_id)
+        .all()
+    )
+    return [
+        {
+            "batch_id": batch_id,
+            "product_id": product_id,
+            "expiry_date": expiry,
+            "units_available": units,
+            "status": expiry_status(expiry, today),
+        }
+        for batch_id, product_id, expiry, units in rows
+    ]
+
+
+# --- FEFO allocation ---
+# WHY: dispatches had to name a batch and product-only sales decremented
+#      nothing, so stock drifted and older batches were left to expire
+# WHAT: allocate a product quantity at a location across batches,
+#       first-expiry-first-out, skipping expired stock; batches without an
+#       expiry date go last. One movement or sale row is written per batch
+#       used, all in the caller's transaction
+# HOW: omit batch_id on POST /stock-movements (with a source location) or
+#      POST /retail-sales. Rows are walked in ix_expiry_calendar_fefo order
+#      (location, product, expiry), so an allocation costs an index seek plus
+#      the batches it actually uses
+FEFO_PAGE_SIZE = 20
+
+
+class DuplicateIdError(Exception):
+    """An id a write would use is already taken."""
+
+    def __init__(self, ids):
+        self.ids = sorted(ids)
+        super().__init__(f"ID already exists: {', '.join(self.ids)}")
+
+
+def _allocation_id(base: str, index: int) -> str:
+    """Caller's id for the first allocated row, ``<id>-2``, ``<id>-3``... after."""
+    return base if index == 0 else f"{base}-{index + 1}"
+
+
+def _allocation_ids(db: Session, column, base: str, count: int) -> list[str]:
+    """Ids for ``count`` allocated rows; DuplicateIdError if any is taken.
+
+    A derived ``<id>-2`` can clash with an id a client chose earlier, so all
+    of them are checked before anything is written.
+    """
+    ids = [_allocation_id(base, n) for n in range(count)]
+    taken = _existing_ids(db, column, ids)
+    if taken:
+        raise DuplicateIdError(taken)
+    return ids
+
+
+def allocate_fefo(
+    db: Session, product_id: str, location_id: str, quantity: int
+) -> list[tuple[str, int]]:
+    """Split ``quantity`` over batches on hand, earliest expiry first.
+
+    Returns ``[(batch_id, units), ...]`` or raises InsufficientStockError
+    when the location holds less than ``quantity`` sellable units.
+    """
+    deferred = db.info.get("deferred_stock_keys")
+    if deferred:
+        # inside a write-pipeline window earlier writes may not be in the
+        # calendar yet
+        refresh_expiry_calendar(
+            db, {k for k in deferred if k[0] == product_id and k[2] == location_id}
+        )
+    calendar = ExpiryCalendar.__table__
+    allocations: list[tuple[str, int]] = []
+    remaining = quantity
+    # start at today: stock past its expiry date is never allocated
+    after = (date.today(), "")
+    while remaining > 0:
+        page = db.execute(
+            select(calendar.c.expiry_date, calendar.c.batch_id, calendar.c.quantity)
+            .where(
+                calendar.c.location_id == location_id,
+                calendar.c.product_id == product_id,
+                tuple_(calendar.c.expiry_date, calendar.c.batch_id) > tuple_(*after),
+            )
+            .order_by(calendar.c.expiry_date, calendar.c.batch_id)
+            .limit(FEFO_PAGE_SIZE)
+        ).all()
+        for expiry, batch_id, units in page:
+            take = min(units, remaining)
+            allocations.append((batch_id, take))
+            remaining -= take
+            if not remaining:
+                break
+        if len(page) < FEFO_PAGE_SIZE:
+            break
+        after = (page[-1][0], page[-1][1])
+    if remaining > 0:
+        undated = db.execute(
+            select(CurrentStock.batch_id, CurrentStock.quantity)
+            .join(Batch, Batch.batch_id == CurrentStock.batch_id)
+            .where(
+                CurrentStock.product_id == product_id,
+                CurrentStock.location_id == location_id,
+                CurrentStock.quantity > 0,
+                Batch.expiry_date.is_(None),
+            )
+            .order_by(CurrentStock.batch_id)
+        ).all()
+        for batch_id, units in undated:
+            take = min(units, remaining)
+            allocations.append((batch_id, take))
+            remaining -= take
+            if not remaining:
+                break
+    if remaining > 0:
+        raise InsufficientStockError(
+            product_id, None, location_id, quantity, quantity - remaining
+        )
+    return allocations
+
+
+def _allocated_movement_changes(db: Session, data: dict) -> list[StockMovement]:
+    if data.get("batch_id"):
+        return [_movement_changes(db, data)]
+    if not data.get("source_location_id"):
+        raise ValueError("batch_id is required for movements without a source")
+    allocations = allocate_fefo(
+        db, data["product_id"], data["source_location_id"], data["quantity"]
+    )
+    ids = _allocation_ids(
+        db, StockMovement.movement_id, data["movement_id"], len(allocations)
+    )
+    return [
+        _movement_changes(
+            db,
+            {
+                **data,
+                "movement_id": movement_id,
+                "batch_id": batch_id,
+                "quantity": units,
+            },
+        )
+        for movement_id, (batch_id, units) in zip(ids, allocations)
+    ]
+
+
+def _allocated_sale_changes(db: Session, data: dict) -> list[RetailSale]:
+    location_id = None
+    if not data.get("batch_id"):
+        location_id = _partner_location_id(db, data["store_id"])
+    if not location_id:
+        return [_retail_sale_changes(db, data)]
+    allocations = allocate_fefo(
+        db, data["product_id"], location_id, data["quantity_sold"]
+    )
+    ids = _allocation_ids(db, RetailSale.sale_id, data["sale_id"], len(allocations))
+    return [
+        _retail_sale_changes(
+            db,
+            {**data, "sale_id": sale_id, "batch_id": batch_id, "quantity_sold": units},
+        )
+        for sale_id, (batch_id, units) in zip(ids, allocations)
+    ]
+
+
+def _allocation_rows(rows, id_attr: str, quantity_attr: str) -> list[dict]:
+    return [
+        {
+            id_attr: getattr(r, id_attr),
+            "batch_id": r.batch_id,
+            "quantity": getattr(r, quantity_attr),
+        }
+        for r in rows
+    ]
+
+
+# --- Stock alerts ---
+# WHY: the Alert Center and store low-stock badges need threshold breaches
+#      without scanning current_stock and batches
+# WHAT: low_stock alerts per (store location, product) against
+#       reorder_thresholds and expiring/expired alerts per stock row from the
+#       expiry calendar; an alert resolves itself once its condition clears
+# HOW: stock write paths call stock_rows_changed() with the keys they touched,
+#      so evaluation cost follows write volume; `python main.py sweep-alerts`
+#      (daily from cron) catches untouched stock crossing an expiry threshold;
+#      GET /alerts pages the feed
+ALERT_TYPES = ("low_stock", "expiring", "expired")
+ALERT_STATUSES = ("active", "open", "acknowledged", "resolved", "all")
+
+
+def _key_terms(columns, keys):
+    """OR of equality terms matching each tuple in ``keys`` against ``columns``."""
+    return or_(*[and_(*[c == v for c, v in zip(columns, key)]) for key in keys])
+
+
+def evaluate_stock_alerts(
+    db: Session, keys, today: date | None = None
+) -> list[StockAlert]:
+    """Open or resolve alerts for touched (product, batch, location) keys.
+
+    Runs inside the caller's transaction after current_stock and the expiry
+    calendar are updated. A ``None`` batch re-checks only the low-stock
+    threshold. Returns the alerts opened.
+    """
+    keys = set(keys)
+    if not keys:
+        return []
+    db.flush()
+    today = today or date.today()
+    store_of = {}
+    for chunk in _chunks(list({loc for _, _, loc in keys})):
+        store_of.update(
+            db.query(RetailPartner.location_id, RetailPartner.store_id).filter(
+                RetailPartner.location_id.in_(chunk)
+            )
+        )
+
+    wanted: dict[tuple, dict] = {}
+    low_scope = sorted({(loc, p) for p, _, loc in keys if loc in store_of})
+    for chunk in _chunks(low_scope):
+        thresholds = {
+            (sid, p): minimum
+            for sid, p, minimum in db.query(
+                ReorderThreshold.store_id,
+                ReorderThreshold.product_id,
+                ReorderThreshold.min_quantity,
+            ).filter(
+                _key_terms(
+                    (ReorderThreshold.store_id, ReorderThreshold.product_id),
+                    [(store_of[loc], p) for loc, p in chunk],
+                )
+            )
+        }
+        if not thresholds:
+            continue
+        on_hand = {
+            (loc, p): qty
+            for loc, p, qty in db.query(
+                CurrentStock.location_id,
+                CurrentStock.product_id,
+                func.sum(CurrentStock.quantity),
+            )
             .filter(
-                CurrentStock.product_id == movement.product_id,
-                CurrentStock.batch_id == movement.batch_id,
-                CurrentStock.location_id == movement.destination_location_id,
+                _key_terms((CurrentStock.location_id, CurrentStock.product_id), chunk)
             )
-            .first()
+            .group_by(CurrentStock.location_id, CurrentStock.product_id)
+        }
+        for loc, p in chunk:
+            minimum = thresholds.get((store_of[loc], p))
+            quantity = on_hand.get((loc, p)) or 0
+            if minimum is not None and quantity < minimum:
+                wanted[("low_stock", loc, p, None)] = {
+                    "quantity": quantity,
+                    "threshold": minimum,
+                }
+
+    expiry_scope = sorted((loc, p, b) for p, b, loc in keys if b)
+    for chunk in _chunks(expiry_scope):
+        for row in db.query(ExpiryCalendar).filter(
+            _key_terms(
+                (
+                    ExpiryCalendar.location_id,
+                    ExpiryCalendar.product_id,
+                    ExpiryCalendar.batch_id,
+                ),
+                chunk,
+            )
+        ):
+            status = expiry_status(row.expiry_date, today)
+            if status != "green":
+                alert_type = "expired" if status == "red" else "expiring"
+                wanted[(alert_type, row.location_id, row.product_id, row.batch_id)] = {
+                    "quantity": row.quantity,
+                    "expiry_date": row.expiry_date,
+                }
+
+    low_scope = set(low_scope)
+    expiry_scope = set(expiry_scope)
+    existing = {}
+    pairs = sorted(low_scope | {(loc, p) for loc, p, _ in expiry_scope})
+    for chunk in _chunks(pairs):
+        for alert in db.query(StockAlert).filter(
+            StockAlert.resolved_at.is_(None),
+            _key_terms((StockAlert.location_id, StockAlert.product_id), chunk),
+        ):
+            if alert.alert_type == "low_stock":
+                in_scope = (alert.location_id, alert.product_id) in low_scope
+            else:
+                in_scope = (
+                    alert.location_id,
+                    alert.product_id,
+                    alert.batch_id,
+                ) in expiry_scope
+            if in_scope:
+                key = (alert.alert_type, alert.location_id, alert.product_id)
+                existing[key + (alert.batch_id,)] = alert
+
+    now = datetime.now()
+    for key, alert in existing.items():
+        if key in wanted:
+            alert.quantity = wanted[key]["quantity"]
+        else:
+            alert.resolved_at = now
+    opened = []
+    for key, values in wanted.items():
+        if key in existing:
+            continue
+        alert_type, loc, p, b = key
+        alert = StockAlert(
+            alert_type=alert_type,
+            store_id=store_of.get(loc),
+            location_id=loc,
+            product_id=p,
+            batch_id=b,
+            created_at=now,
+            **values,
+        )
+        db.add(alert)
+        opened.append(alert)
+    if opened and has_event_subscribers():
+        db.flush()
+        queue_event(
+            db,
+            "alert",
+            [_row_dict(alert) for alert in opened],
+            [(alert.location_id,) for alert in opened],
+        )
+    return opened
+
+
+def sweep_expiry_alerts(db: Session, today: date | None = None) -> list[StockAlert]:
+    """Re-check expiry alerts for all stock due within EXPIRY_WARNING_DAYS.
+
+    Write paths only evaluate the rows they touch, so stock nobody moves
+    would never turn expiring or expired; run this once a day. Commits and
+    returns the alerts opened.
+    """
+    today = today or date.today()
+    cutoff = today + timedelta(days=EXPIRY_WARNING_DAYS)
+    keys = db.query(
+        ExpiryCalendar.product_id,
+        ExpiryCalendar.batch_id,
+        ExpiryCalendar.location_id,
+    ).filter(ExpiryCalendar.expiry_date <= cutoff)
+    opened = evaluate_stock_alerts(db, [tuple(k) for k in keys], today)
+    db.commit()
+    bump_table_versions("stock_alerts")
+    return opened
+
+
+def stock_rows_changed(db: Session, keys) -> None:
+    """Update state derived from current_stock for touched keys before commit.
+
+    Inside a write-pipeline window the keys are collected and processed once
+    for the whole window just before it commits.
+    """
+    keys = set(keys)
+    deferred = db.info.get("deferred_stock_keys")
+    if deferred is not None:
+        deferred.update(keys)
+        return
+    refresh_expiry_calendar(db, keys)
+    evaluate_stock_alerts(db, keys)
+    if has_event_subscribers():
+        rows = [
+            {"product_id": p, "batch_id": b, "location_id": loc, "quantity": qty}
+            for (p, b, loc), (_, qty) in _load_stock_rows(db, keys).items()
+        ]
+        queue_event(db, "stock", rows, [(row["location_id"],) for row in rows])
+
+
+def get_alert_feed(
+    db: Session,
+    limit: int = 50,
+    after: int | None = None,
+    status: str = "active",
+    alert_type: str | None = None,
+    store_id: str | None = None,
+    location_id: str | None = None,
+):
+    """Return one page of alerts, newest first, keyed by alert_id."""
+    query = db.query(StockAlert)
+    if status == "active":
+        query = query.filter(StockAlert.resolved_at.is_(None))
+    elif status == "open":
+        query = query.filter(
+            StockAlert.resolved_at.is_(None), StockAlert.acknowledged_at.is_(None)
+        )
+    elif status == "acknowledged":
+        query = query.filter(
+            StockAlert.resolved_at.is_(None), StockAlert.acknowledged_at.is_not(None)
+        )
+    elif status == "resolved":
+        query = query.filter(StockAlert.resolved_at.is_not(None))
+    if alert_type:
+        query = query.filter(StockAlert.alert_type == alert_type)
+    if store_id:
+        query = query.filter(StockAlert.store_id == store_id)
+    if location_id:
+        query = query.filter(StockAlert.location_id == location_id)
+    if after:
+        query = query.filter(StockAlert.alert_id < after)
+    return query.order_by(StockAlert.alert_id.desc()).limit(limit).all()
+
+
+def acknowledge_alert(db: Session, alert: StockAlert, username: str) -> StockAlert:
+    if alert.acknowledged_at is None:
+        alert.acknowledged_at = datetime.now()
+        alert.acknowledged_by = username
+        db.commit()
+        bump_table_versions("stock_alerts")
+    return alert
+
+
+def set_reorder_thresholds(db: Session, rows: list[dict]) -> int:
+    """Insert or update thresholds and re-check the affected store stock.
+
+    Raises ValueError, writing nothing, if a ``store_id`` is not a retail
+    partner.
+    """
+    stores = {r["store_id"] for r in rows}
+    locations = dict(
+        db.query(RetailPartner.store_id, RetailPartner.location_id).filter(
+            RetailPartner.store_id.in_(stores)
+        )
+    )
+    unknown = stores - locations.keys()
+    if unknown:
+        raise ValueError(f"Unknown store_id: {', '.join(sorted(unknown))}")
+    table = ReorderThreshold.__table__
+    upsert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if upsert and rows:
+        stmt = upsert(table)
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["store_id", "product_id"],
+                set_={"min_quantity": stmt.excluded.min_quantity},
+            ),
+            rows,
         )
+    else:
+        for row in rows:
+            db.merge(ReorderThreshold(**row))
+    evaluate_stock_alerts(
+        db, [(r["product_id"], None, locations[r["store_id"]]) for r in rows]
+    )
+    db.commit()
+    bump_table_versions("reorder_thresholds", "stock_alerts")
+    return len(rows)
+
+
+def get_reorder_thresholds(db: Session, store_id: str | None = None):
+    query = db.query(ReorderThreshold)
+    if store_id:
+        query = query.filter(ReorderThreshold.store_id == store_id)
+    return query.order_by(ReorderThreshold.store_id, ReorderThreshold.product_id).all()
+
+
+def create_movements_bulk(db: Session, rows: list[dict]) -> list[dict]:
+    """Validate and apply many movements in a single transaction.
+
+    Each row is checked against the database and against earlier rows in the
+    same request; stock changes are collapsed into one net delta per
+    (product, batch, location) and applied by apply_stock_deltas. Returns one
+    result dict per input row, in order. Raises InsufficientStockError, with
+    nothing recorded, if a concurrent write took the stock after the checks.
+    """
+    movement_ids = _existing_ids(
+        db, StockMovement.movement_id, [r["movement_id"] for r in rows]
+    )
+    products = _existing_ids(db, Product.product_id, [r["product_id"] for r in rows])
+    batches = _existing_ids(db, Batch.batch_id, [r["batch_id"] for r in rows])
+    locations = _existing_ids(
+        db,
+        Location.location_id,
+        [
+            loc
+            for r in rows
+            for loc in (r.get("source_location_id"), r.get("destination_location_id"))
+            if loc
+        ],
+    )
+    keys = {
+        (r["product_id"], r["batch_id"], r["source_location_id"])
+        for r in rows
+        if r.get("source_location_id")
+    } | {
+        (r["product_id"], r["batch_id"], r["destination_location_id"])
+        for r in rows
+        if r.get("destination_location_id")
+    }
+    stock = _load_stock_rows(db, keys)
+
+    results = []
+    accepted = []
+    seen = set()
+    deltas: dict[tuple[str, str, str], int] = {}
+    for idx, row in enumerate(rows):
+        src = row.get("source_location_id")
+        dest = row.get("destination_location_id")
+        error = None
+        if row["movement_id"] in movement_ids or row["movement_id"] in seen:
+            error = "Movement ID already exists"
+        elif row["quantity"] <= 0:
+            error = "Quantity must be positive"
+        elif not src and not dest:
+            error = "Source or destination location required"
+        elif row["product_id"] not in products:
+            error = "Unknown product"
+        elif not row["batch_id"]:
+            error = "Batch required for bulk movements"
+        elif row["batch_id"] not in batches:
+            error = "Unknown batch"
+        elif (src and src not in locations) or (dest and dest not in locations):
+            error = "Unknown location"
+        elif src:
+            key = (row["product_id"], row["batch_id"], src)
+            available = stock.get(key, (None, 0))[1] + deltas.get(key, 0)
+            if available < row["quantity"]:
+                error = "Insufficient stock"
+        if error:
+            results.append(
+                {
+                    "index": idx,
+                    "movement_id": row["movement_id"],
+                    "status": "rejected",
+                    "detail": error,
+                }
+            )
+            continue
+        seen.add(row["movement_id"])
+        accepted.append(row)
+        if src:
+            key = (row["product_id"], row["batch_id"], src)
+            deltas[key] = deltas.get(key, 0) - row["quantity"]
         if dest:
-            dest.quantity += movement.quantity
+            key = (row["product_id"], row["batch_id"], dest)
+            deltas[key] = deltas.get(key, 0) + row["quantity"]
+        results.append(
+            {"index": idx, "movement_id": row["movement_id"], "status": "created"}
+        )
+
+    if not accepted:
+        return results
+
+    def work():
+        db.execute(StockMovement.__table__.insert(), accepted)
+        queue_event(
+            db,
+            "movement",
+            accepted,
+            [
+                (r.get("source_location_id"), r.get("destination_location_id"))
+                for r in accepted
+            ],
+        )
+        apply_stock_deltas(db, deltas)
+        db.commit()
+
+    # the checks above read a snapshot; the guarded decrements are what keep
+    # stock from going negative, and any shortfall rolls the request back
+    run_stock_write(db, work)
+    bump_table_versions("current_stock", "stock_movements", "stock_alerts")
+    return results
+
+
+def apply_stock_deltas(db: Session, deltas: dict[tuple[str, str, str], int]) -> None:
+    """Apply net stock changes per key in the caller's transaction.
+
+    Decrements are guarded (``quantity >= n``) and run as one executemany;
+    if any row is short they are replayed one by one to raise
+    InsufficientStockError for it. Increments are upserts.
+    """
+    table = CurrentStock.__table__
+    taken = [(key, -delta) for key, delta in deltas.items() if delta < 0]
+    added = [(key, delta) for key, delta in deltas.items() if delta > 0]
+    if taken:
+        begin_write(db)
+        savepoint = db.begin_nested()
+        result = db.execute(
+            table.update()
+            .where(
+                table.c.product_id == bindparam("b_product_id"),
+                table.c.batch_id == bindparam("b_batch_id"),
+                table.c.location_id == bindparam("b_location_id"),
+                table.c.quantity >= bindparam("b_quantity"),
+            )
+            .values(
+                quantity=table.c.quantity - bindparam("b_quantity"),
+                last_updated=func.now(),
+            ),
+            [
+                {
+                    "b_product_id": p,
+                    "b_batch_id": b,
+                    "b_location_id": loc,
+                    "b_quantity": qty,
+                }
+                for (p, b, loc), qty in taken
+            ],
+        )
+        if (
+            db.get_bind().dialect.supports_sane_multi_rowcount
+            and result.rowcount == len(taken)
+        ):
+            savepoint.commit()
         else:
-            dest = CurrentStock(
-                stock_id=f"{movement.batch_id}-{movement.destination_location_id}",
-                product_id=movement.product_id,
-                batch_id=movement.batch_id,
-                location_id=movement.destination_location_id,
-                quantity=movement.quantity,
+            savepoint.rollback()
+            for key, qty in taken:
+                decrement_stock(db, *key, qty)
+    upsert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if upsert and added:
+        stmt = upsert(table)
+        db.execute(
+            stmt.on_conflict_do_update(
+                index_elements=["product_id", "batch_id", "location_id"],
+                set_={
+                    "quantity": table.c.quantity + stmt.excluded.quantity,
+                    "last_updated": stmt.excluded.last_updated,
+                },
+            ),
+            [
+                {
+                    "stock_id": _stock_id(*key),
+                    "product_id": key[0],
+                    "batch_id": key[1],
+                    "location_id": key[2],
+                    "quantity": qty,
+                    "last_updated": datetime.now(),
+                }
+                for key, qty in added
+            ],
+        )
+    else:
+        for key, qty in added:
+            increment_stock(db, *key, qty)
+    stock_rows_changed(db, [key for key, _ in taken + added])
+
+
+def _retail_sale_changes(db: Session, data: dict) -> RetailSale:
+    sale = RetailSale(**data)
+    db.add(sale)
+    invalidate_stock_snapshots(db, sale.sale_date)
+    location_id = _partner_location_id(db, sale.store_id)
+    queue_event(
+        db,
+        "sale",
+        [{**_row_dict(sale), "location_id": location_id}],
+        [(location_id,)],
+    )
+    db.flush()
+    if location_id and sale.batch_id:
+        decrement_stock(
+            db, sale.product_id, sale.batch_id, location_id, sale.quantity_sold
+        )
+        stock_rows_changed(db, [(sale.product_id, sale.batch_id, location_id)])
+    return sale
+
+
+def create_retail_sale(db: Session, data: dict) -> list[RetailSale]:
+    """Record a sale and take its units from the store's stock.
+
+    Without a ``batch_id`` the quantity is allocated FEFO and one sale row is
+    written per batch used. Raises InsufficientStockError when the store
+    does not hold enough stock; nothing is recorded in that case.
+    """
+
+    def work():
+        sales = _allocated_sale_changes(db, data)
+        db.commit()
+        return sales
+
+    sales = run_stock_write(db, work)
+    bump_table_versions("retail_sales", "current_stock", "stock_alerts")
+    return sales
+
+
+# WHY: stores send end-of-day POS exports; posting one sale per request with a
+#      commit each cannot keep up with a day's sales from every store
+# WHAT: stream-parse the CSV in fixed-size chunks, resolve stores once per file
+#       and apply stock decrements per chunk with set-based statements
+# HOW: POST /retail-sales/import (text/csv body) or `python main.py import-sales`
+SALES_IMPORT_CHUNK = 1000
+SALES_IMPORT_MAX_ERRORS = 100
+
+
+def _parse_sale_row(row: dict) -> dict:
+    price = (row.get("sale_price_per_unit") or "").strip()
+    quantity = int(row["quantity_sold"])
+    if quantity <= 0:
+        raise ValueError("quantity_sold must be positive")
+    return {
+        "sale_id": row["sale_id"].strip(),
+        "sale_date": date.fromisoformat(row["sale_date"].strip()),
+        "store_id": row["store_id"].strip(),
+        "product_id": row["product_id"].strip(),
+        "batch_id": (row.get("batch_id") or "").strip() or None,
+        "quantity_sold": quantity,
+        "sales_agent_id": (row.get("sales_agent_id") or "").strip() or None,
+        "sale_price_per_unit": float(price) if price else None,
+        "remarks": (row.get("remarks") or "").strip() or None,
+    }
+
+
+def _reject_sale(report: dict, line: int, detail: str) -> None:
+    report["rejected"] += 1
+    if len(report["errors"]) < SALES_IMPORT_MAX_ERRORS:
+        report["errors"].append({"line": line, "detail": detail})
+
+
+def _apply_sales_chunk(
+    db: Session, chunk: list[tuple[int, dict]], store_locations: dict, report: dict
+) -> None:
+    """Record a chunk of sales and take their units from store stock.
+
+    Each line is taken with the guarded decrement; lines without a batch are
+    allocated FEFO and recorded as one sale row per batch used. A line the
+    store cannot cover is rejected and not recorded. The chunk commits once.
+    """
+    existing = _existing_ids(db, RetailSale.sale_id, [r["sale_id"] for _, r in chunk])
+    pending = []
+    for line, sale in chunk:
+        if sale["sale_id"] in existing:
+            _reject_sale(report, line, "Sale ID already exists")
+            continue
+        existing.add(sale["sale_id"])
+        pending.append((line, sale))
+    if not pending:
+        return
+
+    def take(sale: dict, location_id: str, claimed: set) -> list[dict]:
+        if sale["batch_id"]:
+            decrement_stock(
+                db,
+                sale["product_id"],
+                sale["batch_id"],
+                location_id,
+                sale["quantity_sold"],
+            )
+            return [sale]
+        rows = []
+        allocations = allocate_fefo(
+            db, sale["product_id"], location_id, sale["quantity_sold"]
+        )
+        ids = [_allocation_id(sale["sale_id"], n) for n in range(len(allocations))]
+        taken = claimed.intersection(ids[1:]) | _existing_ids(
+            db, RetailSale.sale_id, ids[1:]
+        )
+        if taken:
+            raise DuplicateIdError(taken)
+        for sale_id, (batch_id, units) in zip(ids, allocations):
+            decrement_stock(db, sale["product_id"], batch_id, location_id, units)
+            rows.append(
+                {
+                    **sale,
+                    "sale_id": sale_id,
+                    "batch_id": batch_id,
+                    "quantity_sold": units,
+                }
+            )
+        return rows
+
+    def work():
+        accepted, rejected = [], []
+        # ids of this chunk's lines and of rows split off earlier in it
+        claimed = {sale["sale_id"] for _, sale in pending}
+        # allocate_fefo refreshes the calendar for keys taken earlier in the
+        # chunk; alerts and events run once for the chunk below
+        touched = db.info["deferred_stock_keys"] = set()
+        begin_write(db)
+        try:
+            for line, sale in pending:
+                location_id = store_locations[sale["store_id"]]
+                savepoint = db.begin_nested()
+                try:
+                    rows = take(sale, location_id, claimed)
+                except InsufficientStockError as exc:
+                    savepoint.rollback()
+                    rejected.append(
+                        (
+                            line,
+                            f"Insufficient stock: requested {exc.requested}, "
+                            f"available {exc.available}",
+                        )
+                    )
+                    continue
+                except DuplicateIdError as exc:
+                    savepoint.rollback()
+                    rejected.append((line, str(exc)))
+                    continue
+                savepoint.commit()
+                claimed.update(row["sale_id"] for row in rows)
+                touched.update(
+                    (row["product_id"], row["batch_id"], location_id) for row in rows
+                )
+                accepted.extend(rows)
+        finally:
+            db.info.pop("deferred_stock_keys", None)
+        if accepted:
+            db.execute(RetailSale.__table__.insert(), accepted)
+            queue_event(
+                db,
+                "sale",
+                [
+                    {**sale, "location_id": store_locations[sale["store_id"]]}
+                    for sale in accepted
+                ],
+                [(store_locations[sale["store_id"]],) for sale in accepted],
             )
-            db.add(dest)
+            invalidate_stock_snapshots(db, min(sale["sale_date"] for sale in accepted))
+            stock_rows_changed(db, touched)
+        db.commit()
+        return accepted, rejected
+
+    accepted, rejected = run_stock_write(db, work)
+    for line, detail in rejected:
+        _reject_sale(report, line, detail)
+    if accepted:
+        bump_table_versions("retail_sales", "current_stock", "stock_alerts")
+    report["imported"] += len(pending) - len(rejected)
+
+
+def import_sales_csv(db: Session, lines, chunk_size: int = SALES_IMPORT_CHUNK) -> dict:
+    """Import retail sales from CSV text lines with a header row.
+
+    Columns follow ``RetailSaleCreate``. Rows are processed and committed in
+    chunks of ``chunk_size`` so memory stays flat for any file size. Returns
+    counts plus the first ``SALES_IMPORT_MAX_ERRORS`` rejected lines.
+    """
+    store_locations = dict(
+        db.query(RetailPartner.store_id, RetailPartner.location_id).all()
+    )
+    products = {pid for (pid,) in db.query(Product.product_id)}
+    report = {"imported": 0, "rejected": 0, "errors": []}
+    chunk = []
+    reader = csv.DictReader(lines)
+    for row in reader:
+        line = reader.line_num
+        try:
+            sale = _parse_sale_row(row)
+        except (KeyError, TypeError, ValueError) as exc:
+            _reject_sale(report, line, f"Invalid row: {exc}")
+            continue
+        if sale["store_id"] not in store_locations:
+            _reject_sale(report, line, "Unknown store")
+        elif sale["product_id"] not in products:
+            _reject_sale(report, line, "Unknown product")
+        else:
+            chunk.append((line, sale))
+        if len(chunk) >= chunk_size:
+            _apply_sales_chunk(db, chunk, store_locations, report)
+            chunk = []
+    if chunk:
+        _apply_sales_chunk(db, chunk, store_locations, report)
+    return report
+
+
+# WHY: the monthly stock report needs units per product/batch/location as of
+#      a past date; replaying the whole movement log gets slower every month
+# WHAT: month-end snapshots of the stock ledger plus replay of only the
+#       production, movements and sales dated after the nearest snapshot
+# HOW: `python main.py snapshot-stock` (daily from cron) creates missing
+#      month-end snapshots; GET /reports/stock?as_of= only reads them.
+#      Back-dated writes drop snapshots they would change
+SNAPSHOT_GRACE_DAYS = 7
+CENTRAL_WAREHOUSE_ID = "MAIN_WH"
+
+StockKey = tuple[str, str, str]
+
+
+def invalidate_stock_snapshots(db: Session, since: date) -> None:
+    """Drop snapshots dated on or after ``since``; caller commits."""
+    if since >= date.today():
+        return
+    db.query(StockSnapshot).filter(StockSnapshot.snapshot_date >= since).delete(
+        synchronize_session=False
+    )
+    db.query(StockSnapshotPeriod).filter(
+        StockSnapshotPeriod.snapshot_date >= since
+    ).delete(synchronize_session=False)
+
+
+def _stock_deltas(db: Session, after: date | None, until: date) -> dict[StockKey, int]:
+    """Net ledger change per key for events dated in (after, until]."""
+    start = after + timedelta(days=1) if after else None
+    end = until + timedelta(days=1)
+    deltas: dict[StockKey, int] = {}
+
+    def add(rows, sign=1):
+        for product_id, batch_id, location_id, qty in rows:
+            key = (product_id, batch_id, location_id)
+            deltas[key] = deltas.get(key, 0) + sign * int(qty)
+
+    produced = (
+        db.query(
+            BatchProduct.product_id,
+            BatchProduct.batch_id,
+            literal(CENTRAL_WAREHOUSE_ID),
+            func.sum(BatchProduct.quantity_produced),
+        )
+        .join(Batch, Batch.batch_id == BatchProduct.batch_id)
+        .filter(Batch.date_manufactured <= until)
+    )
+    if start:
+        produced = produced.filter(Batch.date_manufactured >= start)
+    add(produced.group_by(BatchProduct.product_id, BatchProduct.batch_id))
+    for column, sign in (
+        (StockMovement.destination_location_id, 1),
+        (StockMovement.source_location_id, -1),
+    ):
+        moved = db.query(
+            StockMovement.product_id,
+            StockMovement.batch_id,
+            column,
+            func.sum(StockMovement.quantity),
+        ).filter(StockMovement.movement_date < end, column != None)
+        if start:
+            moved = moved.filter(StockMovement.movement_date >= start)
+        add(
+            moved.group_by(StockMovement.product_id, StockMovement.batch_id, column),
+            sign,
+        )
+    sold = (
+        db.query(
+            RetailSale.product_id,
+            RetailSale.batch_id,
+            RetailPartner.location_id,
+            func.sum(RetailSale.quantity_sold),
+        )
+        .join(RetailPartner, RetailPartner.store_id == RetailSale.store_id)
+        .filter(RetailSale.sale_date <= until, RetailSale.batch_id != None)
+    )
+    if start:
+        sold = sold.filter(RetailSale.sale_date >= start)
+    add(
+        sold.group_by(
+            RetailSale.product_id, RetailSale.batch_id, RetailPartner.location_id
+        ),
+        -1,
+    )
+    return deltas
+
+
+def compute_stock_as_of(db: Session, as_of: date) -> tuple[date | None, dict]:
+    """Return (snapshot used, units per key) at the end of ``as_of``."""
+    snapshot_date = (
+        db.query(func.max(StockSnapshotPeriod.snapshot_date))
+        .filter(StockSnapshotPeriod.snapshot_date <= as_of)
+        .scalar()
+    )
+    stock: dict[StockKey, int] = {}
+    if snapshot_date:
+        for product_id, batch_id, location_id, qty in db.query(
+            StockSnapshot.product_id,
+            StockSnapshot.batch_id,
+            StockSnapshot.location_id,
+            StockSnapshot.quantity,
+        ).filter(StockSnapshot.snapshot_date == snapshot_date):
+            stock[(product_id, batch_id, location_id)] = qty
+    for key, delta in _stock_deltas(db, snapshot_date, as_of).items():
+        stock[key] = stock.get(key, 0) + delta
+    return snapshot_date, {k: v for k, v in stock.items() if v}
+
+
+def create_stock_snapshot(db: Session, snapshot_date: date) -> int:
+    """Persist the ledger state at ``snapshot_date``; return rows written."""
+    _, stock = compute_stock_as_of(db, snapshot_date)
+    invalidate_stock_snapshots(db, snapshot_date)
+    table = StockSnapshotPeriod.__table__
+    values = {"snapshot_date": snapshot_date, "created_at": datetime.now()}
+    upsert = _UPSERT_INSERTS.get(db.get_bind().dialect.name)
+    if upsert:
+        claimed = db.execute(
+            upsert(table).values(**values).on_conflict_do_nothing()
+        ).rowcount
+    else:
+        try:
+            with db.begin_nested():
+                db.execute(table.insert().values(**values))
+            claimed = 1
+        except IntegrityError:
+            claimed = 0
+    if not claimed:
+        # a concurrent run wrote this snapshot first
+        db.rollback()
+        return 0
+    if stock:
+        db.execute(
+            StockSnapshot.__table__.insert(),
+            [
+                {
+                    "snapshot_date": snapshot_date,
+                    "product_id": p,
+                    "batch_id": b,
+                    "location_id": loc,
+                    "quantity": qty,
+                }
+                for (p, b, loc), qty in stock.items()
+            ],
+        )
     db.commit()
+    return len(stock)
+
+
+def _month_end(day: date) -> date:
+    first_next = (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return first_next - timedelta(days=1)
+
+
+def ensure_month_end_snapshots(db: Session, up_to: date) -> list[date]:
+    """Create missing month-end snapshots up to ``up_to``; return new dates.
+
+    Only month ends at least SNAPSHOT_GRACE_DAYS old are snapshotted so late
+    end-of-day imports are unlikely to invalidate them.
+    """
+    limit = min(up_to, date.today() - timedelta(days=SNAPSHOT_GRACE_DAYS))
+    latest = db.query(func.max(StockSnapshotPeriod.snapshot_date)).scalar()
+    if latest:
+        month_end = _month_end(latest + timedelta(days=1))
+    else:
+        firsts = [
+            db.query(func.min(Batch.date_manufactured)).scalar(),
+            db.query(func.min(StockMovement.movement_date)).scalar(),
+            db.query(func.min(RetailSale.sale_date)).scalar(),
+        ]
+        firsts = [f.date() if isinstance(f, datetime) else f for f in firsts if f]
+        if not firsts:
+            return []
+        month_end = _month_end(min(firsts))
+    created = []
+    while month_end <= limit:
+        create_stock_snapshot(db, month_end)
+        created.append(month_end)
+        month_end = _month_end(month_end + timedelta(days=1))
+    return created
+
+
+# WHY: the stock heatmap would otherwise take one request per store
+# WHAT: one grouped query of current_stock by store and product returned as a
+#       dense row-major matrix, cached until the stored versions of stock,
+#       stores or products change (so writes by other processes count too)
+# HOW: GET /dashboard/stock-heatmap
+HEATMAP_TABLES = ("current_stock", "retail_partners", "products")
+_heatmap_cache: dict[str, tuple] = {}
+
+
+def get_stock_heatmap(db: Session) -> dict:
+    """Units on hand per store (rows) and product (columns)."""
+    version = stored_table_versions(db, *HEATMAP_TABLES)
+    cached = _heatmap_cache.get("heatmap")
+    if cached and cached[0] == version:
+        return cached[1]
+    stores = [
+        sid
+        for (sid,) in db.query(RetailPartner.store_id).order_by(RetailPartner.store_id)
+    ]
+    products = [
+        pid for (pid,) in db.query(Product.product_id).order_by(Product.product_id)
+    ]
+    row_of = {sid: i for i, sid in enumerate(stores)}
+    col_of = {pid: j for j, pid in enumerate(products)}
+    values = [0] * (len(stores) * len(products))
+    cells = (
+        db.query(
+            RetailPartner.store_id,
+            CurrentStock.product_id,
+            func.sum(CurrentStock.quantity),
+        )
+        .join(RetailPartner, RetailPartner.location_id == CurrentStock.location_id)
+        .group_by(RetailPartner.store_id, CurrentStock.product_id)
+    )
+    for store_id, product_id, qty in cells:
+        if product_id in col_of:
+            values[row_of[store_id] * len(products) + col_of[product_id]] = int(qty)
+    heatmap = {
+        "rows": stores,
+        "columns": products,
+        "shape": [len(stores), len(products)],
+        "values": values,
+    }
+    _heatmap_cache["heatmap"] = (version, heatmap)
+    return heatmap
+
+
+# WHY: stores should reorder before they sell out, based on their own demand
+# WHAT: daily demand per (store, product) over the last FORECAST_HISTORY_DAYS,
+#       smoothed by exponential smoothing or a simple moving average, turned
+#       into days of cover and order-up-to quantities for all series at once
+# HOW: GET /forecast/reorder; cached (one entry per method) until the day or
+#      the stored versions of sales, movements, stock, stores or products
+#      change. POST /retail-sales/import re-warms it in a background task
+FORECAST_HISTORY_DAYS = int(os.getenv("FORECAST_HISTORY_DAYS", "56"))
+FORECAST_ALPHA = float(os.getenv("FORECAST_ALPHA", "0.2"))
+REORDER_LEAD_DAYS = int(os.getenv("REORDER_LEAD_DAYS", "7"))
+REORDER_TARGET_DAYS = int(os.getenv("REORDER_TARGET_DAYS", "21"))
+FORECAST_TABLES = (
+    "retail_sales",
+    "stock_movements",
+    "current_stock",
+    "retail_partners",
+    "products",
+)
+FORECAST_METHODS = ("ewma", "sma")
+_forecast_cache: dict[str, tuple] = {}
 
 
-def create_retail_sale(db: Session, data: dict) -> RetailSale:
-    sale = RetailSale(**data)
-    db.add(sale)
-    partner = (
-        db.query(RetailPartner).filter(RetailPartner.store_id == sale.store_id).first()
+def _forecast_weights(days: int, method: str, alpha: float) -> np.ndarray:
+    """Per-day weights whose dot product with a series gives its demand rate."""
+    if method == "sma":
+        return np.full(days, 1.0 / days)
+    # exponential smoothing seeded with the first day, unrolled into weights
+    weights = alpha * (1 - alpha) ** np.arange(days - 1, -1, -1, dtype=float)
+    weights[0] = (1 - alpha) ** (days - 1)
+    return weights
+
+
+def _fill_cube(cube: np.ndarray, rows, store_of, product_of, start: date) -> None:
+    day_of: dict = {}
+    cells = []
+    for sid, pid, day, qty in rows:
+        if pid not in product_of:
+            continue
+        if day not in day_of:
+            day_of[day] = (date.fromisoformat(str(day)[:10]) - start).days
+        cells.append((store_of[sid], product_of[pid], day_of[day], qty))
+    if cells:
+        s, p, d, qty = np.array(cells, dtype=np.int64).T
+        np.add.at(cube, (s, p, d), qty)
+
+
+def _demand_cube(db: Session, stores, products, start: date, days: int):
+    """Units per (store, product, day) and units on hand per (store, product).
+
+    Stores with no sales in the window fall back to the units dispatched to
+    them as their demand signal.
+    """
+    store_of = {sid: i for i, sid in enumerate(stores)}
+    product_of = {pid: j for j, pid in enumerate(products)}
+    shape = (len(stores), len(products), days)
+    sales = np.zeros(shape)
+    _fill_cube(
+        sales,
+        db.execute(
+            select(
+                RetailSale.store_id,
+                RetailSale.product_id,
+                RetailSale.sale_date,
+                func.sum(RetailSale.quantity_sold),
+            )
+            .where(
+                RetailSale.sale_date >= start,
+                RetailSale.sale_date < start + timedelta(days=days),
+            )
+            .group_by(RetailSale.store_id, RetailSale.product_id, RetailSale.sale_date)
+        ),
+        store_of,
+        product_of,
+        start,
     )
-    if partner:
-        stock = (
-            db.query(CurrentStock)
-            .filter(
-                CurrentStock.product_id == sale.product_id,
-                CurrentStock.batch_id == sale.batch_id,
-                CurrentStock.location_id == partner.location_id,
+    received = np.zeros(shape)
+    moved_on = func.date(StockMovement.movement_date)
+    _fill_cube(
+        received,
+        db.execute(
+            select(
+                RetailPartner.store_id,
+                StockMovement.product_id,
+                moved_on,
+                func.sum(StockMovement.quantity),
             )
-            .first()
+            .join(
+                RetailPartner,
+                RetailPartner.location_id == StockMovement.destination_location_id,
+            )
+            .where(
+                StockMovement.movement_date >= start,
+                StockMovement.movement_date < start + timedelta(days=days),
+            )
+            .group_by(RetailPartner.store_id, StockMovement.product_id, moved_on)
+        ),
+        store_of,
+        product_of,
+        start,
+    )
+    has_sales = sales.sum(axis=(1, 2)) > 0
+    demand = np.where(has_sales[:, None, None], sales, received)
+
+    on_hand = np.zeros(shape[:2])
+    for store_id, product_id, qty in (
+        db.query(
+            RetailPartner.store_id,
+            CurrentStock.product_id,
+            func.sum(CurrentStock.quantity),
         )
-        if stock:
-            stock.quantity = max(0, stock.quantity - sale.quantity_sold)
-    db.commit()
-    db.refresh(sale)
-    return sale
+        .join(RetailPartner, RetailPartner.location_id == CurrentStock.location_id)
+        .group_by(RetailPartner.store_id, CurrentStock.product_id)
+    ):
+        if product_id in product_of:
+            on_hand[store_of[store_id], product_of[product_id]] = qty
+    return demand, on_hand
+
+
+def compute_reorder_forecast(
+    db: Session,
+    method: str = "ewma",
+    history_days: int = FORECAST_HISTORY_DAYS,
+    alpha: float = FORECAST_ALPHA,
+) -> dict:
+    """Reorder suggestions per store for every (store, product) series.
+
+    A series is flagged when its days of cover fall below REORDER_LEAD_DAYS;
+    the suggested quantity tops it up to REORDER_LEAD_DAYS +
+    REORDER_TARGET_DAYS of demand.
+    """
+    today = date.today()
+    start = today - timedelta(days=history_days - 1)
+    stores = [
+        sid
+        for (sid,) in db.query(RetailPartner.store_id).order_by(RetailPartner.store_id)
+    ]
+    products = [
+        pid for (pid,) in db.query(Product.product_id).order_by(Product.product_id)
+    ]
+    demand, on_hand = _demand_cube(db, stores, products, start, history_days)
+    rate = demand @ _forecast_weights(history_days, method, alpha)
+    cover = np.divide(on_hand, rate, out=np.full(rate.shape, np.inf), where=rate > 0)
+    order_up_to = rate * (REORDER_LEAD_DAYS + REORDER_TARGET_DAYS)
+    reorder = np.where(
+        cover < REORDER_LEAD_DAYS, np.ceil(order_up_to - on_hand), 0
+    ).clip(min=0)
+
+    suggestions: dict[str, list[dict]] = {sid: [] for sid in stores}
+    flagged = np.nonzero(reorder)
+    for i, j in sorted(zip(*flagged), key=lambda ij: (ij[0], cover[ij])):
+        suggestions[stores[i]].append(
+            {
+                "product_id": products[j],
+                "daily_demand": round(float(rate[i, j]), 2),
+                "on_hand": int(on_hand[i, j]),
+                "days_of_cover": round(float(cover[i, j]), 1),
+                "reorder_quantity": int(reorder[i, j]),
+            }
+        )
+    return {
+        "as_of": today,
+        "method": method,
+        "history_days": history_days,
+        "lead_days": REORDER_LEAD_DAYS,
+        "target_days": REORDER_TARGET_DAYS,
+        "stores": suggestions,
+    }
 
 
-def get_store_current_stock_summary(db: Session, store_id: str):
-    partner = db.query(RetailPartner).filter(RetailPartner.store_id == store_id).first()
-    if not partner:
+def get_reorder_forecast(db: Session, method: str = "ewma") -> dict:
+    """Cached compute_reorder_forecast for today's default settings."""
+    if method not in FORECAST_METHODS:
+        raise ValueError(f"Unknown forecast method {method!r}")
+    key = (date.today(), stored_table_versions(db, *FORECAST_TABLES))
+    cached = _forecast_cache.get(method)
+    if cached and cached[0] == key:
+        return cached[1]
+    forecast = compute_reorder_forecast(db, method)
+    _forecast_cache[method] = (key, forecast)
+    return forecast
+
+
+def get_store_current_stock_summary(
+    db: Session, store_id: str, location_id: str | None = None
+):
+    location_id = location_id or _partner_location_id(db, store_id)
+    if not location_id:
         return []
-    return (
-        db.query(CurrentStock)
-        .filter(CurrentStock.location_id == partner.location_id)
-        .all()
-    )
+    return db.query(CurrentStock).filter(CurrentStock.location_id == location_id).all()
 
 
-def get_store_upcoming_deliveries(db: Session, store_id: str):
-    partner = db.query(RetailPartner).filter(RetailPartner.store_id == store_id).first()
-    if not partner:
+def get_store_upcoming_deliveries(
+    db: Session, store_id: str, location_id: str | None = None
+):
+    location_id = location_id or _partner_location_id(db, store_id)
+    if not location_id:
         return []
     today = date.today()
     return (
         db.query(StockMovement)
         .filter(
-            StockMovement.destination_location_id == partner.location_id,
+            StockMovement.destination_location_id == location_id,
             StockMovement.movement_date >= today,
         )
         .order_by(StockMovement.movement_date)
@@ -465,6 +3510,10 @@ def get_store_upcoming_deliveries(db: Session, store_id: str):
     )
 
 
+def get_all_locations(db: Session):
+    return db.query(Location).all()
+
+
 def get_all_retail_partners(db: Session):
     return db.query(RetailPartner).all()
 
@@ -473,6 +3522,7 @@ def create_retail_partner(db: Session, data: dict) -> RetailPartner:
     partner = RetailPartner(**data)
     db.add(partner)
     db.commit()
+    bump_table_versions("retail_partners")
     db.refresh(partner)
     return partner
 
@@ -499,6 +3549,7 @@ def create_store_partner_account(db: Session, data: dict) -> tuple[RetailPartner
     db.add(partner)
     db.add(user)
     db.commit()
+    bump_table_versions("retail_partners", "users")
     db.refresh(partner)
     db.refresh(user)
     return partner, user
@@ -526,6 +3577,40 @@ def _generate_product_id(name: str, qty: str, unit: str, index: int) -> str:
     return f"{base}{qty}{unit.upper()}"
 
 
+def read_products_csv(csv_path: Path = Path("products.csv")) -> dict[str, dict]:
+    """Parse products.csv into product rows keyed by generated product_id.
+
+    Rows whose quantity or price is not a number are reported and skipped.
+    """
+    products = {}
+    with csv_path.open(newline="") as f:
+        reader = csv.DictReader(f)
+        for idx, row in enumerate(reader, start=1):
+            name = row.get("Product Name", "").strip()
+            if not name:
+                continue
+            qty = row.get("Quantity", "1").strip()
+            unit = (
+                row.get("measurement", "").strip()
+                or row.get("measurement ", "").strip()
+            )
+            price = row.get("Price (₹)", "0").strip()
+            try:
+                pack_size, mrp = float(qty), float(price or 0)
+            except ValueError as exc:
+                print(f"Skipping {name}: {exc}")
+                continue
+            product_id = _generate_product_id(name, qty, unit, idx)
+            products[product_id] = {
+                "product_id": product_id,
+                "product_name": name,
+                "unit_of_measure": unit or "unit",
+                "standard_pack_size": pack_size,
+                "mrp": mrp,
+            }
+    return products
+
+
 def load_sample_products() -> None:
     conn = sqlite3.connect(DB_FILE)
     cur = conn.cursor()
@@ -534,105 +3619,1547 @@ def load_sample_products() -> None:
         conn.close()
         return
 
-    import csv
-
     csv_file = Path("products.csv")
     if not csv_file.exists():
         print("products.csv not found; skipping sample load")
         conn.close()
         return
 
-    with csv_file.open(newline="") as f:
-        reader = csv.DictReader(f)
-        for idx, row in enumerate(reader, start=1):
-            name = row.get("Product Name", "").strip()
-            if not name:
-                continue
-            qty = row.get("Quantity", "1").strip()
-            unit = (
-                row.get("measurement", "").strip()
-                or row.get("measurement ", "").strip()
-            )
-            price = row.get("Price (₹)", "0").strip()
-            product_id = _generate_product_id(name, qty, unit, idx)
-            try:
-                cur.execute(
-                    "INSERT INTO products (product_id, product_name, unit_of_measure, standard_pack_size, mrp) VALUES (?,?,?,?,?)",
-                    (product_id, name, unit or "unit", float(qty), float(price or 0)),
-                )
-            except Exception as exc:
-                print(f"Failed to insert {name}: {exc}")
+    rows = list(read_products_csv(csv_file).values())
+    # OR IGNORE skips only rows that violate a constraint, not the whole load
+    cur.executemany(
+        "INSERT OR IGNORE INTO products (product_id, product_name, unit_of_measure, standard_pack_size, mrp) VALUES (:product_id,:product_name,:unit_of_measure,:standard_pack_size,:mrp)",
+        rows,
+    )
+    loaded = cur.rowcount
     conn.commit()
     conn.close()
+    print(f"Loaded {loaded} sample products, skipped {len(rows) - loaded}")
 
 
 # WHY: keep database products in sync with CSV file when new rows are added
-# WHAT: update or insert each product from products.csv (Closes: #45)
-# HOW: call sync_products_from_csv() via CLI or POST /products/sync; remove
-#      function and route to roll back
-def sync_products_from_csv(db: Session, csv_path: Path = Path("products.csv")) -> int:
+# WHAT: diff products.csv against the catalog and apply only the changes
+#       (Closes: #45)
+# HOW: call sync_products_from_csv() via CLI or POST /products/sync; pass
+#      dry_run=True to preview the diff; remove function and route to roll back
+PRODUCT_SYNC_FIELDS = ("product_name", "unit_of_measure", "standard_pack_size", "mrp")
+
+
+def _product_values(row) -> tuple:
+    return (
+        row["product_name"],
+        row["unit_of_measure"],
+        round(float(row["standard_pack_size"]), 2),
+        round(float(row["mrp"]), 2) if row["mrp"] is not None else None,
+    )
+
+
+def sync_products_from_csv(
+    db: Session, csv_path: Path = Path("products.csv"), dry_run: bool = False
+) -> dict:
+    """Diff the CSV against the catalog and apply inserts/updates in bulk.
+
+    Returns the diff as ``{"inserted": [...], "updated": [...], "unchanged": n}``
+    with product ids; nothing is written when ``dry_run`` is set.
+    """
+    diff = {"inserted": [], "updated": [], "unchanged": 0}
     if not csv_path.exists():
         print("products.csv not found; nothing to sync")
-        return 0
-    import csv
+        return diff
+    rows = read_products_csv(csv_path)
+    current = {
+        pid: _product_values(dict(zip(PRODUCT_SYNC_FIELDS, values)))
+        for pid, *values in db.query(
+            Product.product_id, *(getattr(Product, f) for f in PRODUCT_SYNC_FIELDS)
+        )
+    }
+    inserts, updates = [], []
+    for product_id, row in rows.items():
+        if product_id not in current:
+            inserts.append(row)
+            diff["inserted"].append(product_id)
+        elif current[product_id] != _product_values(row):
+            updates.append(
+                {"b_product_id": product_id, **{f: row[f] for f in PRODUCT_SYNC_FIELDS}}
+            )
+            diff["updated"].append(product_id)
+        else:
+            diff["unchanged"] += 1
+    if dry_run:
+        return diff
+    table = Product.__table__
+    if inserts:
+        db.execute(table.insert(), inserts)
+    if updates:
+        db.execute(
+            table.update().where(table.c.product_id == bindparam("b_product_id")),
+            updates,
+        )
+    db.commit()
+    bump_table_versions("products")
+    return diff
 
-    count = 0
-    with csv_path.open(newline="") as f:
-        reader = csv.DictReader(f)
-        for idx, row in enumerate(reader, start=1):
-            name = row.get("Product Name", "").strip()
-            if not name:
-                continue
-            qty = row.get("Quantity", "1").strip()
-            unit = (
-                row.get("measurement", "").strip()
-                or row.get("measurement ", "").strip()
+
+def analyze_schema() -> None:
+    create_re = re.compile(r"CREATE TABLE (\w+) \(")
+    column_re = re.compile(r"\s*(\w+) [A-Z]+")
+    tables = {}
+    lines = SCHEMA_FILE.read_text().splitlines()
+    current = None
+    for line in lines:
+        m = create_re.match(line)
+        if m:
+            current = m.group(1)
+            tables[current] = []
+            continue
+        if current and line.startswith("    "):
+            col = column_re.match(line)
+            if col:
+                tables[current].append(col.group(1))
+        elif line.startswith(");"):
+            current = None
+    for tbl, cols in tables.items():
+        print(f"{tbl}: {', '.join(cols)}")
+
+
+# WHY: a dropped or mismatched index silently turns hot queries into full scans
+# WHAT: run each service-layer query against a scratch database with all
+#       migrations applied and inspect EXPLAIN QUERY PLAN output
+# HOW: `python main.py check-query-plans` exits non-zero on a full table scan;
+#      add a case below for every new service function
+QUERY_PLAN_FULL_SCAN_ALLOWED = {
+    # tables, not functions: only small reference tables may be read whole
+    "products",  # catalog listing and product sync diff against the full catalog
+    "locations",  # one row per warehouse/store
+    "retail_partners",  # sales import resolves every store to its location once
+}
+# statements that must read a whole large table, with the reason
+QUERY_PLAN_SCAN_EXEMPTIONS = {
+    ("get_batch_expiry_status", "expiry_calendar"): (
+        "lists every on-hand batch; the calendar holds only rows with stock, "
+        "so this reads current inventory, never history"
+    ),
+    ("create_stock_snapshot", "stock_movements"): (
+        "offline month-end job (snapshot-stock) that totals the ledger since "
+        "the previous snapshot; the first one totals all of it"
+    ),
+    ("create_stock_snapshot", "batch_products"): (
+        "same month-end job, totalling production since the previous snapshot"
+    ),
+}
+# any SCAN reads rows in table or index order, even through a covering
+# index; only SEARCH narrows by key. The exception is a page: a LIMIT read
+# in index order (no temp B-tree sorting that (sub)query) stops after it
+_FULL_SCAN_RE = re.compile(r"^SCAN (\w+)")
+_INDEX_ORDER_RE = re.compile(r" USING (?:COVERING )?INDEX ")
+_LIMIT_RE = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+
+
+def _seed_query_plan_db(db: Session) -> None:
+    today = date.today()
+    db.add_all(
+        [
+            Product(
+                product_id="P1",
+                product_name="Sample",
+                unit_of_measure="kg",
+                standard_pack_size=1,
+                mrp=100,
+            ),
+            Location(
+                location_id="MAIN_WH", location_name="WH", location_type="Warehouse"
+            ),
+            Location(
+                location_id="LOC1", location_name="Store", location_type="Retail Store"
+            ),
+            RetailPartner(store_id="S1", location_id="LOC1", store_name="Store"),
+            Batch(batch_id="B1", date_manufactured=today, expiry_date=today),
+            BatchProduct(batch_id="B1", product_id="P1", quantity_produced=10),
+            CurrentStock(
+                stock_id="B1-MAIN_WH-P1",
+                product_id="P1",
+                batch_id="B1",
+                location_id="MAIN_WH",
+                quantity=10,
+            ),
+            StockMovement(
+                movement_id="M1",
+                product_id="P1",
+                batch_id="B1",
+                movement_date=today,
+                movement_type="dispatch",
+                source_location_id="MAIN_WH",
+                destination_location_id="LOC1",
+                quantity=1,
+            ),
+            RetailSale(
+                sale_id="S1",
+                sale_date=today,
+                store_id="S1",
+                product_id="P1",
+                quantity_sold=1,
+            ),
+            User(username="u", password="p", role="arivu"),
+        ]
+    )
+    db.commit()
+
+
+def _query_plan_cases(db: Session) -> list[tuple[str, object]]:
+    """Service calls to check, as (name, zero-argument callable) pairs."""
+    today = date.today()
+
+    def allocate_shortfall():
+        # walks every dated batch, then the undated fallback, then raises
+        try:
+            allocate_fefo(db, "P1", "MAIN_WH", 10**6)
+        except InsufficientStockError:
+            pass
+
+    movement = StockMovement(
+        movement_id="M2",
+        product_id="P1",
+        batch_id="B1",
+        source_location_id="MAIN_WH",
+        destination_location_id="LOC1",
+        quantity=1,
+    )
+    bulk_row = {
+        "movement_id": "M3",
+        "product_id": "P1",
+        "batch_id": "B1",
+        "movement_type": "dispatch",
+        "source_location_id": "MAIN_WH",
+        "destination_location_id": "LOC1",
+        "quantity": 1,
+        "movement_date": today,
+    }
+    sales_csv = [
+        "sale_id,sale_date,store_id,product_id,batch_id,quantity_sold",
+        f"S2,{today},S1,P1,B1,1",
+    ]
+    return [
+        ("get_all_products", lambda: get_all_products(db)),
+        ("get_all_batches", lambda: get_all_batches(db, limit=BATCH_PAGE_SIZE)),
+        (
+            "get_all_batches",
+            lambda: get_all_batches(
+                db, limit=10, after=(today, "B9"), manufactured_from=today
+            ),
+        ),
+        ("get_all_batches", lambda: get_all_batches(db, limit=10, expiry_to=today)),
+        ("get_dispatchable_batches", lambda: get_dispatchable_batches(db)),
+        ("get_movement_history", lambda: get_movement_history(db)),
+        (
+            "get_movement_history",
+            lambda: get_movement_history(
+                db, after=(datetime.now(), "M9"), date_from=today, date_to=today
+            ),
+        ),
+        ("get_movement_history", lambda: get_movement_history(db, product_id="P1")),
+        ("get_movement_history", lambda: get_movement_history(db, batch_id="B1")),
+        ("get_movement_history", lambda: get_movement_history(db, location_id="LOC1")),
+        ("get_movement_history", lambda: get_movement_history(db, store_id="S1")),
+        ("get_total_products_count", lambda: get_total_products_count(db)),
+        ("get_total_warehouse_stock", lambda: get_total_warehouse_stock(db)),
+        ("get_total_retail_stock", lambda: get_total_retail_stock(db)),
+        ("get_expiring_units_count", lambda: get_expiring_units_count(db)),
+        ("get_expiring_stock", lambda: get_expiring_stock(db)),
+        ("get_expiring_stock", lambda: get_expiring_stock(db, 30, "LOC1", 10)),
+        ("get_batch_expiry_status", lambda: get_batch_expiry_status(db)),
+        ("get_reorder_forecast", lambda: get_reorder_forecast(db)),
+        (
+            "evaluate_stock_alerts",
+            lambda: evaluate_stock_alerts(db, [("P1", "B1", "LOC1")]),
+        ),
+        ("sweep_expiry_alerts", lambda: sweep_expiry_alerts(db)),
+        ("get_alert_feed", lambda: get_alert_feed(db)),
+        ("get_alert_feed", lambda: get_alert_feed(db, after=10, store_id="S1")),
+        ("get_reorder_thresholds", lambda: get_reorder_thresholds(db, "S1")),
+        (
+            "set_reorder_thresholds",
+            lambda: set_reorder_thresholds(
+                db, [{"store_id": "S1", "product_id": "P1", "min_quantity": 5}]
+            ),
+        ),
+        (
+            "refresh_expiry_calendar",
+            lambda: refresh_expiry_calendar(db, [("P1", "B1", "MAIN_WH")]),
+        ),
+        ("get_recent_movements", lambda: get_recent_movements(db)),
+        ("get_warehouse_stock", lambda: get_warehouse_stock(db)),
+        ("get_warehouse_product_totals", lambda: get_warehouse_product_totals(db)),
+        ("get_store_current_stock", lambda: get_store_current_stock(db, "S1")),
+        ("get_store_sales_today", lambda: get_store_sales_today(db, "S1")),
+        ("get_recent_sales", lambda: get_recent_sales(db)),
+        ("get_sales_history", lambda: get_sales_history(db)),
+        (
+            "get_sales_history",
+            lambda: get_sales_history(
+                db, after=(today, "S9"), date_from=today, date_to=today
+            ),
+        ),
+        ("get_sales_history", lambda: get_sales_history(db, product_id="P1")),
+        ("get_sales_history", lambda: get_sales_history(db, batch_id="B1")),
+        ("get_sales_history", lambda: get_sales_history(db, store_id="S1")),
+        ("get_sales_history", lambda: get_sales_history(db, location_id="LOC1")),
+        ("get_user_by_username", lambda: get_user_by_username(db, "u")),
+        (
+            "get_store_current_stock_summary",
+            lambda: get_store_current_stock_summary(db, "S1"),
+        ),
+        (
+            "get_store_upcoming_deliveries",
+            lambda: get_store_upcoming_deliveries(db, "S1"),
+        ),
+        ("get_all_retail_partners", lambda: get_all_retail_partners(db)),
+        (
+            "add_new_batch_to_inventory",
+            lambda: add_new_batch_to_inventory(db, db.get(Batch, "B1")),
+        ),
+        ("dispatch_stock", lambda: dispatch_stock(db, movement)),
+        (
+            "record_movement",
+            lambda: record_movement(
+                db,
+                {
+                    "movement_id": "M4",
+                    "product_id": "P1",
+                    "batch_id": "B1",
+                    "movement_date": today,
+                    "movement_type": "dispatch",
+                    "source_location_id": "MAIN_WH",
+                    "destination_location_id": "LOC1",
+                    "quantity": 1,
+                },
+            ),
+        ),
+        (
+            "create_retail_sale",
+            lambda: create_retail_sale(
+                db,
+                {
+                    "sale_id": "S3",
+                    "sale_date": today,
+                    "store_id": "S1",
+                    "product_id": "P1",
+                    "batch_id": "B1",
+                    "quantity_sold": 1,
+                },
+            ),
+        ),
+        ("create_movements_bulk", lambda: create_movements_bulk(db, [bulk_row])),
+        ("allocate_fefo", lambda: allocate_fefo(db, "P1", "MAIN_WH", 1)),
+        ("allocate_fefo", allocate_shortfall),
+        (
+            "ensure_month_end_snapshots",
+            lambda: ensure_month_end_snapshots(db, today - timedelta(days=40)),
+        ),
+        (
+            "create_stock_snapshot",
+            lambda: create_stock_snapshot(db, today - timedelta(days=1)),
+        ),
+        ("compute_stock_as_of", lambda: compute_stock_as_of(db, today)),
+        ("get_stock_heatmap", lambda: get_stock_heatmap(db)),
+        ("import_sales_csv", lambda: import_sales_csv(db, sales_csv)),
+        (
+            "sync_products_from_csv",
+            lambda: sync_products_from_csv(db, Path("products.csv"), dry_run=True),
+        ),
+    ]
+
+
+def check_query_plans(verbose: bool = False) -> list[str]:
+    """Return full-table-scan violations found in service-layer queries."""
+    tables = set(Base.metadata.tables)
+    violations = []
+    with tempfile.TemporaryDirectory() as tmp:
+        scratch = create_engine(f"sqlite:///{tmp}/plans.db")
+        Base.metadata.create_all(bind=scratch)
+        run_migrations(scratch)
+        captured: list[tuple[str, object]] = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+                params = parameters[0] if executemany else parameters
+                captured.append((statement, params))
+
+        with Session(bind=scratch) as db:
+            _seed_query_plan_db(db)
+            event.listen(scratch, "before_cursor_execute", capture)
+            try:
+                for name, call in _query_plan_cases(db):
+                    captured.clear()
+                    call()
+                    statements = list(captured)
+                    with scratch.connect() as conn:
+                        for statement, params in statements:
+                            plan = conn.exec_driver_sql(
+                                "EXPLAIN QUERY PLAN " + statement, params
+                            ).all()
+                            # (sub)queries, by plan parent id, that sort
+                            # their rows instead of reading them in order
+                            sorted_in = {
+                                parent
+                                for _, parent, _, d in plan
+                                if "TEMP B-TREE FOR ORDER BY" in d
+                            }
+                            limited = _LIMIT_RE.search(statement)
+                            for _, parent, _, detail in plan:
+                                if verbose:
+                                    print(f"{name}: {detail}")
+                                m = _FULL_SCAN_RE.match(detail)
+                                if not m or m.group(1) not in tables:
+                                    continue
+                                table = m.group(1)
+                                if (
+                                    table in QUERY_PLAN_FULL_SCAN_ALLOWED
+                                    or (name, table) in QUERY_PLAN_SCAN_EXEMPTIONS
+                                    or (
+                                        limited
+                                        and parent not in sorted_in
+                                        and _INDEX_ORDER_RE.search(detail)
+                                    )
+                                ):
+                                    continue
+                                violations.append(
+                                    f"{name}: {detail}\n    {statement.strip()}"
+                                )
+            finally:
+                event.remove(scratch, "before_cursor_execute", capture)
+        scratch.dispose()
+    return violations
+
+
+# WHY: prove the atomic stock writes stay correct and fast when many writers
+#      hit one hot SKU
+# WHAT: threads alternate dispatching HOT from the warehouse to one store and
+#       selling it there, with demand above supply so some writes must be
+#       refused; afterwards the ledger and stock rows must still balance
+# HOW: python main.py bench-stock-contention [--threads 16] [--ops 100];
+#      runs against a scratch SQLite file using the active DB_PROFILE
+def bench_stock_contention(
+    threads: int = 16, ops: int = 100, pipeline: bool = False
+) -> dict:
+    """Hammer one SKU from ``threads`` writers and check the totals.
+
+    With ``pipeline`` the writes go through a WritePipeline (group commit)
+    instead of one transaction per write.
+    """
+    initial = threads * ops
+    dispatch_qty, sale_qty = 3, 2
+    with tempfile.TemporaryDirectory() as tmp:
+        bench = create_engine(
+            f"sqlite:///{tmp}/bench.db", pool_size=threads, max_overflow=0
+        )
+        _install_sqlite_pragmas(bench, engine_profile)
+        Base.metadata.create_all(bind=bench)
+        run_migrations(bench)
+        with Session(bind=bench) as db:
+            db.add_all(
+                [
+                    Product(
+                        product_id="HOT",
+                        product_name="Hot SKU",
+                        unit_of_measure="pcs",
+                        standard_pack_size=1,
+                    ),
+                    Location(
+                        location_id=CENTRAL_WAREHOUSE_ID,
+                        location_name="WH",
+                        location_type="Warehouse",
+                    ),
+                    Location(
+                        location_id="BENCH_LOC",
+                        location_name="Store",
+                        location_type="Retail Store",
+                    ),
+                    RetailPartner(
+                        store_id="BENCH", location_id="BENCH_LOC", store_name="Store"
+                    ),
+                    Batch(batch_id="B1", date_manufactured=date.today()),
+                ]
             )
-            price = row.get("Price (₹)", "0").strip()
-            product_id = _generate_product_id(name, qty, unit, idx)
-            product = db.get(Product, product_id)
-            if product:
-                product.product_name = name
-                product.unit_of_measure = unit or "unit"
-                product.standard_pack_size = float(qty)
-                product.mrp = float(price or 0)
+            db.flush()
+            increment_stock(db, "HOT", "B1", CENTRAL_WAREHOUSE_ID, initial)
+            db.commit()
+
+        group = None
+        if pipeline:
+            group = WritePipeline(
+                sessionmaker(bind=bench, autoflush=False),
+                WRITE_BATCH_SIZE,
+                WRITE_BATCH_LATENCY_MS,
+            )
+
+        def write(db: Session, changes, data: dict) -> None:
+            if group:
+                group.submit(lambda w: changes(w, data) and None)
             else:
-                product = Product(
-                    product_id=product_id,
-                    product_name=name,
-                    unit_of_measure=unit or "unit",
-                    standard_pack_size=float(qty),
-                    mrp=float(price or 0),
+
+                def work():
+                    changes(db, data)
+                    db.commit()
+
+                run_stock_write(db, work)
+
+        outcomes = {"dispatched": 0, "sold": 0, "refused": 0, "failed": 0}
+        latencies: list[float] = []
+        lock = threading.Lock()
+
+        def writer(worker: int) -> None:
+            local = dict.fromkeys(outcomes, 0)
+            timings = []
+            with Session(bind=bench, autoflush=False) as db:
+                for i in range(ops):
+                    started = time.perf_counter()
+                    try:
+                        if i % 2 == 0:
+                            write(
+                                db,
+                                _movement_changes,
+                                {
+                                    "movement_id": f"M{worker}-{i}",
+                                    "product_id": "HOT",
+                                    "batch_id": "B1",
+                                    "movement_date": datetime.now(),
+                                    "movement_type": "dispatch",
+                                    "source_location_id": CENTRAL_WAREHOUSE_ID,
+                                    "destination_location_id": "BENCH_LOC",
+                                    "quantity": dispatch_qty,
+                                },
+                            )
+                            local["dispatched"] += 1
+                        else:
+                            write(
+                                db,
+                                _retail_sale_changes,
+                                {
+                                    "sale_id": f"S{worker}-{i}",
+                                    "sale_date": date.today(),
+                                    "store_id": "BENCH",
+                                    "product_id": "HOT",
+                                    "batch_id": "B1",
+                                    "quantity_sold": sale_qty,
+                                },
+                            )
+                            local["sold"] += 1
+                    except InsufficientStockError:
+                        local["refused"] += 1
+                    except OperationalError:
+                        local["failed"] += 1
+                    timings.append(time.perf_counter() - started)
+            with lock:
+                for key, value in local.items():
+                    outcomes[key] += value
+                latencies.extend(timings)
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=writer, args=(n,)) for n in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        windows = None
+        if group:
+            group.close()
+            windows = group.counters["windows"]
+
+        with Session(bind=bench) as db:
+            stock = dict(
+                db.query(CurrentStock.location_id, CurrentStock.quantity).filter(
+                    CurrentStock.product_id == "HOT"
+                )
+            )
+            movements = db.query(func.count(StockMovement.movement_id)).scalar()
+            sales = db.query(func.count(RetailSale.sale_id)).scalar()
+        bench.dispose()
+
+    expected = {
+        CENTRAL_WAREHOUSE_ID: initial - dispatch_qty * outcomes["dispatched"],
+        "BENCH_LOC": dispatch_qty * outcomes["dispatched"]
+        - sale_qty * outcomes["sold"],
+    }
+    problems = [
+        f"{loc}: expected {qty}, found {stock.get(loc, 0)}"
+        for loc, qty in expected.items()
+        if stock.get(loc, 0) != qty
+    ]
+    if any(qty < 0 for qty in stock.values()):
+        problems.append(f"negative stock: {stock}")
+    if movements != outcomes["dispatched"]:
+        problems.append(
+            f"{movements} movements for {outcomes['dispatched']} dispatches"
+        )
+    if sales != outcomes["sold"]:
+        problems.append(f"{sales} sales rows for {outcomes['sold']} sales")
+    latencies.sort()
+    total = threads * ops
+    return {
+        "threads": threads,
+        "operations": total,
+        "seconds": round(elapsed, 3),
+        "ops_per_second": round(total / elapsed, 1),
+        "p50_ms": round(latencies[total // 2] * 1000, 2),
+        "p95_ms": round(latencies[int(total * 0.95)] * 1000, 2),
+        "commits": windows if pipeline else total - outcomes["refused"],
+        **outcomes,
+        "stock": stock,
+        "problems": problems,
+    }
+
+
+# --- Data generator and API benchmark ---
+# WHY: nothing showed how the API behaves at production data volumes
+# WHAT: gen-data fills a fresh SQLite file with a consistent history
+#       (batches produced into MAIN_WH, dispatched to stores, sold there; day
+#       by day so no stock ever goes negative; a draw that finds no stock is
+#       skipped, so counts can land slightly under) using chunked executemany
+#       inserts in one transaction, then derives current_stock and the expiry
+#       calendar. bench-api drives this app in-process over ASGI with
+#       concurrent clients and reports p50/p95/p99 latency and throughput per
+#       endpoint; --save writes a baseline JSON, --compare fails on regressions
+# HOW: python main.py gen-data [--db bench.db] [--movements 1000000] ...
+#      DATABASE_URL=sqlite:///./bench.db python main.py bench-api \
+#          [--requests 500] [--concurrency 8] [--save base.json]
+#          [--compare base.json] [--tolerance 0.25]
+GEN_DATA_DEFAULTS = {
+    "products": 200,
+    "stores": 100,
+    "batches": 5000,
+    "movements": 1_000_000,
+    "sales": 1_000_000,
+    "days": 365,
+    "seed": 42,
+}
+GEN_DATA_CHUNK = 20_000
+
+
+def _daily_share(total: int, day: int, days: int) -> int:
+    return total * (day + 1) // days - total * day // days
+
+
+def generate_data(path: str, **counts) -> dict:
+    """Fill a new SQLite database at ``path`` with synthetic history."""
+    opts = {**GEN_DATA_DEFAULTS, **counts}
+    rng = random.Random(opts["seed"])
+    target = create_engine(f"sqlite:///{path}")
+    _install_sqlite_pragmas(target, ENGINE_PROFILES["bulk-load"])
+    Base.metadata.create_all(bind=target)
+    run_migrations(target)
+    with target.connect() as conn:
+        if conn.execute(select(func.count()).select_from(Product.__table__)).scalar():
+            raise ValueError(f"{path} already contains data")
+
+    started = time.perf_counter()
+    days = opts["days"]
+    today = date.today()
+    first_day = today - timedelta(days=days - 1)
+    product_ids = [f"GP{n:04d}" for n in range(1, opts["products"] + 1)]
+    stores = [(f"ST{n:04d}", f"LC{n:04d}") for n in range(1, opts["stores"] + 1)]
+    store_of = {loc: store for store, loc in stores}
+    written = dict.fromkeys(
+        ("batches", "batch_products", "stock_movements", "retail_sales"), 0
+    )
+    warehouse: dict[tuple[str, str], int] = {}
+    warehouse_keys: list[tuple[str, str]] = []
+    shelf: dict[tuple[str, str, str], int] = {}
+    shelf_keys: list[tuple[str, str, str]] = []
+    buffers: dict[str, list[dict]] = {name: [] for name in written}
+
+    with target.begin() as conn:
+
+        def flush(name: str, force: bool = False) -> None:
+            rows = buffers[name]
+            if rows and (force or len(rows) >= GEN_DATA_CHUNK):
+                conn.execute(Base.metadata.tables[name].insert(), rows)
+                written[name] += len(rows)
+                rows.clear()
+
+        conn.execute(
+            Product.__table__.insert(),
+            [
+                {
+                    "product_id": pid,
+                    "product_name": f"Product {pid}",
+                    "unit_of_measure": rng.choice(["kg", "g", "L", "pcs"]),
+                    "standard_pack_size": rng.choice([0.25, 0.5, 1, 2]),
+                    "mrp": rng.randint(40, 900),
+                }
+                for pid in product_ids
+            ],
+        )
+        conn.execute(
+            Location.__table__.insert(),
+            [
+                {
+                    "location_id": CENTRAL_WAREHOUSE_ID,
+                    "location_name": "Main Warehouse",
+                    "location_type": "Warehouse",
+                }
+            ]
+            + [
+                {
+                    "location_id": loc,
+                    "location_name": f"Store {store}",
+                    "location_type": "Retail Store",
+                }
+                for store, loc in stores
+            ],
+        )
+        conn.execute(
+            RetailPartner.__table__.insert(),
+            [
+                {"store_id": store, "location_id": loc, "store_name": f"Store {store}"}
+                for store, loc in stores
+            ],
+        )
+
+        batch_no = movement_no = sale_no = 0
+        for day_index in range(days):
+            day = first_day + timedelta(days=day_index)
+            midnight = datetime(day.year, day.month, day.day)
+            for _ in range(_daily_share(opts["batches"], day_index, days)):
+                batch_no += 1
+                batch_id = f"GB{batch_no:06d}"
+                buffers["batches"].append(
+                    {
+                        "batch_id": batch_id,
+                        "date_manufactured": day,
+                        "expiry_date": day + timedelta(days=rng.randint(60, 240)),
+                        "remarks": None,
+                    }
+                )
+                for pid in rng.sample(product_ids, k=min(len(product_ids), 2)):
+                    quantity = rng.randint(500, 3000)
+                    buffers["batch_products"].append(
+                        {
+                            "batch_id": batch_id,
+                            "product_id": pid,
+                            "quantity_produced": quantity,
+                        }
+                    )
+                    warehouse[(pid, batch_id)] = quantity
+                    warehouse_keys.append((pid, batch_id))
+            for _ in range(_daily_share(opts["movements"], day_index, days)):
+                for _attempt in range(5):
+                    if not warehouse_keys:
+                        break
+                    pid, batch_id = rng.choice(warehouse_keys)
+                    quantity = min(rng.randint(1, 10), warehouse[(pid, batch_id)])
+                    if quantity:
+                        break
+                else:
+                    continue
+                if not warehouse_keys:
+                    break
+                store, loc = rng.choice(stores)
+                warehouse[(pid, batch_id)] -= quantity
+                key = (pid, batch_id, loc)
+                if key not in shelf:
+                    shelf[key] = 0
+                    shelf_keys.append(key)
+                shelf[key] += quantity
+                movement_no += 1
+                buffers["stock_movements"].append(
+                    {
+                        "movement_id": f"GM{movement_no:08d}",
+                        "product_id": pid,
+                        "batch_id": batch_id,
+                        "movement_date": midnight
+                        + timedelta(seconds=rng.randrange(86400)),
+                        "movement_type": "Dispatch",
+                        "source_location_id": CENTRAL_WAREHOUSE_ID,
+                        "destination_location_id": loc,
+                        "quantity": quantity,
+                        "agent_id": None,
+                        "remarks": None,
+                    }
+                )
+            for _ in range(_daily_share(opts["sales"], day_index, days)):
+                for _attempt in range(5):
+                    if not shelf_keys:
+                        break
+                    key = rng.choice(shelf_keys)
+                    quantity = min(rng.randint(1, 3), shelf[key])
+                    if quantity:
+                        break
+                else:
+                    continue
+                if not shelf_keys:
+                    break
+                shelf[key] -= quantity
+                sale_no += 1
+                pid, batch_id, loc = key
+                buffers["retail_sales"].append(
+                    {
+                        "sale_id": f"GR{sale_no:08d}",
+                        "sale_date": day,
+                        "store_id": store_of[loc],
+                        "product_id": pid,
+                        "batch_id": batch_id,
+                        "quantity_sold": quantity,
+                        "sales_agent_id": None,
+                        "sale_price_per_unit": None,
+                        "remarks": None,
+                    }
+                )
+            for name in buffers:
+                flush(name)
+        for name in buffers:
+            flush(name, force=True)
+
+        stock_rows = [
+            {
+                "stock_id": _stock_id(pid, batch_id, CENTRAL_WAREHOUSE_ID),
+                "product_id": pid,
+                "batch_id": batch_id,
+                "location_id": CENTRAL_WAREHOUSE_ID,
+                "quantity": quantity,
+            }
+            for (pid, batch_id), quantity in warehouse.items()
+        ] + [
+            {
+                "stock_id": _stock_id(pid, batch_id, loc),
+                "product_id": pid,
+                "batch_id": batch_id,
+                "location_id": loc,
+                "quantity": quantity,
+            }
+            for (pid, batch_id, loc), quantity in shelf.items()
+        ]
+        for chunk in _chunks(stock_rows, GEN_DATA_CHUNK):
+            conn.execute(CurrentStock.__table__.insert(), chunk)
+        for stmt in EXPIRY_CALENDAR_REBUILD:
+            conn.exec_driver_sql(stmt)
+    with target.connect() as conn:
+        conn.exec_driver_sql("ANALYZE")
+    target.dispose()
+    return {
+        "products": len(product_ids),
+        "stores": len(stores),
+        **written,
+        "current_stock": len(stock_rows),
+        "seconds": round(time.perf_counter() - started, 1),
+    }
+
+
+# Share of each kind of request in the "mixed" scenario
+BENCH_MIX = {"read": 0.8, "dispatch": 0.1, "sale": 0.08, "batch": 0.02}
+BENCH_USER = "bench"
+
+
+def _bench_percentiles(latencies: list[float]) -> dict:
+    p50, p95, p99 = np.percentile(np.asarray(latencies) * 1000, [50, 95, 99])
+    return {"p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2)}
+
+
+async def _bench_scenario(client, make_request, total: int, concurrency: int) -> dict:
+    """Issue ``total`` requests from ``concurrency`` workers; stats per endpoint."""
+    samples: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        for n in counter:
+            name, method, url, body = make_request(n)
+            started = time.perf_counter()
+            resp = await client.request(method, url, json=body)
+            samples.setdefault(name, []).append(time.perf_counter() - started)
+            if resp.status_code >= 400:
+                errors[name] = errors.get(name, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    endpoints = {
+        name: {
+            "requests": len(latencies),
+            "errors": errors.get(name, 0),
+            "throughput_rps": round(len(latencies) / elapsed, 1),
+            **_bench_percentiles(latencies),
+        }
+        for name, latencies in sorted(samples.items())
+    }
+    return {
+        "requests": total,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 1),
+        "endpoints": endpoints,
+    }
+
+
+async def _run_api_bench(total: int, concurrency: int, seed: int) -> dict:
+    try:
+        import httpx
+    except ImportError as exc:
+        raise RuntimeError(
+            "bench-api needs httpx (pip install -r requirements-dev.txt)"
+        ) from exc
+    rng = random.Random(seed)
+    with SessionLocal() as db:
+        store_locations = {p.store_id: p.location_id for p in get_partner_refs(db)}
+        stores = list(store_locations)
+        products = [p.product_id for p in get_product_refs(db)]
+        if not stores or not products:
+            raise RuntimeError("database has no stores or products; run gen-data")
+        on_shelf = (
+            db.query(RetailPartner.store_id, CurrentStock.product_id)
+            .join(RetailPartner, RetailPartner.location_id == CurrentStock.location_id)
+            .filter(CurrentStock.quantity > 0)
+            .distinct()
+            .limit(5000)
+            .all()
+        )
+        if not get_user_ref(db, BENCH_USER):
+            create_user(
+                db,
+                {
+                    "username": BENCH_USER,
+                    "password": hashlib.sha256(BENCH_USER.encode()).hexdigest(),
+                    "role": "arivu",
+                },
+            )
+        user = get_user_ref(db, BENCH_USER)
+    token, _ = issue_session_token(user)
+    run_id = secrets.token_hex(3)
+    today = date.today().isoformat()
+
+    reads = [
+        ("GET /dashboard/arivu/bootstrap", lambda: "/dashboard/arivu/bootstrap"),
+        (
+            "GET /dashboard/store/{id}/bootstrap",
+            lambda: f"/dashboard/store/{rng.choice(stores)}/bootstrap",
+        ),
+        ("GET /dashboard/arivu", lambda: "/dashboard/arivu"),
+        ("GET /products", lambda: "/products"),
+        ("GET /warehouse-stock/summary", lambda: "/warehouse-stock/summary"),
+        (
+            "GET /stock-movements/history",
+            lambda: "/stock-movements/history?limit=50",
+        ),
+        ("GET /alerts", lambda: "/alerts"),
+        ("GET /expiring-stock", lambda: "/expiring-stock?days=30"),
+    ]
+
+    def read(n):
+        name, url = rng.choice(reads)
+        return name, "GET", url(), None
+
+    def dispatch(n):
+        body = {
+            "movement_id": f"BM{run_id}-{n}",
+            "product_id": rng.choice(products),
+            "movement_type": "Dispatch",
+            "source_location_id": CENTRAL_WAREHOUSE_ID,
+            "destination_location_id": store_locations[rng.choice(stores)],
+            "quantity": 1,
+        }
+        return "POST /stock-movements", "POST", "/stock-movements", body
+
+    def sale(n):
+        store, product = rng.choice(on_shelf) if on_shelf else (stores[0], products[0])
+        body = {
+            "sale_id": f"BS{run_id}-{n}",
+            "sale_date": today,
+            "store_id": store,
+            "product_id": product,
+            "quantity_sold": 1,
+        }
+        return "POST /retail-sales", "POST", "/retail-sales", body
+
+    def batch(n):
+        body = {
+            "batch_id": f"BB{run_id}-{n}",
+            "date_manufactured": today,
+            "items": [
+                {"product_id": pid, "quantity_produced": 1000}
+                for pid in rng.sample(products, k=min(2, len(products)))
+            ],
+        }
+        return "POST /batches", "POST", "/batches", body
+
+    kinds = list(BENCH_MIX)
+    weights = list(BENCH_MIX.values())
+    handlers = {"read": read, "dispatch": dispatch, "sale": sale, "batch": batch}
+
+    def mixed(n):
+        return handlers[rng.choices(kinds, weights)[0]](n)
+
+    scenarios = {
+        "dashboard_reads": read,
+        "dispatches": dispatch,
+        "sales": sale,
+        "batch_creation": batch,
+        "mixed": mixed,
+    }
+    transport = httpx.ASGITransport(app=app)
+    report = {}
+    async with httpx.AsyncClient(
+        transport=transport,
+        base_url="http://bench",
+        headers={"Authorization": f"Bearer {token}"},
+        timeout=120,
+    ) as client:
+        for name, make_request in scenarios.items():
+            offset = len(report) * total
+            report[name] = await _bench_scenario(
+                client, lambda n: make_request(offset + n), total, concurrency
+            )
+    return report
+
+
+def bench_api(total: int = 500, concurrency: int = 8, seed: int = 7) -> dict:
+    """Benchmark the app in-process against the configured database."""
+    with SessionLocal() as db:
+        sizes = {
+            table: db.execute(
+                select(func.count()).select_from(Base.metadata.tables[table])
+            ).scalar()
+            for table in ("products", "retail_partners", "batches", "stock_movements")
+        }
+    scenarios = asyncio.run(_run_api_bench(total, concurrency, seed))
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "database": make_url(DATABASE_URL).render_as_string(hide_password=True),
+        "db_profile": DB_PROFILE,
+        "write_pipeline": WRITE_PIPELINE_ENABLED,
+        "requests_per_scenario": total,
+        "concurrency": concurrency,
+        "table_rows": sizes,
+        "scenarios": scenarios,
+    }
+
+
+def compare_bench(report: dict, baseline: dict, tolerance: float = 0.25) -> list[str]:
+    """Endpoints whose p95 or throughput regressed by more than ``tolerance``."""
+    regressions = []
+    for scenario, base in baseline.get("scenarios", {}).items():
+        current = report["scenarios"].get(scenario)
+        if not current:
+            continue
+        for endpoint, old in base["endpoints"].items():
+            new = current["endpoints"].get(endpoint)
+            if not new:
+                continue
+            if new["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{scenario} {endpoint}: p95 {old['p95_ms']} -> {new['p95_ms']} ms"
+                )
+        if current["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{scenario}: throughput {base['throughput_rps']} -> "
+                f"{current['throughput_rps']} req/s"
+            )
+    return regressions
+
+
+# --- Request metrics ---
+# WHY: behind the load balancer there was no way to tell which routes are slow
+# WHAT: a pure ASGI middleware records a latency histogram and status counts
+#       per route template (``/dashboard/store/{store_id}``, never the raw
+#       path, so label cardinality stays bounded); InstrumentedRoute counts
+#       requests in flight per route; engine events count statements, changed
+#       rows and database time, attributed to the current request through a
+#       ContextVar. The write pipeline's thread serves no request, so its
+#       statements only reach the per-engine totals. GET /metrics renders
+#       everything, plus write pipeline and reference cache counters, in
+#       Prometheus text format. Request bookkeeping runs on the event loop
+#       thread only, so it takes no lock
+# HOW: METRICS_ENABLED=0 turns collection off; METRICS_BUCKETS overrides the
+#      latency bucket bounds (seconds, comma separated). Set METRICS_TOKEN and
+#      give the scraper `Authorization: Bearer <token>` (Prometheus
+#      `bearer_token`) so it needs no user account
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+METRICS_BUCKETS = tuple(
+    float(bound)
+    for bound in os.getenv(
+        "METRICS_BUCKETS", "0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10"
+    ).split(",")
+)
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class RouteStats:
+    """Latency histogram and SQL totals for one (method, route template)."""
+
+    __slots__ = ("buckets", "count", "seconds", "statements", "rows", "db_seconds")
+
+    def __init__(self):
+        self.buckets = [0] * (len(METRICS_BUCKETS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+
+
+class RequestSql:
+    """Statements, changed rows and database time of one request."""
+
+    __slots__ = ("statements", "rows", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.seconds = 0.0
+
+
+_request_sql: ContextVar[RequestSql | None] = ContextVar("request_sql", default=None)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.routes: dict[tuple[str, str], RouteStats] = {}
+        self.statuses: dict[tuple[str, str, int], int] = {}
+        self.in_flight: dict[tuple[str, str], int] = {}
+        # engine name -> [statements, rows, seconds]; updated from any thread
+        self.sql: dict[str, list] = {}
+        self._sql_lock = threading.Lock()
+
+    def observe(self, method, route, status_code, seconds, sql: RequestSql):
+        key = (method, route)
+        stats = self.routes.get(key)
+        if stats is None:
+            stats = self.routes[key] = RouteStats()
+        stats.buckets[bisect_left(METRICS_BUCKETS, seconds)] += 1
+        stats.count += 1
+        stats.seconds += seconds
+        stats.statements += sql.statements
+        stats.rows += sql.rows
+        stats.db_seconds += sql.seconds
+        status_key = (method, route, status_code)
+        self.statuses[status_key] = self.statuses.get(status_key, 0) + 1
+
+    def observe_sql(self, engine_name: str, rows: int, seconds: float) -> None:
+        with self._sql_lock:
+            totals = self.sql.get(engine_name)
+            if totals is None:
+                totals = self.sql[engine_name] = [0, 0, 0.0]
+            totals[0] += 1
+            totals[1] += rows
+            totals[2] += seconds
+
+    def render(self) -> str:
+        """Prometheus text exposition of all collected metrics."""
+        out: list[str] = []
+
+        def family(name, kind, help_text):
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+
+        def labels(**values) -> str:
+            pairs = ",".join(
+                f'{k}="{_prometheus_escape(str(v))}"' for k, v in values.items()
+            )
+            return "{" + pairs + "}"
+
+        routes = sorted(self.routes.items())
+        family(
+            "arivu_http_requests_total", "counter", "HTTP requests by route and status"
+        )
+        for (method, route, code), n in sorted(self.statuses.items()):
+            out.append(
+                f"arivu_http_requests_total"
+                f"{labels(method=method, route=route, status=code)} {n}"
+            )
+        family(
+            "arivu_http_request_duration_seconds",
+            "histogram",
+            "Request latency by route template",
+        )
+        for (method, route), stats in routes:
+            cumulative = 0
+            for bound, n in zip(METRICS_BUCKETS + (float("inf"),), stats.buckets):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                out.append(
+                    "arivu_http_request_duration_seconds_bucket"
+                    f"{labels(method=method, route=route, le=le)} {cumulative}"
+                )
+            tags = labels(method=method, route=route)
+            out.append(f"arivu_http_request_duration_seconds_sum{tags} {stats.seconds}")
+            out.append(f"arivu_http_request_duration_seconds_count{tags} {stats.count}")
+        family(
+            "arivu_http_requests_in_flight", "gauge", "Requests currently being handled"
+        )
+        for (method, route), n in sorted(self.in_flight.items()):
+            out.append(
+                f"arivu_http_requests_in_flight{labels(method=method, route=route)} {n}"
+            )
+        for suffix, attr, help_text in (
+            ("statements_total", "statements", "SQL statements run by requests"),
+            ("rows_total", "rows", "Rows changed by requests' SQL statements"),
+            ("seconds_total", "db_seconds", "Time requests spent in SQL statements"),
+        ):
+            name = f"arivu_http_request_sql_{suffix}"
+            family(name, "counter", help_text)
+            for (method, route), stats in routes:
+                value = getattr(stats, attr)
+                out.append(f"{name}{labels(method=method, route=route)} {value}")
+        with self._sql_lock:
+            engines = sorted((k, list(v)) for k, v in self.sql.items())
+        for index, suffix, help_text in (
+            (0, "statements_total", "SQL statements run per engine"),
+            (1, "rows_total", "Rows changed per engine"),
+            (2, "seconds_total", "Time spent in SQL statements per engine"),
+        ):
+            name = f"arivu_sql_{suffix}"
+            family(name, "counter", help_text)
+            for engine_name, totals in engines:
+                out.append(f"{name}{labels(engine=engine_name)} {totals[index]}")
+
+        pipeline = write_pipeline.stats()
+        for key in ("writes", "failed", "windows", "retries"):
+            name = f"arivu_write_pipeline_{key}_total"
+            family(name, "counter", f"Write pipeline {key}")
+            out.append(f"{name} {pipeline[key]}")
+        family("arivu_write_pipeline_queued", "gauge", "Writes waiting for a window")
+        out.append(f"arivu_write_pipeline_queued {pipeline['queued']}")
+        caches = sorted(reference_cache_stats().items())
+        for key in ("hits", "misses", "evictions", "invalidations"):
+            name = f"arivu_reference_cache_{key}_total"
+            family(name, "counter", f"Reference cache {key}")
+            for cache_name, stats in caches:
+                out.append(f"{name}{labels(cache=cache_name)} {stats[key]}")
+        family("arivu_reference_cache_entries", "gauge", "Reference cache entries")
+        for cache_name, stats in caches:
+            out.append(
+                f"arivu_reference_cache_entries{labels(cache=cache_name)} "
+                f"{stats['entries']}"
+            )
+        return "\n".join(out) + "\n"
+
+
+def _prometheus_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+request_metrics = RequestMetrics()
+
+
+def _install_sql_metrics(sync_engine, engine_name: str) -> None:
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _start_statement(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _end_statement(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_started
+        rows = max(cursor.rowcount, 0)
+        request_metrics.observe_sql(engine_name, rows, elapsed)
+        sql = _request_sql.get()
+        if sql is not None:
+            sql.statements += 1
+            sql.rows += rows
+            sql.seconds += elapsed
+
+
+if METRICS_ENABLED:
+    _install_sql_metrics(engine, "sync")
+    _install_sql_metrics(async_engine.sync_engine, "async")
+
+
+class InstrumentedRoute(APIRoute):
+    """APIRoute that keeps the in-flight gauge for its template."""
+
+    async def handle(self, scope, receive, send):
+        key = (scope["method"], self.path)
+        in_flight = request_metrics.in_flight
+        in_flight[key] = in_flight.get(key, 0) + 1
+        try:
+            await super().handle(scope, receive, send)
+        finally:
+            in_flight[key] -= 1
+
+
+class RequestMetricsMiddleware:
+    """Record latency, status and SQL totals per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        sql = RequestSql()
+        token = _request_sql.set(sql)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _request_sql.reset(token)
+            request_metrics.observe(
+                scope["method"], _route_template(scope), status_code, elapsed, sql
+            )
+
+
+def _route_template(scope) -> str:
+    """Matched route path (``/dashboard/store/{store_id}``) once routed."""
+    route = scope.get("route")
+    return (
+        route.path if route is not None else scope.get("root_path")
+    ) or UNMATCHED_ROUTE
+
+
+# --- Query profiler ---
+# WHY: N+1 loops (one query per batch) and repeated lookups of the same row
+#      are hard to spot by reading the code
+# WHAT: for profiled requests every statement is fingerprinted (literals and
+#       IN-list lengths folded) and timed with the main.py line that issued
+#       it. Fingerprints run more than QUERY_PROFILE_REPEAT times and
+#       statements slower than QUERY_PROFILE_SLOW_MS are written as one JSON
+#       line per request to QUERY_PROFILE_LOG (rotated to <log>.1 past
+#       QUERY_PROFILE_LOG_MAX_BYTES); the response carries X-Query-Count and
+#       X-Query-Repeats. Writes applied by the write pipeline run on its
+#       thread and are not attributed to the request. assert_max_queries
+#       counts every statement in a block, for tests
+# HOW: QUERY_PROFILE=off (default) disables it, =header profiles requests
+#      sending ``X-Query-Profile: 1`` with an Arivu session token, =all
+#      profiles every request
+QUERY_PROFILE = os.getenv("QUERY_PROFILE", "off")
+QUERY_PROFILE_REPEAT = int(os.getenv("QUERY_PROFILE_REPEAT", "5"))
+QUERY_PROFILE_SLOW_MS = float(os.getenv("QUERY_PROFILE_SLOW_MS", "100"))
+QUERY_PROFILE_LOG = os.getenv("QUERY_PROFILE_LOG", "query_profile.jsonl")
+QUERY_PROFILE_LOG_MAX_BYTES = int(
+    os.getenv("QUERY_PROFILE_LOG_MAX_BYTES", str(10 * 1024 * 1024))
+)
+QUERY_PROFILE_HEADER = b"x-query-profile"
+# Only sessions with this role may switch profiling on per request
+QUERY_PROFILE_ROLE = "arivu"
+
+_FINGERPRINT_SUBS = [
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"__\[POSTCOMPILE_\w+\]"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)"), "(?+)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+@lru_cache(maxsize=4096)
+def fingerprint_sql(statement: str) -> str:
+    """Statement with literals and IN-list lengths folded to placeholders."""
+    for pattern, replacement in _FINGERPRINT_SUBS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def _sql_call_site() -> str:
+    """``function:line`` of the innermost main.py frame outside this section."""
+    frame = sys._getframe(2)
+    while frame is not None:
+        code = frame.f_code
+        if code.co_filename == __file__ and code.co_name not in _PROFILER_FRAMES:
+            return f"{code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "<unknown>"
+
+
+class QueryProfile:
+    """Statements of one profiled request: (fingerprint, seconds, call site)."""
+
+    __slots__ = ("statements",)
+
+    def __init__(self):
+        self.statements: list[tuple[str, float, str]] = []
+
+    def report(self) -> dict:
+        groups: dict[str, dict] = {}
+        slow = []
+        for fingerprint, seconds, site in self.statements:
+            group = groups.setdefault(
+                fingerprint, {"count": 0, "ms": 0.0, "call_sites": {}}
+            )
+            group["count"] += 1
+            group["ms"] += seconds * 1000
+            group["call_sites"][site] = group["call_sites"].get(site, 0) + 1
+            if seconds * 1000 >= QUERY_PROFILE_SLOW_MS:
+                slow.append(
+                    {"sql": fingerprint, "ms": round(seconds * 1000, 2), "site": site}
+                )
+        repeated = [
+            {"sql": fingerprint, **group, "ms": round(group["ms"], 2)}
+            for fingerprint, group in groups.items()
+            if group["count"] > QUERY_PROFILE_REPEAT
+        ]
+        repeated.sort(key=lambda g: g["count"], reverse=True)
+        return {
+            "queries": len(self.statements),
+            "distinct": len(groups),
+            "db_ms": round(sum(s for _, s, _ in self.statements) * 1000, 2),
+            "repeated": repeated,
+            "slow": slow,
+        }
+
+
+_query_profile: ContextVar[QueryProfile | None] = ContextVar(
+    "query_profile", default=None
+)
+# Active assert_max_queries blocks; each collects every statement, any thread
+_query_counters: list[list[str]] = []
+_query_profile_lock = threading.Lock()
+
+
+def _install_query_profiler(sync_engine) -> None:
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _profile_start(conn, cursor, statement, parameters, context, executemany):
+        if _query_counters:
+            for counter in list(_query_counters):
+                counter.append(statement)
+        if _query_profile.get() is not None:
+            context._profile_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _profile_end(conn, cursor, statement, parameters, context, executemany):
+        profile = _query_profile.get()
+        if profile is not None:
+            profile.statements.append(
+                (
+                    fingerprint_sql(statement),
+                    time.perf_counter() - context._profile_started,
+                    _sql_call_site(),
+                )
+            )
+
+
+_PROFILER_FRAMES = {"_profile_start", "_profile_end", "_sql_call_site"}
+
+# always installed: assert_max_queries relies on them, and with profiling off
+# they cost one ContextVar lookup per statement
+_install_query_profiler(engine)
+_install_query_profiler(async_engine.sync_engine)
+
+
+def write_query_profile(entry: dict) -> None:
+    line = json.dumps(entry, default=str)
+    with _query_profile_lock:
+        try:
+            if os.path.getsize(QUERY_PROFILE_LOG) >= QUERY_PROFILE_LOG_MAX_BYTES:
+                os.replace(QUERY_PROFILE_LOG, f"{QUERY_PROFILE_LOG}.1")
+        except FileNotFoundError:
+            pass
+        with open(QUERY_PROFILE_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def _profile_requested(scope) -> bool:
+    if QUERY_PROFILE == "all":
+        return True
+    if QUERY_PROFILE != "header":
+        return False
+    headers = dict(scope["headers"])
+    if headers.get(QUERY_PROFILE_HEADER) != b"1":
+        return False
+    scheme, _, token = headers.get(b"authorization", b"").decode().partition(" ")
+    if scheme.lower() != "bearer":
+        return False
+    claims = decode_session_token(token.strip())
+    return bool(claims) and claims.get("role") == QUERY_PROFILE_ROLE
+
+
+class QueryProfilerMiddleware:
+    """Profile the request's SQL when QUERY_PROFILE or its header asks to."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _profile_requested(scope):
+            await self.app(scope, receive, send)
+            return
+        profile = QueryProfile()
+        token = _query_profile.set(profile)
+
+        async def send_with_counts(message):
+            if message["type"] == "http.response.start":
+                repeats = sum(
+                    1
+                    for n in Counter(f for f, _, _ in profile.statements).values()
+                    if n > QUERY_PROFILE_REPEAT
+                )
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"x-query-count", str(len(profile.statements)).encode()),
+                    (b"x-query-repeats", str(repeats).encode()),
+                ]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_counts)
+        finally:
+            _query_profile.reset(token)
+            report = profile.report()
+            if report["repeated"] or report["slow"]:
+                write_query_profile(
+                    {
+                        "at": datetime.now().isoformat(timespec="milliseconds"),
+                        "method": scope["method"],
+                        "route": _route_template(scope),
+                        "path": scope["path"],
+                        "ms": round((time.perf_counter() - started) * 1000, 2),
+                        **report,
+                    }
                 )
-                db.add(product)
-            count += 1
-    db.commit()
-    return count
 
 
-def analyze_schema() -> None:
-    create_re = re.compile(r"CREATE TABLE (\w+) \(")
-    column_re = re.compile(r"\s*(\w+) [A-Z]+")
-    tables = {}
-    lines = SCHEMA_FILE.read_text().splitlines()
-    current = None
-    for line in lines:
-        m = create_re.match(line)
-        if m:
-            current = m.group(1)
-            tables[current] = []
-            continue
-        if current and line.startswith("    "):
-            col = column_re.match(line)
-            if col:
-                tables[current].append(col.group(1))
-        elif line.startswith(");"):
-            current = None
-    for tbl, cols in tables.items():
-        print(f"{tbl}: {', '.join(cols)}")
+@contextmanager
+def assert_max_queries(limit: int):
+    """Fail the block if it runs more than ``limit`` SQL statements.
+
+    For tests, e.g. ``with assert_max_queries(3): client.get("/products")``.
+    Counts statements on both engines from any thread, including the write
+    pipeline's, so it also works through TestClient.
+    """
+    statements: list[str] = []
+    _query_counters.append(statements)
+    try:
+        yield statements
+    finally:
+        _query_counters.remove(statements)
+    if len(statements) > limit:
+        counts = Counter(fingerprint_sql(s) for s in statements).most_common(5)
+        detail = "\n".join(f"  {n}x {sql}" for sql, n in counts)
+        raise AssertionError(
+            f"{len(statements)} queries run, expected at most {limit}:\n{detail}"
+        )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Print the active database profile so deployments can confirm it."""
+    settings = ", ".join(f"{k}={v}" for k, v in engine_profile.items() if k != "echo")
+    print(
+        f"Database profile '{DB_PROFILE}' ({engine.url.get_backend_name()}): {settings}"
+    )
+    yield
+
+
+app = FastAPI(
+    title="Arivu Foods Inventory API",
+    default_response_class=FastJSONResponse,
+    lifespan=lifespan,
+)
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_BYTES, compresslevel=5)
+if METRICS_ENABLED:
+    app.router.route_class = InstrumentedRoute
+    app.add_middleware(RequestMetricsMiddleware)
+app.add_middleware(QueryProfilerMiddleware)
 
 
-app = FastAPI(title="Arivu Foods Inventory API")
 # Serve frontend HTML from /ui and show login page at root
 app.mount("/ui", StaticFiles(directory="."), name="ui")
 
@@ -681,8 +5208,9 @@ def serve_products_page():
     return FileResponse("products.html")
 
 
-# Individual routes use HTTP Basic auth dependency so endpoints require login
-auth_dep = Depends(verify_basic_auth)
+# Individual routes use the session token / HTTP Basic dependency so endpoints
+# require login
+auth_dep = Depends(verify_auth)
 
 
 class ProductCreate(BaseModel):
@@ -718,7 +5246,7 @@ class StockMovementCreate(BaseModel):
 
     movement_id: str
     product_id: str
-    batch_id: str
+    batch_id: str | None = None  # None: allocate FEFO at the source location
     movement_type: str
     source_location_id: str | None = None
     destination_location_id: str | None = None
@@ -734,7 +5262,7 @@ class RetailSaleCreate(BaseModel):
     sale_date: date
     store_id: str
     product_id: str
-    batch_id: str | None = None
+    batch_id: str | None = None  # None: allocate FEFO at the store
     quantity_sold: int
     sales_agent_id: str | None = None
     sale_price_per_unit: float | None = None
@@ -789,38 +5317,66 @@ def register(user: UserCreate, db: Session = Depends(get_db)):
     if get_user_by_username(db, user.username):
         raise HTTPException(status_code=400, detail="Username already exists")
     hashed = hashlib.sha256(user.password.encode()).hexdigest()
-    db_user = create_user(db, {**user.dict(exclude={"password"}), "password": hashed})
+    db_user = create_user(
+        db, {**user.model_dump(exclude={"password"}), "password": hashed}
+    )
     return {"message": "User registered", "id": db_user.id}
 
 
 @app.post("/login")
 def login(credentials: UserLogin, db: Session = Depends(get_db)):
-    """Verify credentials and return role info."""
+    """Verify credentials and return role info with a session token."""
     user = get_user_by_username(db, credentials.username)
     hashed = hashlib.sha256(credentials.password.encode()).hexdigest()
-    if not user or user.password != hashed:
+    if not user or not secrets.compare_digest(user.password, hashed):
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    return {"role": user.role, "store_id": user.store_id}
+    token, expires_in = issue_session_token(user)
+    return {
+        "role": user.role,
+        "store_id": user.store_id,
+        "access_token": token,
+        "token_type": "bearer",
+        "expires_in": expires_in,
+    }
+
+
+@app.post("/logout")
+def logout(
+    bearer: HTTPAuthorizationCredentials | None = Depends(bearer_security),
+):
+    """Revoke the presented session token."""
+    try:
+        revoked = bool(bearer) and revoke_session_token(bearer.credentials)
+    except RevocationListFullError as exc:
+        raise HTTPException(
+            status_code=503,
+            detail=str(exc),
+            headers={"Retry-After": str(exc.retry_after)},
+        )
+    if not revoked:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    return {"message": "Logged out"}
+
+
+def _product_dict(p: ProductRef) -> dict:
+    return {
+        "product_id": p.product_id,
+        "product_name": p.product_name,
+        "unit_of_measure": p.unit_of_measure,
+        "standard_pack_size": p.standard_pack_size,
+        "mrp": p.mrp,
+    }
 
 
-@app.get("/products", dependencies=[auth_dep])
-def list_products(db: Session = Depends(get_db)):
+@app.get("/products", dependencies=[auth_dep, async_conditional_get("products")])
+async def list_products(db: AsyncSession = Depends(get_async_db)):
     """Return all products."""
-    products = get_all_products(db)
-    return [
-        {
-            "product_id": p.product_id,
-            "product_name": p.product_name,
-            "unit_of_measure": p.unit_of_measure,
-            "standard_pack_size": float(p.standard_pack_size),
-            "mrp": float(p.mrp) if p.mrp else None,
-        }
-        for p in products
-    ]
+    products = await db.run_sync(get_product_refs)
+    return [_product_dict(p) for p in products]
 
 
 @app.post("/products", status_code=201, dependencies=[auth_dep])
-def create_product(product: ProductCreate, db: Session = Depends(get_db)):
+def create_product_endpoint(product: ProductCreate, db: Session = Depends(get_db)):
     """Create a new product in the database."""
     # WHY: allow backend to manage DB by inserting products (Closes: #3)
     # WHAT: adds POST /products route for creating new products
@@ -828,132 +5384,753 @@ def create_product(product: ProductCreate, db: Session = Depends(get_db)):
     existing = db.get(Product, product.product_id)
     if existing:
         raise HTTPException(status_code=400, detail="Product ID already exists")
-    db_product = create_product(db, product.dict())
+    db_product = create_product(db, product.model_dump())
     return {"message": "Product created", "product_id": db_product.product_id}
 
 
 # WHY: bulk update products from CSV via API for admin automation (Closes: #45)
-# WHAT: POST /products/sync reads products.csv and upserts records
-# HOW: call sync_products_from_csv; remove route and CLI command to rollback
+# WHAT: POST /products/sync reads products.csv and upserts changed records
+# HOW: call sync_products_from_csv; ?dry_run=true previews the diff; remove
+#      route and CLI command to rollback
 @app.post("/products/sync", dependencies=[auth_dep])
-def sync_products(db: Session = Depends(get_db)):
-    count = sync_products_from_csv(db)
-    return {"message": f"{count} products synced"}
+def sync_products(dry_run: bool = False, db: Session = Depends(get_db)):
+    diff = sync_products_from_csv(db, dry_run=dry_run)
+    changed = len(diff["inserted"]) + len(diff["updated"])
+    verb = "would be synced" if dry_run else "synced"
+    return {"message": f"{changed} products {verb}", "dry_run": dry_run, **diff}
+
+
+BATCH_FIELDS = ("batch_id", "date_manufactured", "expiry_date", "remarks", "items")
+
+
+def _batch_row(b: Batch, items: list[BatchProduct]) -> tuple:
+    return (
+        b.batch_id,
+        b.date_manufactured,
+        b.expiry_date,
+        b.remarks,
+        [
+            {"product_id": i.product_id, "quantity_produced": i.quantity_produced}
+            for i in items
+        ],
+    )
 
 
-@app.get("/batches", dependencies=[auth_dep])
-def list_batches(db: Session = Depends(get_db)):
-    """Return all batches."""
+@app.get(
+    "/batches",
+    dependencies=[
+        auth_dep,
+        conditional_get("batches", "batch_products", "current_stock"),
+    ],
+)
+def list_batches(
+    response: Response,
+    limit: int = Query(BATCH_PAGE_SIZE, ge=1, le=1000),
+    cursor: str | None = None,
+    manufactured_from: date | None = None,
+    manufactured_to: date | None = None,
+    expiry_from: date | None = None,
+    expiry_to: date | None = None,
+    in_stock_at: str | None = None,
+    fmt: str = Depends(response_format),
+    db: Session = Depends(get_db),
+):
+    """Return batches, newest first, optionally paginated and date-filtered."""
     # WHY: list production batches for inventory tracking (Closes: #4)
-    batches = get_all_batches(db)
-    results = []
-    for b, items in batches:
-        results.append(
-            {
-                "batch_id": b.batch_id,
-                "date_manufactured": b.date_manufactured.isoformat(),
-                "expiry_date": b.expiry_date.isoformat() if b.expiry_date else None,
-                "remarks": b.remarks,
-                "items": [
-                    {
-                        "product_id": i.product_id,
-                        "quantity_produced": i.quantity_produced,
-                    }
-                    for i in items
-                ],
-            }
+    after = None
+    if cursor:
+        try:
+            manufactured, batch_id = decode_cursor(cursor)
+            after = (date.fromisoformat(manufactured), batch_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    batches = get_all_batches(
+        db,
+        limit=limit,
+        after=after,
+        manufactured_from=manufactured_from,
+        manufactured_to=manufactured_to,
+        expiry_from=expiry_from,
+        expiry_to=expiry_to,
+        in_stock_at=in_stock_at,
+    )
+    if len(batches) == limit:
+        last = batches[-1][0]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            last.date_manufactured, last.batch_id
         )
-    return results
+    rows = (_batch_row(b, items) for b, items in batches)
+    return rows_response(response, BATCH_FIELDS, rows, fmt)
 
 
 @app.post("/batches", status_code=201, dependencies=[auth_dep])
-def create_batch(batch: BatchCreate, db: Session = Depends(get_db)):
+def create_batch_endpoint(batch: BatchCreate, db: Session = Depends(get_db)):
     """Create a new batch."""
     existing = db.get(Batch, batch.batch_id)
     if existing:
         raise HTTPException(status_code=400, detail="Batch ID already exists")
-    batch_data = batch.dict()
+    batch_data = batch.model_dump()
     items = batch_data.pop("items")
     if not batch_data.get("expiry_date"):
         batch_data["expiry_date"] = batch_data["date_manufactured"] + timedelta(days=90)
-    db_batch = create_batch(db, batch_data, [i for i in items])
-    # WHY: update warehouse inventory when a batch is produced
-    add_new_batch_to_inventory(db, db_batch)
-    return {"message": "Batch created", "batch_id": db_batch.batch_id}
+    # WHY: the batch, its items and the warehouse stock commit together
+    batch_id = submit_write(
+        db,
+        lambda w: _batch_changes(w, batch_data, items).batch_id,
+        ("batches", "batch_products", "current_stock", "stock_alerts"),
+    )
+    return {"message": "Batch created", "batch_id": batch_id}
+
+
+MOVEMENT_FIELDS = (
+    "movement_id",
+    "product_id",
+    "batch_id",
+    "movement_date",
+    "movement_type",
+    "source_location_id",
+    "destination_location_id",
+    "quantity",
+    "agent_id",
+    "remarks",
+)
 
 
 @app.get("/stock-movements", dependencies=[auth_dep])
-def list_movements(db: Session = Depends(get_db)):
-    """Return all stock movements."""
-    movements = get_all_movements(db)
-    return [
-        {
-            "movement_id": m.movement_id,
-            "product_id": m.product_id,
-            "batch_id": m.batch_id,
-            "movement_date": m.movement_date.isoformat() if m.movement_date else None,
-            "movement_type": m.movement_type,
-            "source_location_id": m.source_location_id,
-            "destination_location_id": m.destination_location_id,
-            "quantity": m.quantity,
-            "agent_id": m.agent_id,
-            "remarks": m.remarks,
-        }
-        for m in movements
-    ]
+def list_movements(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    fmt: str = Depends(response_format),
+    db: Session = Depends(get_db),
+):
+    """Return a page of stock movements, newest first (unfiltered history)."""
+    return movement_history(response, limit=limit, cursor=cursor, fmt=fmt, db=db)
+
+
+# WHY: the movement log grows without limit; listing it whole does not scale
+# WHAT: keyset-paginated history filtered by date range, product, batch,
+#       location or store
+# HOW: follow the X-Next-Cursor header with ?cursor= to page backwards in time
+@app.get("/stock-movements/history", dependencies=[auth_dep])
+def movement_history(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    product_id: str | None = None,
+    batch_id: str | None = None,
+    location_id: str | None = None,
+    store_id: str | None = None,
+    fmt: str = Depends(response_format),
+    db: Session = Depends(get_db),
+):
+    """Return a page of stock movements, newest first."""
+    after = None
+    if cursor:
+        try:
+            moved, movement_id = decode_cursor(cursor)
+            after = (datetime.fromisoformat(moved), movement_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    movements = get_movement_history(
+        db,
+        limit=limit,
+        after=after,
+        date_from=date_from,
+        date_to=date_to,
+        product_id=product_id,
+        batch_id=batch_id,
+        location_id=location_id,
+        store_id=store_id,
+    )
+    if len(movements) == limit:
+        last = movements[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            last.movement_date, last.movement_id
+        )
+    return rows_response(
+        response, MOVEMENT_FIELDS, map(attrgetter(*MOVEMENT_FIELDS), movements), fmt
+    )
 
 
 @app.post("/stock-movements", status_code=201, dependencies=[auth_dep])
-def create_movement(movement: StockMovementCreate, db: Session = Depends(get_db)):
+def create_movement_endpoint(
+    movement: StockMovementCreate, db: Session = Depends(get_db)
+):
     """Record a stock movement."""
     existing = db.get(StockMovement, movement.movement_id)
     if existing:
         raise HTTPException(status_code=400, detail="Movement ID already exists")
-    db_move = create_movement(db, {**movement.dict(), "movement_date": date.today()})
-    # WHY: adjust CurrentStock on dispatch or receipt
-    # WHAT: front-end dashboard relies on this to update stock tables
-    # HOW: remove this call if inventory syncing is handled elsewhere
-    dispatch_stock(db, db_move)
-    return {"message": "Movement recorded", "movement_id": db_move.movement_id}
+    if not movement.batch_id and not movement.source_location_id:
+        raise HTTPException(
+            status_code=400, detail="batch_id is required without a source location"
+        )
+    try:
+        # WHY: adjust CurrentStock on dispatch or receipt
+        # WHAT: front-end dashboard relies on this to update stock tables
+        # HOW: the movement and its stock changes commit together
+        allocations = submit_write(
+            db,
+            lambda w: _allocation_rows(
+                _allocated_movement_changes(
+                    w, {**movement.model_dump(), "movement_date": date.today()}
+                ),
+                "movement_id",
+                "quantity",
+            ),
+            ("stock_movements", "current_stock", "stock_alerts"),
+        )
+    except (InsufficientStockError, DuplicateIdError) as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    except IntegrityError:
+        # a concurrent write took one of the ids after the check
+        raise HTTPException(status_code=409, detail="Movement ID already exists")
+    return {
+        "message": "Movement recorded",
+        "movement_id": movement.movement_id,
+        "allocations": allocations,
+    }
+
+
+# WHY: agents dispatch to ~20 stores at once; one request and one commit per
+#      movement is slow
+# WHAT: POST /stock-movements/bulk validates all lines together and applies
+#       the accepted ones with net stock deltas in one transaction
+# HOW: inspect per-line results and resubmit only rejected lines
+BULK_MOVEMENTS_MAX = 5000
+
+
+@app.post("/stock-movements/bulk", dependencies=[auth_dep])
+def create_movements_bulk_endpoint(
+    movements: list[StockMovementCreate], db: Session = Depends(get_db)
+):
+    """Record many stock movements and report a result per line."""
+    if len(movements) > BULK_MOVEMENTS_MAX:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {BULK_MOVEMENTS_MAX} movements per request",
+        )
+    today = date.today()
+    try:
+        results = create_movements_bulk(
+            db, [{**m.model_dump(), "movement_date": today} for m in movements]
+        )
+    except InsufficientStockError as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    created = sum(1 for r in results if r["status"] == "created")
+    return {
+        "created": created,
+        "rejected": len(results) - created,
+        "results": results,
+    }
 
 
 @app.post("/retail-sales", status_code=201, dependencies=[auth_dep])
 def record_retail_sale(sale: RetailSaleCreate, db: Session = Depends(get_db)):
     """Record sale at a retail partner and adjust stock."""
-    db_sale = create_retail_sale(db, sale.dict())
-    return {"message": "Sale recorded", "sale_id": db_sale.sale_id}
+    try:
+        allocations = submit_write(
+            db,
+            lambda w: _allocation_rows(
+                _allocated_sale_changes(w, sale.model_dump()),
+                "sale_id",
+                "quantity_sold",
+            ),
+            ("retail_sales", "current_stock", "stock_alerts"),
+        )
+    except (InsufficientStockError, DuplicateIdError) as exc:
+        raise HTTPException(status_code=409, detail=str(exc))
+    except IntegrityError:
+        # a concurrent write took one of the ids after the check
+        raise HTTPException(status_code=409, detail="Sale ID already exists")
+    return {
+        "message": "Sale recorded",
+        "sale_id": sale.sale_id,
+        "allocations": allocations,
+    }
 
 
-@app.get("/expiring-stock", dependencies=[auth_dep])
-def get_expiring_stock(days: int = 30, db: Session = Depends(get_db)):
-    """Return batches expiring within given days."""
-    cutoff = date.today() + timedelta(days=days)
-    batches = (
-        db.query(Batch)
-        .filter(Batch.expiry_date != None, Batch.expiry_date <= cutoff)
-        .all()
+@app.get("/reference-cache/stats", dependencies=[auth_dep])
+def reference_cache_statistics():
+    """Hit, miss and eviction counts per reference cache."""
+    return reference_cache_stats()
+
+
+@app.get("/write-pipeline/stats", dependencies=[auth_dep])
+def write_pipeline_stats():
+    """Group-commit counters and write throughput over the last minute."""
+    return write_pipeline.stats()
+
+
+async def verify_metrics_scraper(
+    bearer: HTTPAuthorizationCredentials | None = Depends(bearer_security),
+    basic: HTTPBasicCredentials | None = Depends(security),
+) -> None:
+    """Accept the METRICS_TOKEN scrape token, else a normal user login."""
+    if (
+        METRICS_TOKEN
+        and bearer
+        and hmac.compare_digest(bearer.credentials.encode(), METRICS_TOKEN.encode())
+    ):
+        return
+    await verify_auth(bearer, basic)
+
+
+@app.get(
+    "/metrics",
+    response_class=PlainTextResponse,
+    dependencies=[Depends(verify_metrics_scraper)],
+)
+async def prometheus_metrics():
+    """Request, SQL, write pipeline and cache metrics for Prometheus."""
+    return PlainTextResponse(
+        request_metrics.render(), media_type="text/plain; version=0.0.4"
+    )
+
+
+def _import_sales_file(text) -> dict:
+    with SessionLocal() as db:
+        return import_sales_csv(db, text)
+
+
+def _warm_reorder_forecast() -> None:
+    with SessionLocal() as db:
+        get_reorder_forecast(db)
+
+
+@app.post("/retail-sales/import", dependencies=[auth_dep])
+async def import_retail_sales(request: Request, background: BackgroundTasks):
+    """Import a CSV export of retail sales sent as the request body."""
+    # Spool the upload to disk past 1 MB so large files do not sit in memory
+    with tempfile.SpooledTemporaryFile(max_size=1 << 20) as spool:
+        async for part in request.stream():
+            spool.write(part)
+        spool.seek(0)
+        text = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+        try:
+            report = await run_in_threadpool(_import_sales_file, text)
+        finally:
+            text.detach()
+    if report["imported"]:
+        # the new sales changed the forecast's cache key; recompute it after
+        # the response instead of on the next dashboard load
+        background.add_task(_warm_reorder_forecast)
+    return report
+
+
+SALE_FIELDS = (
+    "sale_id",
+    "sale_date",
+    "store_id",
+    "product_id",
+    "batch_id",
+    "quantity_sold",
+    "sales_agent_id",
+    "sale_price_per_unit",
+    "remarks",
+)
+
+
+@app.get("/retail-sales/history", dependencies=[auth_dep])
+def sales_history(
+    response: Response,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    product_id: str | None = None,
+    batch_id: str | None = None,
+    location_id: str | None = None,
+    store_id: str | None = None,
+    fmt: str = Depends(response_format),
+    db: Session = Depends(get_db),
+):
+    """Return a page of retail sales, newest first."""
+    after = None
+    if cursor:
+        try:
+            sold, sale_id = decode_cursor(cursor)
+            after = (date.fromisoformat(sold), sale_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    sales = get_sales_history(
+        db,
+        limit=limit,
+        after=after,
+        date_from=date_from,
+        date_to=date_to,
+        product_id=product_id,
+        batch_id=batch_id,
+        location_id=location_id,
+        store_id=store_id,
+    )
+    if len(sales) == limit:
+        last = sales[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(
+            last.sale_date, last.sale_id
+        )
+    return rows_response(
+        response, SALE_FIELDS, map(attrgetter(*SALE_FIELDS), sales), fmt
     )
+
+
+# WHY: the Expiry Dashboard lists on-hand stock by soonest expiry and colours
+#      batches by status; the old query read a column batches does not have
+# WHAT: reads the expiry calendar index instead of joining stock to batches
+# HOW: ?days= bounds the window (expired stock included); status is
+#      red/yellow/green per EXPIRY_WARNING_DAYS
+@app.get("/expiring-stock", dependencies=[auth_dep])
+def list_expiring_stock(
+    days: int = Query(30, ge=0),
+    location_id: str | None = None,
+    limit: int | None = Query(None, ge=1, le=1000),
+    db: Session = Depends(get_db),
+):
+    """Return on-hand stock expiring within given days, soonest first."""
+    today = date.today()
+    return [
+        {
+            "batch_id": row.batch_id,
+            "product_id": row.product_id,
+            "product_name": product_name,
+            "location_id": row.location_id,
+            "expiry_date": row.expiry_date,
+            "units_available": row.quantity,
+            "status": expiry_status(row.expiry_date, today),
+        }
+        for row, product_name in get_expiring_stock(db, days, location_id, limit)
+    ]
+
+
+@app.get("/expiring-stock/summary", dependencies=[auth_dep])
+def expiring_stock_summary(days: int = Query(30, ge=0), db: Session = Depends(get_db)):
+    """Return the number of units expiring within given days."""
+    return {"days": days, "units": get_expiring_units_count(db, days)}
+
+
+@app.get(
+    "/expiring-stock/batches",
+    dependencies=[
+        auth_dep,
+        conditional_get("current_stock", "batches", daily=True),
+    ],
+)
+def batch_expiry_status(db: Session = Depends(get_db)):
+    """Return units on hand and green/yellow/red expiry status per batch."""
+    return get_batch_expiry_status(db)
+
+
+@app.get("/reports/stock", dependencies=[auth_dep])
+def stock_report(
+    as_of: date, location_id: str | None = None, db: Session = Depends(get_db)
+):
+    """Units per product, batch and location at the end of ``as_of``."""
+    snapshot_date, stock = compute_stock_as_of(db, as_of)
+    return {
+        "as_of": as_of.isoformat(),
+        "snapshot_date": snapshot_date.isoformat() if snapshot_date else None,
+        "rows": [
+            {
+                "product_id": product_id,
+                "batch_id": batch_id,
+                "location_id": loc,
+                "quantity": qty,
+            }
+            for (product_id, batch_id, loc), qty in sorted(stock.items())
+            if not location_id or loc == location_id
+        ],
+    }
+
+
+class ReorderThresholdIn(BaseModel):
+    """Schema for setting a store reorder threshold."""
+
+    store_id: str
+    product_id: str
+    min_quantity: int
+
+
+@app.get("/reorder-thresholds", dependencies=[auth_dep])
+def list_reorder_thresholds(store_id: str | None = None, db: Session = Depends(get_db)):
+    """Return reorder thresholds, optionally for one store."""
     return [
         {
-            "batch_id": b.batch_id,
-            "product_id": b.product_id,
-            "expiry_date": b.expiry_date.isoformat() if b.expiry_date else None,
+            "store_id": t.store_id,
+            "product_id": t.product_id,
+            "min_quantity": t.min_quantity,
         }
-        for b in batches
+        for t in get_reorder_thresholds(db, store_id)
     ]
 
 
+@app.put("/reorder-thresholds", dependencies=[auth_dep])
+def put_reorder_thresholds(
+    thresholds: list[ReorderThresholdIn], db: Session = Depends(get_db)
+):
+    """Insert or update thresholds and re-check the affected stock."""
+    if any(t.min_quantity < 0 for t in thresholds):
+        raise HTTPException(status_code=400, detail="min_quantity must be >= 0")
+    try:
+        saved = set_reorder_thresholds(db, [t.model_dump() for t in thresholds])
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    return {"message": f"{saved} thresholds saved"}
+
+
+def _alert_dict(alert: StockAlert) -> dict:
+    return {
+        "alert_id": alert.alert_id,
+        "alert_type": alert.alert_type,
+        "store_id": alert.store_id,
+        "location_id": alert.location_id,
+        "product_id": alert.product_id,
+        "batch_id": alert.batch_id,
+        "quantity": alert.quantity,
+        "threshold": alert.threshold,
+        "expiry_date": alert.expiry_date,
+        "created_at": alert.created_at,
+        "acknowledged_at": alert.acknowledged_at,
+        "acknowledged_by": alert.acknowledged_by,
+        "resolved_at": alert.resolved_at,
+    }
+
+
+# WHY: feed for the Alert Center and store low-stock badges
+# WHAT: alerts newest first, filtered by status, type and store; store users
+#       only see alerts for their own location
+# HOW: follow the X-Next-Cursor header with ?cursor= for older alerts
+@app.get("/alerts")
+def list_alerts(
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: str | None = None,
+    status: str = Query("active", pattern="^(" + "|".join(ALERT_STATUSES) + ")$"),
+    alert_type: str | None = Query(None, pattern="^(" + "|".join(ALERT_TYPES) + ")$"),
+    store_id: str | None = None,
+    user: AuthUser = auth_dep,
+    db: Session = Depends(get_db),
+):
+    """Return a page of stock alerts, newest first."""
+    after = None
+    if cursor:
+        try:
+            (after,) = decode_cursor(cursor)
+            after = int(after)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    alerts = get_alert_feed(
+        db,
+        limit=limit,
+        after=after,
+        status=status,
+        alert_type=alert_type,
+        store_id=store_id,
+        location_id=user.store_id if user.role == "store" else None,
+    )
+    if len(alerts) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(alerts[-1].alert_id)
+    return [_alert_dict(a) for a in alerts]
+
+
+@app.post("/alerts/{alert_id}/acknowledge")
+def acknowledge_alert_endpoint(
+    alert_id: int, user: AuthUser = auth_dep, db: Session = Depends(get_db)
+):
+    """Mark an alert as seen; it stays active until its condition clears."""
+    alert = db.get(StockAlert, alert_id)
+    if not alert or (user.role == "store" and alert.location_id != user.store_id):
+        raise HTTPException(status_code=404, detail="Alert not found")
+    return _alert_dict(acknowledge_alert(db, alert, user.username))
+
+
+@app.get("/forecast/reorder", dependencies=[auth_dep])
+async def reorder_forecast(
+    method: str = Query("ewma", pattern="^(ewma|sma)$"),
+    store_id: str | None = None,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Reorder suggestions per store from smoothed daily demand."""
+    forecast = await db.run_sync(get_reorder_forecast, method)
+    if store_id:
+        if store_id not in forecast["stores"]:
+            raise HTTPException(status_code=404, detail="Store not found")
+        forecast = {**forecast, "stores": {store_id: forecast["stores"][store_id]}}
+    return forecast
+
+
 # --- Dashboard endpoints ---
 
 
+# WHY: dashboards patch their tables from pushed changes instead of polling
+# WHAT: Server-Sent Events stream of movement, sale, batch, stock and alert
+#       events; store users only receive rows for their own location
+# HOW: new EventSource('/events?access_token=<token>'); EventSource cannot
+#      send headers, so the session token may be passed as a query parameter.
+#      A "ready" event is sent on every (re)connect so clients reload state
+@app.get("/events")
+async def change_events(
+    access_token: str | None = None,
+    bearer: HTTPAuthorizationCredentials | None = Depends(bearer_security),
+    basic: HTTPBasicCredentials | None = Depends(security),
+):
+    """Stream change events to a dashboard."""
+    if access_token:
+        bearer = HTTPAuthorizationCredentials(scheme="Bearer", credentials=access_token)
+    user = await verify_auth(bearer, basic)
+    location_id = user.store_id if user.role == "store" else None
+
+    async def stream():
+        subscriber = subscribe_events(location_id)
+        try:
+            yield f"retry: 3000\nevent: ready\ndata: {{}}\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(
+                        subscriber.queue.get(), SSE_KEEPALIVE_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if message is None:
+                    break
+                yield message
+        finally:
+            unsubscribe_events(subscriber)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def read_concurrently(*calls: tuple) -> list:
+    """Run independent read-only service calls concurrently.
+
+    Each ``(fn, *args)`` call gets its own session (and so its own pooled
+    connection); results come back in call order.
+    """
+
+    async def run(fn, *args):
+        async with AsyncSessionLocal() as db:
+            return await db.run_sync(fn, *args)
+
+    return await asyncio.gather(*(run(*call) for call in calls))
+
+
+WAREHOUSE_STOCK_FIELDS = ("product_id", "batch_id", "quantity")
+
+
+def _stock_dict(r: CurrentStock) -> dict:
+    return dict(zip(WAREHOUSE_STOCK_FIELDS, attrgetter(*WAREHOUSE_STOCK_FIELDS)(r)))
+
+
+def _delivery_dict(d: StockMovement) -> dict:
+    return {
+        "movement_id": d.movement_id,
+        "product_id": d.product_id,
+        "quantity": d.quantity,
+        "movement_date": d.movement_date,
+    }
+
+
+def _recent_sale_dict(s: RetailSale) -> dict:
+    return {
+        "sale_id": s.sale_id,
+        "store_id": s.store_id,
+        "product_id": s.product_id,
+        "quantity_sold": s.quantity_sold,
+        "sale_date": s.sale_date,
+    }
+
+
+# WHY: the dashboards issued eight (manufacturer) or four (store) requests on
+#      load, several of them repeating the same lookups
+# WHAT: one payload per page; independent aggregates run concurrently on
+#       separate sessions, shared data (products, partners, warehouse rows,
+#       the store's location) is read once and derived values computed from it
+# HOW: GET /dashboard/arivu/bootstrap, GET /dashboard/store/{id}/bootstrap;
+#      the per-widget endpoints remain for refreshes
+@app.get("/dashboard/arivu/bootstrap", dependencies=[auth_dep])
+async def arivu_bootstrap():
+    """Everything the manufacturer dashboard needs on first load."""
+    (
+        products,
+        partners,
+        batches,
+        stock,
+        warehouse_total,
+        retail_total,
+        expiring,
+        sales,
+        movements,
+    ) = await read_concurrently(
+        (get_product_refs,),
+        (get_partner_refs,),
+        (get_dispatchable_batches,),
+        (get_warehouse_stock, CENTRAL_WAREHOUSE_ID),
+        (get_total_warehouse_stock,),
+        (get_total_retail_stock,),
+        (get_expiring_units_count, 60),
+        (get_recent_sales, 5),
+        (get_movement_history, 5),
+    )
+    totals: dict[str, int] = {}
+    for r in stock:
+        totals[r.product_id] = totals.get(r.product_id, 0) + r.quantity
+    return {
+        "metrics": {
+            "total_products": len(products),
+            "warehouse_stock": warehouse_total,
+            "retail_stock": retail_total,
+            "expiring_soon": expiring,
+        },
+        "products": [_product_dict(p) for p in products],
+        "retail_partners": [_partner_dict(p) for p in partners],
+        "batches": [dict(zip(BATCH_FIELDS, _batch_row(*b))) for b in batches],
+        "warehouse_stock": [_stock_dict(r) for r in stock],
+        "warehouse_summary": [
+            {"product_id": p, "quantity": q} for p, q in sorted(totals.items())
+        ],
+        "recent_sales": [_recent_sale_dict(s) for s in sales],
+        "recent_movements": [
+            dict(zip(MOVEMENT_FIELDS, attrgetter(*MOVEMENT_FIELDS)(m)))
+            for m in movements
+        ],
+    }
+
+
+@app.get("/dashboard/store/{store_id}/bootstrap", dependencies=[auth_dep])
+async def store_bootstrap(store_id: str, db: AsyncSession = Depends(get_async_db)):
+    """Everything the store partner dashboard needs on first load."""
+    partner = await db.run_sync(get_partner_ref, store_id)
+    if not partner:
+        raise HTTPException(status_code=404, detail="Store not found")
+    location_id = partner.location_id
+    stock, deliveries, sales_today = await read_concurrently(
+        (get_store_current_stock_summary, store_id, location_id),
+        (get_store_upcoming_deliveries, store_id, location_id),
+        (get_store_sales_today, store_id),
+    )
+    return {
+        "store": _partner_dict(partner),
+        "current_stock": sum(r.quantity for r in stock),
+        "sales_today": sales_today,
+        "stock": [_stock_dict(r) for r in stock],
+        "deliveries": [_delivery_dict(d) for d in deliveries],
+    }
+
+
 @app.get("/dashboard/arivu", dependencies=[auth_dep])
-def arivu_dashboard(db: Session = Depends(get_db)):
+async def arivu_dashboard(db: AsyncSession = Depends(get_async_db)):
     """Aggregate metrics for manufacturer dashboard."""
     return {
-        "total_products": get_total_products_count(db),
-        "warehouse_stock": get_total_warehouse_stock(db),
-        "retail_stock": get_total_retail_stock(db),
-        "expiring_soon": get_expiring_units_count(db, 60),
+        "total_products": await db.run_sync(get_total_products_count),
+        "warehouse_stock": await db.run_sync(get_total_warehouse_stock),
+        "retail_stock": await db.run_sync(get_total_retail_stock),
+        "expiring_soon": await db.run_sync(get_expiring_units_count, 60),
         "recent_movements": [
             {
                 "movement_id": m.movement_id,
@@ -963,102 +6140,98 @@ def arivu_dashboard(db: Session = Depends(get_db)):
                     m.movement_date.isoformat() if m.movement_date else None
                 ),
             }
-            for m in get_recent_movements(db)
+            for m in await db.run_sync(get_recent_movements)
         ],
     }
 
 
+@app.get("/dashboard/stock-heatmap", dependencies=[auth_dep])
+async def stock_heatmap(db: AsyncSession = Depends(get_async_db)):
+    """Store x product units matrix; ``values`` is row-major over rows/columns."""
+    return await db.run_sync(get_stock_heatmap)
+
+
 @app.get("/dashboard/store/{store_id}", dependencies=[auth_dep])
-def store_dashboard(store_id: str, db: Session = Depends(get_db)):
+async def store_dashboard(store_id: str, db: AsyncSession = Depends(get_async_db)):
     """Return stock and sales info for a retail partner."""
-    partner = db.get(RetailPartner, store_id)
+    partner = await db.run_sync(get_partner_ref, store_id)
     if not partner:
         raise HTTPException(status_code=404, detail="Store not found")
     return {
-        "current_stock": get_store_current_stock(db, store_id),
-        "sales_today": get_store_sales_today(db, store_id),
+        "current_stock": await db.run_sync(
+            get_store_current_stock, store_id, partner.location_id
+        ),
+        "sales_today": await db.run_sync(get_store_sales_today, store_id),
     }
 
 
 @app.get("/dashboard/store/{store_id}/stock", dependencies=[auth_dep])
-def store_stock_details(store_id: str, db: Session = Depends(get_db)):
+async def store_stock_details(store_id: str, db: AsyncSession = Depends(get_async_db)):
     """Detailed stock table for a store."""
-    partner = db.get(RetailPartner, store_id)
+    partner = await db.run_sync(get_partner_ref, store_id)
     if not partner:
         raise HTTPException(status_code=404, detail="Store not found")
-    records = get_store_current_stock_summary(db, store_id)
-    return [
-        {
-            "product_id": r.product_id,
-            "batch_id": r.batch_id,
-            "quantity": r.quantity,
-        }
-        for r in records
-    ]
+    records = await db.run_sync(
+        get_store_current_stock_summary, store_id, partner.location_id
+    )
+    return [_stock_dict(r) for r in records]
 
 
 @app.get("/dashboard/store/{store_id}/deliveries", dependencies=[auth_dep])
-def store_upcoming_deliveries(store_id: str, db: Session = Depends(get_db)):
+async def store_upcoming_deliveries(
+    store_id: str, db: AsyncSession = Depends(get_async_db)
+):
     """Upcoming dispatches destined for the store."""
-    partner = db.get(RetailPartner, store_id)
+    partner = await db.run_sync(get_partner_ref, store_id)
     if not partner:
         raise HTTPException(status_code=404, detail="Store not found")
-    deliveries = get_store_upcoming_deliveries(db, store_id)
-    return [
-        {
-            "movement_id": d.movement_id,
-            "product_id": d.product_id,
-            "quantity": d.quantity,
-            "movement_date": d.movement_date.isoformat() if d.movement_date else None,
-        }
-        for d in deliveries
-    ]
+    deliveries = await db.run_sync(
+        get_store_upcoming_deliveries, store_id, partner.location_id
+    )
+    return [_delivery_dict(d) for d in deliveries]
 
 
 @app.get("/dashboard/recent-sales", dependencies=[auth_dep])
-def recent_sales(limit: int = 5, db: Session = Depends(get_db)):
+async def recent_sales(limit: int = 5, db: AsyncSession = Depends(get_async_db)):
     """Return recent retail sales for overview."""
     # WHY: show latest sales data on dashboards (Closes: #7)
-    sales = get_recent_sales(db, limit)
-    return [
-        {
-            "sale_id": s.sale_id,
-            "store_id": s.store_id,
-            "product_id": s.product_id,
-            "quantity_sold": s.quantity_sold,
-            "sale_date": s.sale_date.isoformat() if s.sale_date else None,
-        }
-        for s in sales
-    ]
+    sales = await db.run_sync(get_recent_sales, limit)
+    return [_recent_sale_dict(s) for s in sales]
 
 
 @app.get("/warehouse-stock", dependencies=[auth_dep])
-def warehouse_stock(warehouse_id: str = "MAIN_WH", db: Session = Depends(get_db)):
+async def warehouse_stock(
+    response: Response,
+    warehouse_id: str = "MAIN_WH",
+    fmt: str = Depends(response_format),
+    db: AsyncSession = Depends(get_async_db),
+):
     """Return current stock records for a warehouse."""
-    stock = get_warehouse_stock(db, warehouse_id)
-    return [
-        {
-            "product_id": s.product_id,
-            "batch_id": s.batch_id,
-            "quantity": s.quantity,
-        }
-        for s in stock
-    ]
+    stock = await db.run_sync(get_warehouse_stock, warehouse_id)
+    return rows_response(
+        response,
+        WAREHOUSE_STOCK_FIELDS,
+        map(attrgetter(*WAREHOUSE_STOCK_FIELDS), stock),
+        fmt,
+    )
 
 
-@app.get("/warehouse-stock/summary", dependencies=[auth_dep])
-def warehouse_stock_summary(
-    warehouse_id: str = "MAIN_WH", db: Session = Depends(get_db)
+@app.get(
+    "/warehouse-stock/summary",
+    dependencies=[auth_dep, async_conditional_get("current_stock")],
+)
+async def warehouse_stock_summary(
+    warehouse_id: str = "MAIN_WH", db: AsyncSession = Depends(get_async_db)
 ):
     """Return product totals for a warehouse for quick dashboard view."""
-    records = get_warehouse_product_totals(db, warehouse_id)
+    records = await db.run_sync(get_warehouse_product_totals, warehouse_id)
     return [{"product_id": r.product_id, "quantity": r.total_quantity} for r in records]
 
 
-@app.get("/locations")
-def list_locations(db: Session = Depends(get_db)):
+@app.get("/locations", dependencies=[async_conditional_get("locations")])
+async def list_locations(db: AsyncSession = Depends(get_async_db)):
     """List all locations."""
-    locations = db.query(Location).all()
+    locations = await db.run_sync(get_location_refs)
     return [
         {
             "location_id": l.location_id,
@@ -1069,18 +6242,22 @@ def list_locations(db: Session = Depends(get_db)):
     ]
 
 
-@app.get("/retail-partners", dependencies=[auth_dep])
-def list_retail_partners(db: Session = Depends(get_db)):
+def _partner_dict(p: PartnerRef) -> dict:
+    return {
+        "store_id": p.store_id,
+        "location_id": p.location_id,
+        "store_name": p.store_name,
+    }
+
+
+@app.get(
+    "/retail-partners",
+    dependencies=[auth_dep, async_conditional_get("retail_partners")],
+)
+async def list_retail_partners(db: AsyncSession = Depends(get_async_db)):
     """Return all retail partners."""
-    partners = get_all_retail_partners(db)
-    return [
-        {
-            "store_id": p.store_id,
-            "location_id": p.location_id,
-            "store_name": p.store_name,
-        }
-        for p in partners
-    ]
+    partners = await db.run_sync(get_partner_refs)
+    return [_partner_dict(p) for p in partners]
 
 
 @app.post("/retail-partners", status_code=201, dependencies=[auth_dep])
@@ -1090,7 +6267,7 @@ def create_retail_partner_endpoint(
     """Create a new retail partner."""
     if db.get(RetailPartner, partner.store_id):
         raise HTTPException(status_code=400, detail="Store ID already exists")
-    db_partner = create_retail_partner(db, partner.dict())
+    db_partner = create_retail_partner(db, partner.model_dump())
     return {"message": "Retail partner created", "store_id": db_partner.store_id}
 
 
@@ -1106,7 +6283,7 @@ def create_store_partner_account_endpoint(
         raise HTTPException(status_code=400, detail="Username already exists")
     hashed = hashlib.sha256(account.password.encode()).hexdigest()
     create_store_partner_account(
-        db, {**account.dict(exclude={"password"}), "password": hashed}
+        db, {**account.model_dump(exclude={"password"}), "password": hashed}
     )
     return {"message": "Store partner account created", "store_id": account.store_id}
 
@@ -1124,8 +6301,109 @@ if __name__ == "__main__":
         elif cmd == "analyze-schema":
             analyze_schema()
         elif cmd == "sync-products":
+            dry_run = "--dry-run" in sys.argv[2:]
+            with SessionLocal() as db:
+                diff = sync_products_from_csv(db, dry_run=dry_run)
+            prefix = "Would insert" if dry_run else "Inserted"
+            print(f"{prefix} {len(diff['inserted'])}: {', '.join(diff['inserted'])}")
+            prefix = "Would update" if dry_run else "Updated"
+            print(f"{prefix} {len(diff['updated'])}: {', '.join(diff['updated'])}")
+            print(f"Unchanged {diff['unchanged']}")
+        elif cmd == "migrate":
+            if "--status" in sys.argv[2:]:
+                applied = get_applied_migrations()
+                for version, name, _ in MIGRATIONS:
+                    state = "applied" if version in applied else "pending"
+                    print(f"{version:>4}  {state:<8} {name}")
+            else:
+                versions = run_migrations()
+                print(f"Applied migrations: {versions or 'none pending'}")
+        elif cmd == "check-query-plans":
+            problems = check_query_plans(verbose="--verbose" in sys.argv[2:])
+            for problem in problems:
+                print(f"FULL SCAN {problem}")
+            print(f"{len(problems)} full table scans found")
+            sys.exit(1 if problems else 0)
+        elif cmd == "bench-stock-contention":
+            args = sys.argv[2:]
+            options = dict(zip(args, args[1:]))
+            report = bench_stock_contention(
+                threads=int(options.get("--threads", 16)),
+                ops=int(options.get("--ops", 100)),
+                pipeline="--pipeline" in args,
+            )
+            problems = report.pop("problems")
+            for key, value in report.items():
+                print(f"{key:>15}: {value}")
+            for problem in problems:
+                print(f"MISMATCH {problem}")
+            sys.exit(1 if problems or report["failed"] else 0)
+        elif cmd == "gen-data":
+            args = sys.argv[2:]
+            options = dict(zip(args, args[1:]))
+            counts = {
+                key: int(options[f"--{key}"])
+                for key in GEN_DATA_DEFAULTS
+                if f"--{key}" in options
+            }
+            path = options.get("--db", "arivu_bench.db")
+            try:
+                report = generate_data(path, **counts)
+            except ValueError as exc:
+                print(exc)
+                sys.exit(1)
+            for key, value in report.items():
+                print(f"{key:>15}: {value}")
+        elif cmd == "bench-api":
+            args = sys.argv[2:]
+            options = dict(zip(args, args[1:]))
+            report = bench_api(
+                total=int(options.get("--requests", 500)),
+                concurrency=int(options.get("--concurrency", 8)),
+            )
+            for scenario, result in report["scenarios"].items():
+                print(
+                    f"{scenario}: {result['throughput_rps']} req/s "
+                    f"over {result['requests']} requests"
+                )
+                for endpoint, stats in result["endpoints"].items():
+                    print(
+                        f"  {endpoint:<38} n={stats['requests']:<5} "
+                        f"err={stats['errors']:<3} p50={stats['p50_ms']:>8} "
+                        f"p95={stats['p95_ms']:>8} p99={stats['p99_ms']:>8} ms"
+                    )
+            if "--save" in options:
+                with open(options["--save"], "w", encoding="utf-8") as f:
+                    json.dump(report, f, indent=2)
+                print(f"Saved {options['--save']}")
+            if "--compare" in options:
+                with open(options["--compare"], encoding="utf-8") as f:
+                    baseline = json.load(f)
+                regressions = compare_bench(
+                    report, baseline, float(options.get("--tolerance", 0.25))
+                )
+                for regression in regressions:
+                    print(f"REGRESSION {regression}")
+                print(f"{len(regressions)} regressions against {options['--compare']}")
+                sys.exit(1 if regressions else 0)
+        elif cmd == "snapshot-stock":
+            with SessionLocal() as db:
+                created = ensure_month_end_snapshots(db, date.today())
+            print(f"Created snapshots: {[d.isoformat() for d in created] or 'none'}")
+        elif cmd == "sweep-alerts":
             with SessionLocal() as db:
-                sync_products_from_csv(db)
+                opened = sweep_expiry_alerts(db)
+            print(f"{len(opened)} expiry alerts opened")
+        elif cmd == "import-sales":
+            if len(sys.argv) < 3:
+                print("Usage: python main.py import-sales <file.csv>")
+                sys.exit(1)
+            with open(sys.argv[2], newline="", encoding="utf-8-sig") as f:
+                with SessionLocal() as db:
+                    report = import_sales_csv(db, f)
+            print(f"{report['imported']} sales imported, {report['rejected']} rejected")
+            for err in report["errors"]:
+                print(f"  line {err['line']}: {err['detail']}")
         else:
             print("Unknown command")
     else:
@@ -1,5 +1,7 @@
 -- Schema extracted from sqlscema.md
 -- Contains table definitions for Arivu Foods Inventory
+-- Secondary indexes are owned by the versioned migrations in main.py
+-- (MIGRATIONS); apply them with `python main.py migrate`
 
 CREATE TABLE products (
     product_id VARCHAR(50) PRIMARY KEY,
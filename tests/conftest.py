@@ -0,0 +1,112 @@
+"""Shared fixtures: a throwaway SQLite database and a small seeded inventory."""
+
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+_tmp = tempfile.mkdtemp(prefix="arivu-tests-")
+# main.py builds its engines at import time, so point it at a scratch file first
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/test.db"
+os.environ.setdefault("QUERY_PROFILE_LOG", f"{_tmp}/query_profile.jsonl")
+os.chdir(ROOT)
+sys.path.insert(0, str(ROOT))
+
+import main  # noqa: E402
+
+_DATA_TABLES = [
+    t
+    for t in reversed(main.Base.metadata.sorted_tables)
+    if t.name != "schema_migrations"
+]
+
+
+@pytest.fixture
+def db():
+    with main.engine.begin() as conn:
+        for table in _DATA_TABLES:
+            conn.execute(table.delete())
+    main.bump_table_versions(*(t.name for t in _DATA_TABLES))
+    with main.SessionLocal() as session:
+        yield session
+
+
+@pytest.fixture
+def seeded(db):
+    """MAIN_WH with batches B1 (expires in 60 days) and B2 (120 days) of P1,
+    10 units of B1 and 5 of B2 dispatched to store S1 at location L1."""
+    today = date.today()
+    db.add_all(
+        [
+            main.Location(
+                location_id="MAIN_WH", location_name="WH", location_type="Warehouse"
+            ),
+            main.Location(
+                location_id="L1", location_name="Store", location_type="Retail Store"
+            ),
+            main.Product(
+                product_id="P1",
+                product_name="Millet",
+                unit_of_measure="kg",
+                standard_pack_size=1,
+                mrp=100,
+            ),
+        ]
+    )
+    db.commit()
+    main.create_retail_partner(
+        db, {"store_id": "S1", "location_id": "L1", "store_name": "Store"}
+    )
+    for batch_id, days in (("B1", 60), ("B2", 120)):
+        main.create_batch(
+            db,
+            {
+                "batch_id": batch_id,
+                "date_manufactured": today - timedelta(days=5),
+                "expiry_date": today + timedelta(days=days),
+            },
+            [{"product_id": "P1", "quantity_produced": 100}],
+        )
+    for movement_id, batch_id, quantity in (("M1", "B1", 10), ("M2", "B2", 5)):
+        main.record_movement(
+            db,
+            {
+                "movement_id": movement_id,
+                "product_id": "P1",
+                "batch_id": batch_id,
+                "movement_date": today - timedelta(days=1),
+                "movement_type": "Dispatch",
+                "source_location_id": "MAIN_WH",
+                "destination_location_id": "L1",
+                "quantity": quantity,
+            },
+        )
+    return db
+
+
+def stock(db, batch_id, location_id="L1"):
+    row = db.get(main.CurrentStock, main._stock_id("P1", batch_id, location_id))
+    db.expire_all()
+    return row.quantity if row else 0
+
+
+@pytest.fixture
+def client(db):
+    """TestClient logged in as an Arivu user (Basic auth)."""
+    from fastapi.testclient import TestClient
+
+    main.create_user(
+        db,
+        {
+            "username": "tester",
+            "password": main.hashlib.sha256(b"pw").hexdigest(),
+            "role": "arivu",
+        },
+    )
+    with TestClient(main.app) as test_client:
+        test_client.auth = ("tester", "pw")
+        yield test_client
@@ -0,0 +1,76 @@
+from datetime import date, timedelta
+
+import main
+
+
+def travel(monkeypatch, days):
+    """Make main's date.today() return ``days`` from now."""
+    target = date.today() + timedelta(days=days)
+
+    class FutureDate(date):
+        @classmethod
+        def today(cls):
+            return target
+
+    monkeypatch.setattr(main, "date", FutureDate)
+
+
+def active(db):
+    return sorted(
+        (a.alert_type, a.batch_id, a.location_id)
+        for a in db.query(main.StockAlert).filter(main.StockAlert.resolved_at.is_(None))
+        if a.alert_type != "low_stock"
+    )
+
+
+def test_daily_sweep_flags_stock_nobody_touched(seeded, monkeypatch):
+    # B1 expires in 60 days, B2 in 120; nothing moves after seeding
+    assert active(seeded) == []
+    assert main.sweep_expiry_alerts(seeded) == []
+
+    travel(monkeypatch, 60 - main.EXPIRY_WARNING_DAYS)
+    main.sweep_expiry_alerts(seeded)
+    assert active(seeded) == [
+        ("expiring", "B1", "L1"),
+        ("expiring", "B1", "MAIN_WH"),
+    ]
+
+    travel(monkeypatch, 61)
+    main.sweep_expiry_alerts(seeded)
+    assert active(seeded) == [
+        ("expired", "B1", "L1"),
+        ("expired", "B1", "MAIN_WH"),
+    ]
+
+
+def _low_stock(db):
+    return [
+        a.threshold
+        for a in db.query(main.StockAlert).filter(
+            main.StockAlert.alert_type == "low_stock",
+            main.StockAlert.resolved_at.is_(None),
+        )
+    ]
+
+
+def test_thresholds_upsert_and_reject_unknown_stores(seeded, client):
+    def put(*rows):
+        return client.put(
+            "/reorder-thresholds",
+            json=[
+                {"store_id": s, "product_id": "P1", "min_quantity": q} for s, q in rows
+            ],
+        )
+
+    resp = put(("S1", 20), ("NOPE", 5))
+    assert resp.status_code == 400
+    assert "NOPE" in resp.json()["detail"]
+    assert main.get_reorder_thresholds(seeded) == []
+
+    # L1 holds 15 units of P1
+    assert put(("S1", 20)).status_code == 200
+    assert _low_stock(seeded) == [20]
+    assert put(("S1", 10)).status_code == 200
+    seeded.expire_all()
+    assert [t.min_quantity for t in main.get_reorder_thresholds(seeded)] == [10]
+    assert _low_stock(seeded) == []
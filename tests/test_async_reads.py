@@ -0,0 +1,81 @@
+"""Async dashboard and reference routes, read through the async session."""
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def async_only(client):
+    """Fail any route that falls back to the sync session."""
+
+    def no_sync_session():
+        raise AssertionError("async route opened a sync session")
+        yield
+
+    main.app.dependency_overrides[main.get_db] = no_sync_session
+    yield client
+    main.app.dependency_overrides.pop(main.get_db)
+
+
+def test_arivu_dashboard_totals(seeded, async_only):
+    body = async_only.get("/dashboard/arivu").json()
+    assert body["total_products"] == 1
+    assert body["warehouse_stock"] == 185
+    assert body["retail_stock"] == 15
+    # B1 expires in 60 days, B2 in 120
+    assert body["expiring_soon"] == 100
+    assert {m["movement_id"] for m in body["recent_movements"]} == {"M1", "M2"}
+
+
+def test_store_routes_scope_to_the_partner_location(seeded, async_only):
+    bootstrap = async_only.get("/dashboard/store/S1/bootstrap").json()
+    assert bootstrap["store"] == {
+        "store_id": "S1",
+        "location_id": "L1",
+        "store_name": "Store",
+    }
+    assert bootstrap["current_stock"] == 15
+    assert bootstrap["sales_today"] == 0
+
+    stock = async_only.get("/dashboard/store/S1/stock").json()
+    assert sorted((r["batch_id"], r["quantity"]) for r in stock) == [
+        ("B1", 10),
+        ("B2", 5),
+    ]
+    assert async_only.get("/dashboard/store/S1").json()["current_stock"] == 15
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "/dashboard/store/NOPE",
+        "/dashboard/store/NOPE/bootstrap",
+        "/dashboard/store/NOPE/stock",
+        "/dashboard/store/NOPE/deliveries",
+    ],
+)
+def test_unknown_store_is_404(seeded, async_only, url):
+    assert async_only.get(url).status_code == 404
+
+
+def test_reference_lists(seeded, async_only):
+    assert async_only.get("/products").json()[0]["product_id"] == "P1"
+    assert {l["location_id"] for l in async_only.get("/locations").json()} == {
+        "MAIN_WH",
+        "L1",
+    }
+    assert async_only.get("/retail-partners").json() == [
+        {"store_id": "S1", "location_id": "L1", "store_name": "Store"}
+    ]
+
+
+def test_warehouse_stock_and_summary(seeded, async_only):
+    stock = async_only.get("/warehouse-stock").json()
+    assert sorted((r["batch_id"], r["quantity"]) for r in stock) == [
+        ("B1", 90),
+        ("B2", 95),
+    ]
+    assert async_only.get("/warehouse-stock/summary").json() == [
+        {"product_id": "P1", "quantity": 185}
+    ]
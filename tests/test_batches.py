@@ -0,0 +1,72 @@
+from datetime import date, timedelta
+
+import main
+
+
+def test_bootstrap_lists_only_batches_with_warehouse_stock(seeded, client):
+    today = date.today()
+    main.create_batch(
+        seeded,
+        {
+            "batch_id": "B3",
+            "date_manufactured": today,
+            "expiry_date": today + timedelta(days=90),
+        },
+        [{"product_id": "P1", "quantity_produced": 10}],
+    )
+    main.record_movement(
+        seeded,
+        {
+            "movement_id": "M3",
+            "product_id": "P1",
+            "batch_id": "B3",
+            "movement_date": today,
+            "movement_type": "dispatch",
+            "source_location_id": "MAIN_WH",
+            "destination_location_id": "L1",
+            "quantity": 10,
+        },
+    )
+
+    batches = client.get("/dashboard/arivu/bootstrap").json()["batches"]
+    assert sorted(b["batch_id"] for b in batches) == ["B1", "B2"]
+    listed = client.get("/batches", params={"in_stock_at": "MAIN_WH"}).json()
+    assert sorted(b["batch_id"] for b in listed) == ["B1", "B2"]
+
+
+def test_batches_default_to_one_page(seeded, client):
+    today = date.today()
+    seeded.add_all(
+        main.Batch(batch_id=f"X{n:03}", date_manufactured=today, expiry_date=today)
+        for n in range(main.BATCH_PAGE_SIZE)
+    )
+    seeded.commit()
+
+    resp = client.get("/batches")
+    assert len(resp.json()) == main.BATCH_PAGE_SIZE
+    assert "X-Next-Cursor" in resp.headers
+
+
+def test_bootstrap_keeps_oldest_warehouse_stock_past_a_page(seeded, client):
+    today = date.today()
+    for n in range(main.BATCH_PAGE_SIZE):
+        batch_id = f"X{n:03}"
+        seeded.add(
+            main.Batch(batch_id=batch_id, date_manufactured=today, expiry_date=today)
+        )
+        seeded.add(
+            main.CurrentStock(
+                stock_id=main._stock_id("P1", batch_id, "MAIN_WH"),
+                product_id="P1",
+                batch_id=batch_id,
+                location_id="MAIN_WH",
+                quantity=1,
+            )
+        )
+    seeded.commit()
+
+    batches = client.get("/dashboard/arivu/bootstrap").json()["batches"]
+    ids = {b["batch_id"] for b in batches}
+    assert len(ids) == main.BATCH_PAGE_SIZE + 2
+    # B1 and B2 are the oldest and would be cut by a newest-first page
+    assert {"B1", "B2"} <= ids
@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+import main
+
+SMALL = {"products": 5, "stores": 3, "batches": 20, "movements": 200, "sales": 100}
+
+
+def test_gen_data_stock_matches_its_history(tmp_path):
+    path = tmp_path / "gen.db"
+    counts = main.generate_data(str(path), days=10, **SMALL)
+    assert counts["stock_movements"] == 200
+    assert counts["retail_sales"] == 100
+
+    conn = sqlite3.connect(path)
+    produced, shelf, warehouse, sold, calendar = conn.execute("""SELECT
+             (SELECT SUM(quantity_produced) FROM batch_products),
+             (SELECT SUM(quantity) FROM current_stock WHERE location_id != 'MAIN_WH'),
+             (SELECT SUM(quantity) FROM current_stock WHERE location_id = 'MAIN_WH'),
+             (SELECT SUM(quantity_sold) FROM retail_sales),
+             (SELECT SUM(quantity) FROM expiry_calendar)""").fetchone()
+    conn.close()
+    assert produced == warehouse + shelf + sold
+    assert calendar == warehouse + shelf
+
+    with pytest.raises(ValueError, match="already contains data"):
+        main.generate_data(str(path), **SMALL)
+
+
+def test_bench_api_reports_every_scenario(seeded):
+    report = main.bench_api(total=6, concurrency=2)
+    assert set(report["scenarios"]) == {
+        "dashboard_reads",
+        "dispatches",
+        "sales",
+        "batch_creation",
+        "mixed",
+    }
+    for scenario in report["scenarios"].values():
+        assert scenario["requests"] == 6
+        for endpoint in scenario["endpoints"].values():
+            assert endpoint["errors"] == 0
+            assert endpoint["p50_ms"] <= endpoint["p95_ms"] <= endpoint["p99_ms"]
+    assert report["table_rows"]["products"] == 1
+
+
+def _report(p95, rps):
+    return {
+        "scenarios": {
+            "sales": {
+                "throughput_rps": rps,
+                "endpoints": {"POST /retail-sales": {"p95_ms": p95}},
+            }
+        }
+    }
+
+
+def test_compare_bench_flags_regressions_beyond_tolerance():
+    baseline = _report(p95=10, rps=100)
+    assert main.compare_bench(_report(p95=12, rps=80), baseline) == []
+    assert main.compare_bench(_report(p95=20, rps=50), baseline) == [
+        "sales POST /retail-sales: p95 10 -> 20 ms",
+        "sales: throughput 100 -> 50 req/s",
+    ]
@@ -0,0 +1,55 @@
+from datetime import date
+
+import pytest
+
+import main
+from conftest import stock
+
+
+def _move(movement_id, batch_id, quantity, src="MAIN_WH", dest="L1"):
+    return {
+        "movement_id": movement_id,
+        "product_id": "P1",
+        "batch_id": batch_id,
+        "movement_date": date.today(),
+        "movement_type": "Dispatch",
+        "source_location_id": src,
+        "destination_location_id": dest,
+        "quantity": quantity,
+        "agent_id": None,
+        "remarks": None,
+    }
+
+
+def test_bulk_applies_net_deltas(seeded):
+    results = main.create_movements_bulk(
+        seeded,
+        [_move("BM1", "B1", 20), _move("BM2", "B1", 5, src="L1", dest="MAIN_WH")],
+    )
+    assert [r["status"] for r in results] == ["created", "created"]
+    assert stock(seeded, "B1", "MAIN_WH") == 75
+    assert stock(seeded, "B1") == 25
+
+
+def test_bulk_rolls_back_when_stock_was_taken_after_checks(seeded, monkeypatch):
+    real_load = main._load_stock_rows
+
+    def stale_snapshot(db, keys):
+        rows = real_load(db, keys)
+        # another writer empties B2 at the warehouse after the snapshot
+        db.execute(
+            main.CurrentStock.__table__.update()
+            .where(main.CurrentStock.batch_id == "B2")
+            .values(quantity=0)
+        )
+        db.commit()
+        return rows
+
+    monkeypatch.setattr(main, "_load_stock_rows", stale_snapshot)
+    with pytest.raises(main.InsufficientStockError):
+        main.create_movements_bulk(
+            seeded, [_move("BM3", "B1", 20), _move("BM4", "B2", 30)]
+        )
+    assert stock(seeded, "B1", "MAIN_WH") == 90
+    assert stock(seeded, "B2", "MAIN_WH") == 0
+    assert seeded.get(main.StockMovement, "BM3") is None
@@ -0,0 +1,54 @@
+import io
+from datetime import date
+
+import pytest
+
+import main
+
+
+def _store_units(heatmap, store_id="S1", product_id="P1"):
+    row = heatmap["rows"].index(store_id)
+    col = heatmap["columns"].index(product_id)
+    return heatmap["values"][row * len(heatmap["columns"]) + col]
+
+
+def test_heatmap_sees_writes_from_other_sessions(seeded):
+    assert _store_units(main.get_stock_heatmap(seeded)) == 15
+    # a write that skips bump_table_versions, as another worker's would
+    with main.SessionLocal() as other:
+        other.execute(
+            main.CurrentStock.__table__.update()
+            .where(main.CurrentStock.location_id == "L1")
+            .values(quantity=1)
+        )
+        other.commit()
+    assert _store_units(main.get_stock_heatmap(seeded)) == 2
+
+
+def test_forecast_cache_is_bounded_to_known_methods(seeded):
+    main.get_reorder_forecast(seeded, "sma")
+    with pytest.raises(ValueError):
+        main.get_reorder_forecast(seeded, "made-up")
+    assert set(main._forecast_cache) <= set(main.FORECAST_METHODS)
+
+
+def test_sales_import_warms_forecast_after_responding(seeded, client, monkeypatch):
+    computed = []
+    compute = main.compute_reorder_forecast
+
+    def counting(db, method):
+        computed.append(method)
+        return compute(db, method)
+
+    monkeypatch.setattr(main, "compute_reorder_forecast", counting)
+    header = "sale_id,sale_date,store_id,product_id,batch_id,quantity_sold\n"
+    today = date.today().isoformat()
+
+    main.import_sales_csv(seeded, io.StringIO(f"{header}F1,{today},S1,P1,B1,1\n"))
+    assert computed == []
+
+    resp = client.post(
+        "/retail-sales/import", content=f"{header}F2,{today},S1,P1,B1,1\n"
+    )
+    assert resp.json()["imported"] == 1
+    assert computed == ["ewma"]
@@ -0,0 +1,72 @@
+from datetime import date, timedelta
+
+import pytest
+
+import main
+
+
+def test_etag_changes_after_write_outside_service_functions(seeded, client):
+    first = client.get("/products")
+    etag = first.headers["ETag"]
+    assert client.get("/products", headers={"If-None-Match": etag}).status_code == 304
+
+    # e.g. another worker or a CLI command: no in-process bump_table_versions
+    with main.SessionLocal() as other:
+        other.add(
+            main.Product(
+                product_id="P2",
+                product_name="Ragi",
+                unit_of_measure="kg",
+                standard_pack_size=1,
+            )
+        )
+        other.commit()
+
+    resp = client.get("/products", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+    assert resp.headers["ETag"] != etag
+
+
+def test_rolled_back_write_keeps_etag(seeded, client):
+    etag = client.get("/products").headers["ETag"]
+    with main.SessionLocal() as other:
+        other.add(
+            main.Product(
+                product_id="P3",
+                product_name="Jowar",
+                unit_of_measure="kg",
+                standard_pack_size=1,
+            )
+        )
+        other.flush()
+        other.rollback()
+    assert client.get("/products", headers={"If-None-Match": etag}).status_code == 304
+
+
+class _Tomorrow(date):
+    @classmethod
+    def today(cls):
+        return date.today() + timedelta(days=1)
+
+
+def test_expiry_status_etag_changes_with_the_date(seeded, client, monkeypatch):
+    etag = client.get("/expiring-stock/batches").headers["ETag"]
+    monkeypatch.setattr(main, "date", _Tomorrow)
+    resp = client.get("/expiring-stock/batches", headers={"If-None-Match": etag})
+    assert resp.status_code == 200
+
+
+@pytest.mark.parametrize(
+    "url", ["/products", "/locations", "/retail-partners", "/warehouse-stock/summary"]
+)
+def test_async_routes_check_etags_without_a_sync_session(seeded, client, url):
+    def no_sync_session():
+        raise AssertionError("async route opened a sync session")
+        yield
+
+    main.app.dependency_overrides[main.get_db] = no_sync_session
+    try:
+        etag = client.get(url).headers["ETag"]
+        assert client.get(url, headers={"If-None-Match": etag}).status_code == 304
+    finally:
+        main.app.dependency_overrides.pop(main.get_db)
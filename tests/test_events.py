@@ -0,0 +1,110 @@
+import asyncio
+import json
+from datetime import date
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """Events handed to subscribers, with the stock_movements count another
+    connection could see at that moment."""
+    seen = []
+
+    def record(events):
+        with main.engine.connect() as conn:
+            visible = conn.exec_driver_sql(
+                "SELECT COUNT(*) FROM stock_movements"
+            ).scalar()
+        seen.extend((event_type, rows, visible) for event_type, rows, _ in events)
+
+    monkeypatch.setattr(main, "_subscribers", {object()})
+    monkeypatch.setattr(main, "publish_events", record)
+    return seen
+
+
+def _movement(movement_id, quantity=1):
+    return {
+        "movement_id": movement_id,
+        "product_id": "P1",
+        "batch_id": "B1",
+        "movement_date": date.today(),
+        "movement_type": "Dispatch",
+        "source_location_id": "MAIN_WH",
+        "destination_location_id": "L1",
+        "quantity": quantity,
+    }
+
+
+def test_pipeline_window_publishes_after_it_commits(seeded, published):
+    def good(db):
+        return main._movement_changes(db, _movement("M3"))
+
+    def bad(db):
+        main._movement_changes(db, _movement("M4", quantity=10**6))
+
+    outcomes = main.write_pipeline._apply_once(
+        seeded, [(good, (), None), (bad, (), None)]
+    )
+
+    assert outcomes[0][1] is None
+    assert isinstance(outcomes[1][1], main.InsufficientStockError)
+    movements = [(rows, visible) for t, rows, visible in published if t == "movement"]
+    # only the unit that succeeded, and only once its rows were visible
+    assert [[row["movement_id"] for row in rows] for rows, _ in movements] == [["M3"]]
+    assert movements[0][1] == 3
+
+
+def test_savepoints_neither_publish_nor_drop_other_events(db, published):
+    main.queue_event(db, "stock", [{"n": 1}], [("L1",)])
+    with db.begin_nested():
+        main.queue_event(db, "stock", [{"n": 2}], [("L1",)])
+    savepoint = db.begin_nested()
+    main.queue_event(db, "stock", [{"n": 3}], [("L1",)])
+    savepoint.rollback()
+    assert published == []
+
+    db.commit()
+    assert [rows for _, rows, _ in published] == [[{"n": 1}], [{"n": 2}]]
+
+
+def test_outer_rollback_drops_events_of_released_savepoints(db, published):
+    with db.begin_nested():
+        main.queue_event(db, "stock", [{"n": 1}], [("L1",)])
+    db.rollback()
+    db.commit()
+    assert published == []
+
+
+def _drain(queue) -> dict[str, list]:
+    received = {}
+    while not queue.empty():
+        message = queue.get_nowait().strip()
+        lines = dict(line.split(": ", 1) for line in message.splitlines())
+        received[lines["event"]] = json.loads(lines["data"])["rows"]
+    return received
+
+
+def test_subscribers_receive_committed_rows_for_their_location(seeded):
+    async def scenario():
+        subscribers = [main.subscribe_events(loc) for loc in (None, "L1", "L2")]
+        try:
+            await asyncio.to_thread(main.record_movement, seeded, _movement("M3"))
+            await asyncio.sleep(0)
+            return [_drain(s.queue) for s in subscribers]
+        finally:
+            for subscriber in subscribers:
+                main.unsubscribe_events(subscriber)
+
+    everything, store, other = asyncio.run(scenario())
+    assert [row["movement_id"] for row in everything["movement"]] == ["M3"]
+    assert {row["location_id"] for row in everything["stock"]} == {"MAIN_WH", "L1"}
+    assert [row["movement_id"] for row in store["movement"]] == ["M3"]
+    assert {row["location_id"] for row in store["stock"]} == {"L1"}
+    assert other == {}
+
+
+def test_events_stream_requires_a_session(client):
+    assert client.get("/events", auth=None).status_code == 401
@@ -0,0 +1,65 @@
+from datetime import date, timedelta
+
+import main
+
+
+def _batch(db, batch_id, days):
+    today = date.today()
+    main.create_batch(
+        db,
+        {
+            "batch_id": batch_id,
+            "date_manufactured": today - timedelta(days=200),
+            "expiry_date": today + timedelta(days=days),
+        },
+        [{"product_id": "P1", "quantity_produced": 7}],
+    )
+
+
+def test_window_includes_expired_stock_soonest_first(seeded, client):
+    _batch(seeded, "OLD", -1)
+    _batch(seeded, "SOON", 10)
+    rows = client.get("/expiring-stock?days=30").json()
+    assert [(r["batch_id"], r["status"]) for r in rows] == [
+        ("OLD", "red"),
+        ("SOON", "yellow"),
+    ]
+    assert rows[0]["product_name"] == "Millet"
+    assert rows[0]["units_available"] == 7
+
+    wider = client.get("/expiring-stock?days=90").json()
+    assert [(r["batch_id"], r["location_id"], r["status"]) for r in wider][2:] == [
+        ("B1", "L1", "green"),
+        ("B1", "MAIN_WH", "green"),
+    ]
+    assert client.get("/expiring-stock/summary?days=90").json() == {
+        "days": 90,
+        "units": 114,
+    }
+
+
+def test_location_filter_and_limit(seeded, client):
+    rows = client.get("/expiring-stock?days=365&location_id=L1").json()
+    assert [(r["batch_id"], r["units_available"]) for r in rows] == [
+        ("B1", 10),
+        ("B2", 5),
+    ]
+    assert len(client.get("/expiring-stock?days=365&limit=1").json()) == 1
+
+
+def test_stock_that_leaves_a_location_drops_out(seeded, client):
+    main.record_movement(
+        seeded,
+        {
+            "movement_id": "M3",
+            "product_id": "P1",
+            "batch_id": "B1",
+            "movement_date": date.today(),
+            "movement_type": "Dispatch",
+            "source_location_id": "MAIN_WH",
+            "destination_location_id": "L1",
+            "quantity": 90,
+        },
+    )
+    rows = client.get("/expiring-stock?days=90").json()
+    assert [(r["location_id"], r["units_available"]) for r in rows] == [("L1", 100)]
@@ -0,0 +1,32 @@
+from datetime import date
+
+import main
+from conftest import stock
+
+
+def test_split_movement_id_collision_returns_409(seeded, client):
+    seeded.add(
+        main.StockMovement(
+            movement_id="D1-2",
+            product_id="P1",
+            batch_id="B2",
+            movement_date=date.today(),
+            movement_type="Adjustment",
+            quantity=1,
+        )
+    )
+    seeded.commit()
+    resp = client.post(
+        "/stock-movements",
+        json={
+            "movement_id": "D1",
+            "product_id": "P1",
+            "movement_type": "Dispatch",
+            "source_location_id": "L1",
+            "destination_location_id": "MAIN_WH",
+            "quantity": 12,
+        },
+    )
+    assert resp.status_code == 409
+    assert "D1-2" in resp.json()["detail"]
+    assert stock(seeded, "B1") == 10
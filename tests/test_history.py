@@ -0,0 +1,37 @@
+from datetime import date
+
+import main
+
+
+def _sell(db, sale_id, quantity, price=None):
+    main.create_retail_sale(
+        db,
+        {
+            "sale_id": sale_id,
+            "sale_date": date.today(),
+            "store_id": "S1",
+            "product_id": "P1",
+            "batch_id": "B1",
+            "quantity_sold": quantity,
+            "sale_price_per_unit": price,
+        },
+    )
+
+
+def test_sales_history_pages_and_supports_columnar(seeded, client):
+    _sell(seeded, "S-1", 1, 12.5)
+    _sell(seeded, "S-2", 2)
+
+    first = client.get("/retail-sales/history", params={"limit": 1})
+    assert [s["sale_id"] for s in first.json()] == ["S-2"]
+    rest = client.get(
+        "/retail-sales/history",
+        params={"limit": 1, "cursor": first.headers["X-Next-Cursor"]},
+    )
+    assert rest.json()[0]["sale_price_per_unit"] == 12.5
+
+    columnar = client.get("/retail-sales/history", params={"format": "columnar"})
+    body = columnar.json()
+    assert body["sale_id"] == ["S-2", "S-1"]
+    assert body["quantity_sold"] == [2, 1]
+    assert body["sale_date"] == [date.today().isoformat()] * 2
@@ -0,0 +1,57 @@
+import main
+
+
+def test_scraper_token_reads_metrics_without_a_user(client, monkeypatch):
+    monkeypatch.setattr(main, "METRICS_TOKEN", "scrape-secret")
+
+    def scrape(headers):
+        return client.get("/metrics", headers=headers, auth=None)
+
+    assert scrape({"Authorization": "Bearer scrape-secret"}).status_code == 200
+    assert scrape({"Authorization": "Bearer wrong"}).status_code == 401
+    assert scrape({}).status_code == 401
+    # user logins keep working
+    assert client.get("/metrics").status_code == 200
+
+
+def _samples(client):
+    """Metric lines keyed by name plus labels."""
+    text = client.get("/metrics").text
+    return dict(
+        line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#")
+    )
+
+
+def test_requests_are_recorded_per_route_template(seeded, client):
+    route = 'method="GET",route="/dashboard/store/{store_id}"'
+    before = _samples(client)
+    client.get("/dashboard/store/S1")
+    client.get("/dashboard/store/NOPE")
+    after = _samples(client)
+
+    def delta(key):
+        return float(after[key]) - float(before.get(key, 0))
+
+    assert delta(f'arivu_http_requests_total{{{route},status="200"}}') == 1
+    assert delta(f'arivu_http_requests_total{{{route},status="404"}}') == 1
+    assert delta(f"arivu_http_request_duration_seconds_count{{{route}}}") == 2
+    assert (
+        delta(f'arivu_http_request_duration_seconds_bucket{{{route},le="+Inf"}}') == 2
+    )
+    assert delta(f"arivu_http_request_sql_statements_total{{{route}}}") > 0
+    assert after[f"arivu_http_requests_in_flight{{{route}}}"] == "0"
+    # raw paths never become labels
+    assert not any("/dashboard/store/S1" in key for key in after)
+
+
+def test_buckets_are_cumulative(seeded, client):
+    client.get("/products")
+    samples = _samples(client)
+    prefix = (
+        'arivu_http_request_duration_seconds_bucket{method="GET",route="/products",le='
+    )
+    counts = [int(v) for k, v in samples.items() if k.startswith(prefix)]
+    assert len(counts) == len(main.METRICS_BUCKETS) + 1
+    assert counts == sorted(counts)
+    assert "arivu_write_pipeline_writes_total" in samples
+    assert 'arivu_reference_cache_hits_total{cache="product_list"}' in samples
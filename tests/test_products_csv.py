@@ -0,0 +1,28 @@
+from pathlib import Path
+
+import main
+
+CSV = (
+    "Product Name,Quantity,measurement,Price (₹)\n"
+    "Ragi Flour,500,g,120\n"
+    "Broken Row,lots,g,50\n"
+    ",1,kg,10\n"
+    "Jowar Flakes,1,kg,\n"
+)
+
+
+def test_sample_load_keeps_valid_rows_when_one_is_bad(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, "DB_FILE", tmp_path / "sample.db")
+    Path("products.csv").write_text(CSV, encoding="utf-8")
+    main.create_tables()
+
+    main.load_sample_products()
+
+    conn = main.sqlite3.connect(main.DB_FILE)
+    names = [n for (n,) in conn.execute("SELECT product_name FROM products")]
+    conn.close()
+    assert sorted(names) == ["Jowar Flakes", "Ragi Flour"]
+    out = capsys.readouterr().out
+    assert "Skipping Broken Row" in out
+    assert "Loaded 2 sample products" in out
@@ -0,0 +1,79 @@
+"""Query budgets for hot routes; a new per-row query fails these."""
+
+from datetime import date, timedelta
+
+import pytest
+
+import main
+
+HOT_ROUTES = [
+    ("/dashboard/arivu/bootstrap", 7),
+    ("/dashboard/store/S1/bootstrap", 3),
+    ("/dashboard/arivu", 5),
+    ("/products", 1),
+    ("/alerts", 1),
+]
+
+
+@pytest.mark.parametrize("url,limit", HOT_ROUTES)
+def test_hot_route_query_budget(seeded, client, url, limit):
+    client.get(url)  # warm the reference caches
+    with main.assert_max_queries(limit):
+        assert client.get(url).status_code == 200
+
+
+def test_bootstrap_budget_does_not_grow_with_batches(seeded, client):
+    for n in range(10):
+        main.create_batch(
+            seeded,
+            {
+                "batch_id": f"X{n}",
+                "date_manufactured": date.today(),
+                "expiry_date": date.today() + timedelta(days=30 + n),
+            },
+            [{"product_id": "P1", "quantity_produced": 10}],
+        )
+    client.get("/dashboard/arivu/bootstrap")
+    with main.assert_max_queries(7):
+        client.get("/dashboard/arivu/bootstrap")
+
+
+def _token(client, username="tester", password="pw"):
+    resp = client.post("/login", json={"username": username, "password": password})
+    return resp.json()["access_token"]
+
+
+def test_profile_header_needs_an_arivu_session(seeded, client, monkeypatch):
+    monkeypatch.setattr(main, "QUERY_PROFILE", "header")
+    anonymous = client.get("/locations", headers={"X-Query-Profile": "1"}, auth=None)
+    assert "x-query-count" not in anonymous.headers
+    basic = client.get("/products", headers={"X-Query-Profile": "1"})
+    assert "x-query-count" not in basic.headers
+
+    token = _token(client)
+    profiled = client.get(
+        "/products",
+        headers={"X-Query-Profile": "1", "Authorization": f"Bearer {token}"},
+        auth=None,
+    )
+    assert profiled.headers["x-query-count"] == "1"
+
+
+def test_profiling_is_off_by_default(seeded, client):
+    token = _token(client)
+    resp = client.get(
+        "/products",
+        headers={"X-Query-Profile": "1", "Authorization": f"Bearer {token}"},
+        auth=None,
+    )
+    assert "x-query-count" not in resp.headers
+
+
+def test_profile_log_rotates(tmp_path, monkeypatch):
+    log = tmp_path / "profile.jsonl"
+    monkeypatch.setattr(main, "QUERY_PROFILE_LOG", str(log))
+    monkeypatch.setattr(main, "QUERY_PROFILE_LOG_MAX_BYTES", 100)
+    for n in range(5):
+        main.write_query_profile({"n": n, "pad": "x" * 40})
+    assert log.stat().st_size < 200
+    assert (tmp_path / "profile.jsonl.1").exists()
@@ -0,0 +1,39 @@
+import main
+
+
+def test_no_full_scans_outside_reference_tables():
+    assert main.check_query_plans() == []
+
+
+def test_stock_movements_pages_instead_of_dumping_the_log(seeded, client):
+    first = client.get("/stock-movements", params={"limit": 1})
+    assert first.status_code == 200
+    assert [m["movement_id"] for m in first.json()] == ["M2"]
+
+    cursor = first.headers["X-Next-Cursor"]
+    rest = client.get("/stock-movements", params={"limit": 1, "cursor": cursor})
+    assert [m["movement_id"] for m in rest.json()] == ["M1"]
+
+
+def test_covering_index_scans_count_as_full_scans(monkeypatch):
+    calendar, sales = main.ExpiryCalendar, main.RetailSale
+
+    def probes(db):
+        return [
+            ("covering", lambda: db.query(calendar.expiry_date).all()),
+            (
+                "page",
+                lambda: db.query(sales)
+                .order_by(sales.sale_date.desc(), sales.sale_id.desc())
+                .limit(5)
+                .all(),
+            ),
+            (
+                "sorted_page",
+                lambda: db.query(sales).order_by(sales.quantity_sold).limit(5).all(),
+            ),
+        ]
+
+    monkeypatch.setattr(main, "_query_plan_cases", probes)
+    flagged = [v.split(":")[0] for v in main.check_query_plans()]
+    assert flagged == ["covering", "sorted_page"]
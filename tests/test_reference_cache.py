@@ -0,0 +1,58 @@
+import main
+
+
+def _stats(name):
+    return main.reference_cache_stats()[name]
+
+
+def test_product_list_is_served_from_cache_until_a_write(seeded):
+    before = _stats("product_list")
+    first = main.get_product_refs(seeded)
+    with main.assert_max_queries(0):
+        assert main.get_product_refs(seeded) is first
+    assert _stats("product_list")["hits"] == before["hits"] + 1
+
+    main.create_product(
+        seeded,
+        {
+            "product_id": "P2",
+            "product_name": "Ragi",
+            "unit_of_measure": "kg",
+            "standard_pack_size": 1,
+        },
+    )
+    assert _stats("product_list")["invalidations"] > before["invalidations"]
+    assert [p.product_id for p in main.get_product_refs(seeded)] == ["P1", "P2"]
+
+
+def test_new_partner_is_visible_to_store_routes(seeded, client):
+    assert client.get("/dashboard/store/S2").status_code == 404
+    main.create_retail_partner(
+        seeded, {"store_id": "S2", "location_id": "L1", "store_name": "Second"}
+    )
+    assert client.get("/dashboard/store/S2").status_code == 200
+    assert [p["store_id"] for p in client.get("/retail-partners").json()] == [
+        "S1",
+        "S2",
+    ]
+
+
+def test_new_user_can_log_in_after_a_failed_lookup(db, client):
+    headers = {"Authorization": "Basic bmV3Ym9keTpwdw=="}  # newbody:pw
+    assert client.get("/dashboard/arivu", headers=headers, auth=None).status_code == 401
+    main.create_user(
+        db,
+        {
+            "username": "newbody",
+            "password": main.hashlib.sha256(b"pw").hexdigest(),
+            "role": "arivu",
+        },
+    )
+    assert client.get("/dashboard/arivu", headers=headers, auth=None).status_code == 200
+
+
+def test_cache_stats_route(seeded, client):
+    client.get("/locations")
+    stats = client.get("/reference-cache/stats").json()
+    assert set(stats) >= {"product_list", "location_list", "partners", "users"}
+    assert stats["location_list"]["tables"] == ["locations"]
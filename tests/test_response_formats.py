@@ -0,0 +1,53 @@
+"""Columnar payloads and gzip for the list endpoints."""
+
+from datetime import date, timedelta
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("url", ["/batches", "/stock-movements", "/warehouse-stock"])
+def test_columnar_matches_rows(seeded, client, url):
+    rows = client.get(url).json()
+    columns = client.get(url, params={"format": "columnar"}).json()
+    assert list(columns) == list(rows[0])
+    assert [dict(zip(columns, values)) for values in zip(*columns.values())] == rows
+
+
+def test_empty_columnar_keeps_every_field(db, client):
+    assert client.get("/stock-movements?format=columnar").json() == {
+        field: [] for field in main.MOVEMENT_FIELDS
+    }
+
+
+def test_unknown_format_is_rejected(seeded, client):
+    assert client.get("/batches?format=xml").status_code == 422
+
+
+def test_columnar_keeps_etag_and_cursor(seeded, client):
+    resp = client.get("/batches", params={"format": "columnar", "limit": 1})
+    assert resp.headers["ETag"]
+    assert resp.headers[main.NEXT_CURSOR_HEADER]
+    assert len(resp.json()["batch_id"]) == 1
+
+
+def test_large_bodies_are_gzipped(seeded, client):
+    today = date.today()
+    for n in range(40):
+        main.create_batch(
+            seeded,
+            {
+                "batch_id": f"G{n:02d}",
+                "date_manufactured": today,
+                "expiry_date": today + timedelta(days=90),
+            },
+            [{"product_id": "P1", "quantity_produced": 10}],
+        )
+    resp = client.get("/batches", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert len(resp.json()) == 42
+
+    small = client.get("/products", headers={"Accept-Encoding": "gzip"})
+    assert len(small.content) < main.GZIP_MIN_BYTES
+    assert "Content-Encoding" not in small.headers
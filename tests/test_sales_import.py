@@ -0,0 +1,81 @@
+import io
+import sqlite3
+from datetime import date
+
+import main
+from conftest import stock
+
+HEADER = "sale_id,sale_date,store_id,product_id,batch_id,quantity_sold\n"
+
+
+def _import(db, *rows):
+    return main.import_sales_csv(db, io.StringIO(HEADER + "".join(rows)))
+
+
+def test_import_rejects_sale_larger_than_stock(seeded):
+    today = date.today().isoformat()
+    report = _import(
+        seeded,
+        f"X1,{today},S1,P1,B1,500\n",
+        f"X2,{today},S1,P1,B1,3\n",
+    )
+    assert report["imported"] == 1
+    assert report["rejected"] == 1
+    assert report["errors"][0]["line"] == 2
+    assert "Insufficient stock" in report["errors"][0]["detail"]
+    assert stock(seeded, "B1") == 7
+    assert seeded.get(main.RetailSale, "X1") is None
+
+
+def test_import_allocates_batchless_sales_fefo(seeded):
+    today = date.today().isoformat()
+    report = _import(
+        seeded,
+        f"Y1,{today},S1,P1,,12\n",
+        f"Y2,{today},S1,P1,,4\n",
+    )
+    assert report == {"imported": 1, "rejected": 1, "errors": report["errors"]}
+    assert "Insufficient stock" in report["errors"][0]["detail"]
+    # B1 expires first and is used up before B2
+    assert stock(seeded, "B1") == 0
+    assert stock(seeded, "B2") == 3
+    sold = {
+        s.batch_id: s.quantity_sold
+        for s in seeded.query(main.RetailSale).filter(
+            main.RetailSale.sale_id.like("Y1%")
+        )
+    }
+    assert sold == {"B1": 10, "B2": 2}
+
+
+def test_split_sale_id_taken_by_client_is_rejected(seeded):
+    today = date.today().isoformat()
+    report = _import(
+        seeded,
+        f"Z1-2,{today},S1,P1,B2,1\n",
+        f"Z1,{today},S1,P1,,12\n",
+    )
+    assert report["imported"] == 1
+    assert report["errors"][0]["detail"] == "ID already exists: Z1-2"
+    assert stock(seeded, "B1") == 10
+
+
+def test_chunk_retried_after_lock_error_takes_stock_once(seeded, monkeypatch):
+    invalidate = main.invalidate_stock_snapshots
+    calls = []
+
+    def locked_once(db, since):
+        calls.append(since)
+        if len(calls) == 1:
+            raise main.OperationalError(
+                "UPDATE", {}, sqlite3.OperationalError("database is locked")
+            )
+        return invalidate(db, since)
+
+    monkeypatch.setattr(main, "invalidate_stock_snapshots", locked_once)
+    monkeypatch.setattr(main, "STOCK_RETRY_BASE_DELAY", 0)
+    report = _import(seeded, f"Z1,{date.today()},S1,P1,B1,3\n")
+    assert report["imported"] == 1
+    assert len(calls) == 2
+    assert stock(seeded, "B1") == 7
+    assert seeded.query(main.RetailSale).filter_by(sale_id="Z1").count() == 1
@@ -0,0 +1,39 @@
+import time
+
+import main
+
+
+def login(client):
+    resp = client.post("/login", json={"username": "tester", "password": "pw"})
+    return resp.json()["access_token"]
+
+
+def test_full_denylist_refuses_logout_instead_of_unrevoking(client, monkeypatch):
+    monkeypatch.setattr(main, "REVOKED_TOKENS_MAX", 2)
+    monkeypatch.setattr(main, "_revoked_tokens", {})
+    first, second, third = login(client), login(client), login(client)
+    for token in (first, second):
+        resp = client.post(
+            "/logout", headers={"Authorization": f"Bearer {token}"}, auth=None
+        )
+        assert resp.status_code == 200
+
+    resp = client.post(
+        "/logout", headers={"Authorization": f"Bearer {third}"}, auth=None
+    )
+    assert resp.status_code == 503
+    assert int(resp.headers["Retry-After"]) > 0
+    assert main.decode_session_token(first) is None
+    assert main.decode_session_token(second) is None
+    assert main.decode_session_token(third) is not None
+
+
+def test_expired_entries_make_room(client, monkeypatch):
+    monkeypatch.setattr(main, "REVOKED_TOKENS_MAX", 1)
+    monkeypatch.setattr(main, "_revoked_tokens", {"old": time.time() - 1})
+    token = login(client)
+    resp = client.post(
+        "/logout", headers={"Authorization": f"Bearer {token}"}, auth=None
+    )
+    assert resp.status_code == 200
+    assert "old" not in main._revoked_tokens
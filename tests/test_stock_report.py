@@ -0,0 +1,60 @@
+import io
+from datetime import date
+
+import main
+
+
+def _current_stock(db):
+    return {
+        (r.product_id, r.batch_id, r.location_id): r.quantity
+        for r in db.query(main.CurrentStock)
+        if r.quantity
+    }
+
+
+def test_report_matches_current_stock_after_imports(seeded, client):
+    today = date.today().isoformat()
+    csv_text = (
+        "sale_id,sale_date,store_id,product_id,batch_id,quantity_sold\n"
+        f"R1,{today},S1,P1,B1,500\n"
+        f"R2,{today},S1,P1,B1,3\n"
+        f"R3,{today},S1,P1,,9\n"
+        f"R4,{today},S1,P1,,100\n"
+    )
+    report = main.import_sales_csv(seeded, io.StringIO(csv_text))
+    assert report["imported"] == 2
+    resp = client.post(
+        "/stock-movements",
+        json={
+            "movement_id": "D1",
+            "product_id": "P1",
+            "movement_type": "Dispatch",
+            "source_location_id": "MAIN_WH",
+            "destination_location_id": "L1",
+            "quantity": 95,
+        },
+    )
+    assert resp.status_code == 201
+
+    resp = client.get("/reports/stock", params={"as_of": today})
+    assert resp.status_code == 200
+    rows = {
+        (r["product_id"], r["batch_id"], r["location_id"]): r["quantity"]
+        for r in resp.json()["rows"]
+    }
+    seeded.expire_all()
+    assert rows == _current_stock(seeded)
+    assert all(qty > 0 for qty in rows.values())
+
+
+def test_report_does_not_write_snapshots(seeded, client):
+    resp = client.get("/reports/stock", params={"as_of": "2030-01-31"})
+    assert resp.status_code == 200
+    assert seeded.query(main.StockSnapshotPeriod).count() == 0
+
+
+def test_snapshot_is_written_once(seeded):
+    day = date.today()
+    assert main.create_stock_snapshot(seeded, day) > 0
+    assert main.create_stock_snapshot(seeded, day) == 0
+    assert seeded.query(main.StockSnapshotPeriod).count() == 1
@@ -0,0 +1,75 @@
+import threading
+from datetime import date
+
+import pytest
+
+import main
+from conftest import stock
+
+
+@pytest.fixture
+def pipeline():
+    group = main.WritePipeline(main.SessionLocal, batch_size=8, latency_ms=200)
+    yield group
+    group.close()
+
+
+def _dispatch(movement_id, quantity):
+    def work(db):
+        main._movement_changes(
+            db,
+            {
+                "movement_id": movement_id,
+                "product_id": "P1",
+                "batch_id": "B1",
+                "movement_date": date.today(),
+                "movement_type": "Dispatch",
+                "source_location_id": "MAIN_WH",
+                "destination_location_id": "L1",
+                "quantity": quantity,
+            },
+        )
+        return movement_id
+
+    return work
+
+
+def test_concurrent_writes_share_a_commit_and_fail_alone(seeded, pipeline):
+    results = {}
+
+    def submit(movement_id, quantity):
+        try:
+            results[movement_id] = pipeline.submit(
+                _dispatch(movement_id, quantity), ("stock_movements",)
+            )
+        except Exception as exc:
+            results[movement_id] = exc
+
+    threads = [
+        threading.Thread(target=submit, args=(f"W{n}", 10**6 if n == 2 else 1))
+        for n in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert isinstance(results.pop("W2"), main.InsufficientStockError)
+    assert results == {f"W{n}": f"W{n}" for n in (0, 1, 3, 4)}
+    # the failed unit's savepoint rolled back without touching the others
+    assert stock(seeded, "B1") == 14
+    assert stock(seeded, "B1", "MAIN_WH") == 86
+    stats = pipeline.stats()
+    assert (stats["writes"], stats["failed"]) == (4, 1)
+    assert stats["windows"] < 5
+
+
+def test_window_that_cannot_commit_fails_every_caller(seeded, pipeline, monkeypatch):
+    def broken_commit(db):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(main.Session, "commit", broken_commit)
+    with pytest.raises(RuntimeError, match="disk full"):
+        pipeline.submit(_dispatch("W9", 1))
+    monkeypatch.undo()
+    assert stock(seeded, "B1") == 10